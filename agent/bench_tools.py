@@ -0,0 +1,94 @@
+import argparse
+import time
+
+from agent.tools import (
+    AddCellAction,
+    DeleteCellAction,
+    JupyterCodeActionParser,
+    ModifyCellAction,
+    StopAction,
+)
+from typing import Any, Callable, List
+from utils.parsing import (
+    extract_block_from_tags,
+    extract_blocks_from_tags,
+    try_to_parse_as_int,
+)
+
+
+def legacy_parse_actions(response: str) -> List[Any]:
+    """Parsing of the previous parser, one scan per action type and sub-tag"""
+    actions: List[Any] = []
+    for entry in extract_blocks_from_tags(response, AddCellAction.name):
+        actions.append(
+            (
+                extract_block_from_tags(entry, AddCellAction.type),
+                try_to_parse_as_int(extract_block_from_tags(entry, AddCellAction.idx)),
+                extract_block_from_tags(entry, AddCellAction.content),
+            )
+        )
+    for entry in extract_blocks_from_tags(response, ModifyCellAction.name):
+        actions.append(
+            (
+                try_to_parse_as_int(
+                    extract_block_from_tags(entry, ModifyCellAction.idx)
+                ),
+                extract_block_from_tags(entry, ModifyCellAction.content),
+            )
+        )
+    for entry in extract_blocks_from_tags(response, DeleteCellAction.name):
+        actions.append(
+            try_to_parse_as_int(extract_block_from_tags(entry, DeleteCellAction.idx))
+        )
+    if extract_blocks_from_tags(response, StopAction.name):
+        actions.append(StopAction.name)
+    return actions
+
+
+def make_response(num_actions: int, cell_lines: int) -> str:
+    code = "\n".join(
+        f"value_{i} = compute({i})  # some code" for i in range(cell_lines)
+    )
+    blocks = ["Sure, here is my plan for the notebook."]
+    for i in range(num_actions):
+        if i % 3 == 0:
+            blocks.append(
+                f"<add_cell><type>code</type><idx>{i}</idx><content>\n{code}\n</content></add_cell>"
+            )
+        elif i % 3 == 1:
+            blocks.append(
+                f"<modify_cell><type>code</type><idx>{i}</idx><content>\n{code}\n</content></modify_cell>"
+            )
+        else:
+            blocks.append(f"<delete_cell><idx>{i}</idx></delete_cell>")
+    blocks.append("<stop></stop>")
+    return "\n".join(blocks)
+
+
+def bench(parse: Callable[[str], Any], response: str, repeat: int) -> float:
+    """Best time of `repeat` runs in seconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(response)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--cell-lines", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{'actions':>8} {'legacy ms':>10} {'single pass ms':>15} {'speedup':>8}")
+    for num_actions in [3, 30, 300]:
+        response = make_response(num_actions, args.cell_lines)
+        legacy = bench(legacy_parse_actions, response, args.repeat)
+        single_pass = bench(
+            JupyterCodeActionParser.parse_actions, response, args.repeat
+        )
+        print(
+            f"{num_actions:>8} {legacy * 1000:>10.3f} {single_pass * 1000:>15.3f} "
+            f"{legacy / single_pass:>7.1f}x"
+        )
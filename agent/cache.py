@@ -0,0 +1,71 @@
+import diskcache
+import hashlib
+import json
+
+from agent.models import LlmMessage, LlmMessageContentItem
+from typing import Any, Dict, List, Optional
+
+
+def _normalise_item(item: LlmMessageContentItem) -> Dict[str, Any]:
+    """Content item with image data replaced by its hash"""
+    if item["type"] != "image_url":
+        return dict(item)
+    url = item["image_url"]["url"]
+    if url.startswith("data:"):
+        url = "sha256:" + hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return {"type": "image_url", "image_url": {"url": url}}
+
+
+class LlmResponseCache:
+    """On-disk cache of LLM answers, keyed by the normalised request
+
+    Entries are evicted least-recently-used once the cache grows past
+    `size_limit` bytes and expire after `ttl` seconds. `namespace` keeps
+    the entries of e.g. different sessions apart.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        size_limit: int,
+        ttl: Optional[float] = None,
+        namespace: str = "",
+    ):
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._cache = diskcache.Cache(
+            directory,
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+
+    def get_key(self, messages: List[LlmMessage], **params: Any) -> str:
+        request = {
+            "namespace": self.namespace,
+            "params": params,
+            "messages": [
+                {
+                    "role": message.role,
+                    "content": [_normalise_item(item) for item in message.content],
+                }
+                for message in messages
+            ],
+        }
+        content = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        answer = self._cache.get(key)
+        if answer is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return answer
+
+    def set(self, key: str, answer: str):
+        self._cache.set(key, answer, expire=self.ttl)
+
+    def close(self):
+        self._cache.close()
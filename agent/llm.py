@@ -1,46 +1,280 @@
 import litellm
 import os
 
+from agent.cache import LlmResponseCache
 from agent.models import LlmMessage, LlmModel, LlmParameterConfig, LlmProviderConfig
-from litellm import completion
-from litellm.caching.caching import Cache, LiteLLMCacheType
+from agent.offline import (
+    LlmMode,
+    OfflineBackend,
+    RecordedBackend,
+    ResponseRecordings,
+    get_llm_mode,
+)
+from app.constants import (
+    LLM_CACHE_DIR,
+    LLM_CACHE_SIZE_LIMIT,
+    LLM_CACHE_TTL,
+    LLM_RECORDINGS_PATH,
+    OFFLINE_LLM_LATENCY,
+)
+from concurrent.futures import ThreadPoolExecutor
+from litellm import acompletion, completion
+from litellm.utils import supports_prompt_caching
+from pydantic import ConfigDict
 from pydantic.dataclasses import dataclass
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 litellm.suppress_debug_info = True
-litellm.cache = Cache(type=LiteLLMCacheType.DISK)
 litellm.success_callback = ["langfuse"]
 litellm.failure_callback = ["langfuse"]  # logs errors to langfuse
 
 
-@dataclass
+@dataclass(config=ConfigDict(arbitrary_types_allowed=True))
 class LlmClient:
     id: str
     provider_config: LlmProviderConfig
     parameter_config: LlmParameterConfig
+    cache: Optional[LlmResponseCache] = None
+    # token usage of the last request, None if it was answered from `cache`
+    last_usage: Optional[Dict[str, int]] = None
+    # answers requests instead of the provider, see `agent.offline`
+    backend: Optional[OfflineBackend] = None
+    # answers are recorded here if set, to be replayed by a `RecordedBackend`
+    recordings: Optional[ResponseRecordings] = None
 
-    def get_single_answer(self, messages: List[LlmMessage]) -> str:
-        full_response = completion(
-            messages=messages,
-            model=self.provider_config.model.value,
-            api_key=self.provider_config.api_key,
-            temperature=self.parameter_config.temperature,
-            max_tokens=self.parameter_config.max_tokens,
-            caching=True,
-            metadata={
+    def _get_cache_key(
+        self, messages: List[LlmMessage], temperature: float, sample: int = 0
+    ) -> Optional[str]:
+        if self.cache is None:
+            return None
+        params: Dict[str, Any] = {
+            "model": self.provider_config.model.value,
+            "temperature": temperature,
+            "max_tokens": self.parameter_config.max_tokens,
+        }
+        if sample:
+            # tells apart otherwise identical requests for several candidates
+            params["sample"] = sample
+        return self.cache.get_key(messages, **params)
+
+    def _get_request_messages(self, messages: List[LlmMessage]) -> List[Dict[str, Any]]:
+        """Messages as sent, without `cache_control` if prompt caching is off"""
+        prompt_caching = self.provider_config.prompt_caching
+        if prompt_caching is None:
+            prompt_caching = supports_prompt_caching(self.provider_config.model.value)
+        request_messages = [message.model_dump() for message in messages]
+        if not prompt_caching:
+            for message in request_messages:
+                for item in message["content"]:
+                    item.pop("cache_control", None)
+        return request_messages
+
+    @staticmethod
+    def _get_usage(usage: Any) -> Dict[str, int]:
+        details = usage.prompt_tokens_details
+        return {
+            "prompt_tokens": usage.prompt_tokens,
+            "cached_tokens": (details.cached_tokens or 0) if details else 0,
+            "completion_tokens": usage.completion_tokens,
+        }
+
+    def _get_cached_answer(self, cache_key: Optional[str]) -> Optional[str]:
+        cache = self.cache
+        if cache_key is None or cache is None:
+            return None
+        return cache.get(cache_key)
+
+    def _get_request_kwargs(
+        self,
+        messages: List[LlmMessage],
+        temperature: float,
+        metadata: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        return {
+            "messages": self._get_request_messages(messages),
+            "model": self.provider_config.model.value,
+            "api_key": self.provider_config.api_key,
+            "temperature": temperature,
+            "max_tokens": self.parameter_config.max_tokens,
+            "metadata": {
                 "session_id": self.id,
+                **(metadata or {}),
             },
+        }
+
+    def _request(self, stream: bool = False, **kwargs: Any) -> Any:
+        if stream:
+            kwargs.update(stream=True, stream_options={"include_usage": True})
+        if self.backend is not None:
+            return self.backend.completion(**kwargs)
+        return completion(**kwargs)
+
+    async def _arequest(self, **kwargs: Any) -> Any:
+        if self.backend is not None:
+            return await self.backend.acompletion(**kwargs)
+        return await acompletion(**kwargs)
+
+    def _get_answer(
+        self, full_response: Any, cache_key: Optional[str]
+    ) -> Tuple[str, Optional[Dict[str, int]]]:
+        answer = full_response["choices"][0]["message"]["content"]
+        usage = full_response.get("usage")
+        cache = self.cache
+        if cache_key is not None and cache is not None:
+            cache.set(cache_key, answer)
+        return answer, self._get_usage(usage) if usage else None
+
+    def _record_answer(self, metadata: Optional[Dict[str, Any]], answer: str):
+        if self.recordings is not None and metadata:
+            self.recordings.add(metadata, answer)
+
+    def _get_single_answer(
+        self,
+        messages: List[LlmMessage],
+        temperature: Optional[float],
+        sample: int,
+        metadata: Optional[Dict[str, Any]],
+    ) -> Tuple[str, Optional[Dict[str, int]]]:
+        if temperature is None:
+            temperature = self.parameter_config.temperature
+        cache_key = self._get_cache_key(messages, temperature, sample)
+        answer = self._get_cached_answer(cache_key)
+        usage = None
+        if answer is None:
+            full_response = self._request(
+                **self._get_request_kwargs(messages, temperature, metadata)
+            )
+            answer, usage = self._get_answer(full_response, cache_key)
+        self._record_answer(metadata, answer)
+        return answer, usage
+
+    def get_single_answer(
+        self,
+        messages: List[LlmMessage],
+        temperature: Optional[float] = None,
+        sample: int = 0,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """The complete answer
+
+        `metadata` such as the task, iteration and character of the prompt is
+        passed on to the backend and to recordings, see `agent.offline`.
+        """
+        self.last_usage = None
+        answer, self.last_usage = self._get_single_answer(
+            messages, temperature, sample, metadata
         )
-        return full_response["choices"][0]["message"]["content"]
+        return answer
+
+    async def aget_single_answer(
+        self,
+        messages: List[LlmMessage],
+        temperature: Optional[float] = None,
+        sample: int = 0,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        """`get_single_answer` without blocking the event loop"""
+        if temperature is None:
+            temperature = self.parameter_config.temperature
+        self.last_usage = None
+        cache_key = self._get_cache_key(messages, temperature, sample)
+        answer = self._get_cached_answer(cache_key)
+        if answer is None:
+            full_response = await self._arequest(
+                **self._get_request_kwargs(messages, temperature, metadata)
+            )
+            answer, self.last_usage = self._get_answer(full_response, cache_key)
+        self._record_answer(metadata, answer)
+        return answer
+
+    def get_candidate_answers(
+        self,
+        messages: List[LlmMessage],
+        n: int,
+        temperature: float,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> List[Tuple[str, Optional[Dict[str, int]]]]:
+        """`n` answers requested concurrently, each with its token usage
+
+        The first is sampled at the configured temperature, the others at
+        `temperature` to make them differ. `last_usage` is left untouched.
+        """
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [
+                executor.submit(
+                    self._get_single_answer,
+                    messages,
+                    temperature if sample else None,
+                    sample,
+                    {**metadata, "sample": sample} if metadata else None,
+                )
+                for sample in range(n)
+            ]
+            return [future.result() for future in futures]
+
+    def stream_answer(
+        self, messages: List[LlmMessage], metadata: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """Yield the answer in chunks as they are generated"""
+        self.last_usage = None
+        temperature = self.parameter_config.temperature
+        cache_key = self._get_cache_key(messages, temperature)
+        answer = self._get_cached_answer(cache_key)
+        if answer is not None:
+            self._record_answer(metadata, answer)
+            yield answer
+            return
+
+        response = self._request(
+            stream=True, **self._get_request_kwargs(messages, temperature, metadata)
+        )
+        chunks = []
+        for chunk in response:
+            if chunk.get("usage"):
+                self.last_usage = self._get_usage(chunk["usage"])
+            if not chunk["choices"]:
+                continue
+            content = chunk["choices"][0]["delta"].get("content")
+            if content:
+                chunks.append(content)
+                yield content
+        # only complete answers are cached and recorded
+        answer = "".join(chunks)
+        cache = self.cache
+        if cache_key is not None and cache is not None:
+            cache.set(cache_key, answer)
+        self._record_answer(metadata, answer)
 
 
 def get_llm_client(session_id: str) -> LlmClient:
+    """Client of the configured model, `LLM_MODE` selects offline replay"""
+    mode = get_llm_mode()
+    if mode == LlmMode.REPLAY:
+        return LlmClient(
+            id=session_id,
+            provider_config=LlmProviderConfig(
+                model=LlmModel.GEMINI_2_0_FLASH, api_key=""
+            ),
+            parameter_config=LlmParameterConfig(),
+            backend=RecordedBackend(
+                ResponseRecordings(LLM_RECORDINGS_PATH), latency=OFFLINE_LLM_LATENCY
+            ),
+        )
     return LlmClient(
         id=session_id,
         provider_config=LlmProviderConfig(
             model=LlmModel.GEMINI_2_0_FLASH, api_key=os.getenv("GEMINI_API_KEY")
         ),
         parameter_config=LlmParameterConfig(),
+        cache=LlmResponseCache(
+            LLM_CACHE_DIR,
+            LLM_CACHE_SIZE_LIMIT,
+            ttl=LLM_CACHE_TTL,
+            namespace=session_id,
+        ),
+        recordings=(
+            ResponseRecordings(LLM_RECORDINGS_PATH) if mode == LlmMode.RECORD else None
+        ),
     )
 
 
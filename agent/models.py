@@ -1,6 +1,16 @@
 from enum import Enum
 from pydantic import BaseModel
-from typing import Any, Dict, List, Literal, TypeAlias, TypedDict, Union
+from typing import (
+    Any,
+    Dict,
+    List,
+    Literal,
+    NotRequired,
+    Optional,
+    TypeAlias,
+    TypedDict,
+    Union,
+)
 
 
 # models enum
@@ -12,6 +22,10 @@ class LlmModel(Enum):
     GEMINI_1_5_FLASH_8B = "gemini/gemini-1.5-flash-8b"
 
 
+class CacheControl(TypedDict):
+    type: Literal["ephemeral"]
+
+
 class ImageUrl(TypedDict):
     url: str
 
@@ -19,11 +33,14 @@ class ImageUrl(TypedDict):
 class ImageItem(TypedDict):
     type: Literal["image_url"]
     image_url: ImageUrl
+    cache_control: NotRequired[CacheControl]
 
 
 class TextItem(TypedDict):
     type: Literal["text"]
     text: str
+    # marks the end of a prompt prefix the provider may cache
+    cache_control: NotRequired[CacheControl]
 
 
 LlmMessageContentItem: TypeAlias = Union[ImageItem, TextItem]
@@ -37,6 +54,8 @@ class LlmMessage(BaseModel):
 class LlmProviderConfig(BaseModel):
     model: LlmModel
     api_key: str
+    # send `cache_control` annotations, by default if the model supports them
+    prompt_caching: Optional[bool] = None
 
 
 class LlmParameterConfig(BaseModel):
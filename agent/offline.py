@@ -0,0 +1,210 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from abc import abstractmethod
+from agent.prompts import Character
+from agent.tokens import estimate_tokens
+from agent.tools import AddCellAction, StopAction
+from enum import Enum
+from litellm import ModelResponse
+from litellm.types.utils import ModelResponseStream, Usage
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class LlmMode(Enum):
+    LIVE = "live"
+    # live, answers are also recorded, see `ResponseRecordings`
+    RECORD = "record"
+    # only serve recorded answers, never touch the network
+    REPLAY = "replay"
+
+
+def get_llm_mode() -> LlmMode:
+    return LlmMode(os.getenv("LLM_MODE", LlmMode.LIVE.value))
+
+
+class MissingRecordedResponse(LookupError):
+    pass
+
+
+def get_recording_key(metadata: Dict[str, Any]) -> str:
+    return json.dumps(
+        [
+            metadata.get("task"),
+            metadata.get("iteration"),
+            metadata.get("character"),
+            metadata.get("sample", 0),
+        ]
+    )
+
+
+class ResponseRecordings:
+    """LLM answers by task, iteration and character, stored as JSON lines
+
+    Unlike `LlmResponseCache` the prompt is not part of the key, so a
+    recorded run can be replayed after prompt or notebook changes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._answers: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._answers[get_recording_key(record)] = record["answer"]
+
+    def __len__(self) -> int:
+        return len(self._answers)
+
+    def get(self, metadata: Dict[str, Any]) -> Optional[str]:
+        return self._answers.get(get_recording_key(metadata))
+
+    def add(self, metadata: Dict[str, Any], answer: str):
+        record = {**metadata, "answer": answer}
+        with self._lock:
+            self._answers[get_recording_key(metadata)] = answer
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+class OfflineBackend:
+    """Stand-in for litellm's `completion` that answers without network
+
+    Answers are returned after `latency` seconds. Streamed answers start after
+    `time_to_first_token` seconds and arrive in chunks of `chunk_size`
+    characters spread over the rest of the latency. Token usage is estimated.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        time_to_first_token: Optional[float] = None,
+        chunk_size: int = 64,
+    ):
+        self.latency = latency
+        self.time_to_first_token = (
+            latency / 4 if time_to_first_token is None else time_to_first_token
+        )
+        self.chunk_size = chunk_size
+
+    @abstractmethod
+    def get_answer(
+        self, messages: List[Dict[str, Any]], metadata: Dict[str, Any]
+    ) -> str:
+        pass
+
+    def _get_usage(self, messages: List[Dict[str, Any]], answer: str) -> Usage:
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        completion_tokens = estimate_tokens(answer)
+        return Usage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+    def _get_response(
+        self, messages: List[Dict[str, Any]], answer: str
+    ) -> ModelResponse:
+        return ModelResponse(
+            choices=[{"message": {"role": "assistant", "content": answer}}],
+            usage=self._get_usage(messages, answer),
+        )
+
+    def completion(
+        self,
+        messages: List[Dict[str, Any]],
+        metadata: Dict[str, Any],
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> Any:
+        answer = self.get_answer(messages, metadata)
+        if stream:
+            return self._stream(messages, answer)
+        time.sleep(self.latency)
+        return self._get_response(messages, answer)
+
+    async def acompletion(
+        self, messages: List[Dict[str, Any]], metadata: Dict[str, Any], **kwargs: Any
+    ) -> ModelResponse:
+        answer = self.get_answer(messages, metadata)
+        await asyncio.sleep(self.latency)
+        return self._get_response(messages, answer)
+
+    def _stream(
+        self, messages: List[Dict[str, Any]], answer: str
+    ) -> Iterator[ModelResponseStream]:
+        chunks = [
+            answer[idx : idx + self.chunk_size]
+            for idx in range(0, len(answer), self.chunk_size)
+        ]
+        time.sleep(self.time_to_first_token)
+        interval = max(self.latency - self.time_to_first_token, 0) / max(len(chunks), 1)
+        for idx, chunk in enumerate(chunks):
+            if idx:
+                time.sleep(interval)
+            yield ModelResponseStream(choices=[{"delta": {"content": chunk}}])
+        yield ModelResponseStream(choices=[], usage=self._get_usage(messages, answer))
+
+
+class RecordedBackend(OfflineBackend):
+    """Answers recorded by a run in `LlmMode.RECORD`"""
+
+    def __init__(self, recordings: ResponseRecordings, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.recordings = recordings
+
+    def get_answer(
+        self, messages: List[Dict[str, Any]], metadata: Dict[str, Any]
+    ) -> str:
+        answer = self.recordings.get(metadata)
+        if answer is None:
+            raise MissingRecordedResponse(
+                f"No recorded answer for {get_recording_key(metadata)}"
+            )
+        return answer
+
+
+class ScriptedBackend(OfflineBackend):
+    """Synthetic answers for benchmarks
+
+    Each of the first `turns` iterations adds `cells_per_turn` code cells
+    running `cell_code`, later iterations and critiques stop.
+    """
+
+    def __init__(
+        self,
+        cells_per_turn: int = 1,
+        turns: int = 3,
+        cell_code: str = "print(1)",
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.cells_per_turn = cells_per_turn
+        self.turns = turns
+        self.cell_code = cell_code
+
+    def get_answer(
+        self, messages: List[Dict[str, Any]], metadata: Dict[str, Any]
+    ) -> str:
+        stop = f"<{StopAction.name}></{StopAction.name}>"
+        if metadata.get("character") == Character.CRITIQUE_CODE.value:
+            return stop
+        if metadata.get("iteration", 0) > self.turns:
+            return stop
+        cell = (
+            f"<{AddCellAction.name}>"
+            f"<{AddCellAction.type}>code</{AddCellAction.type}>"
+            f"<{AddCellAction.idx}>-1</{AddCellAction.idx}>"
+            f"<{AddCellAction.content}>\n{self.cell_code}\n</{AddCellAction.content}>"
+            f"</{AddCellAction.name}>"
+        )
+        return "\n".join([cell] * self.cells_per_turn)
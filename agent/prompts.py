@@ -1,8 +1,11 @@
 from agent.models import LlmMessage, LlmMessageContentItem, TextItem
+from agent.retrieval import ApiGuide
+from agent.tokens import estimate_tokens
 from agent.tools import JupyterCodeActionParser, JupyterCritiqueActionsParser
+from app.constants import API_GUIDE_TOP_K
 from enum import Enum
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, List, Optional
 
 
 class Character(Enum):
@@ -10,7 +13,16 @@ class Character(Enum):
     CRITIQUE_CODE = "critique_code"
 
 
+def mark_cacheable(item: LlmMessageContentItem) -> LlmMessageContentItem:
+    """Copy of the item marked as the end of a cacheable prompt prefix"""
+    marked = item.copy()
+    marked["cache_control"] = {"type": "ephemeral"}
+    return marked
+
+
 class JupyterCodeAgentPrompt(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     GENERATE_CODE_SYSTEM_PROMPT: str = f"""
 Background:
     - You are a data analysis agent.
@@ -57,6 +69,14 @@ Strategies for generating actions:
     - This feedback will be used in addition to the task to improve the notebook.
 """
     ADDITIONAL_SYSTEM_PROMPT: str
+    # only the parts relevant to the task are added to generate prompts
+    api_guide: Optional[ApiGuide] = None
+    API_GUIDE_PREAMBLE: str = """
+The following are the parts of the API guide relevant to the task:
+"""
+    RELATED_API_GUIDE_PREAMBLE: str = """
+The following parts of the API guide are relevant to the current notebook:
+"""
     NOTEBOOK_STATE_PREAMBLE: str = """
 The following is the current state of the notebook:
 ```
@@ -71,6 +91,51 @@ The following is the task we need to complete:
 {task}
 """
 
+    def get_api_guide_content(
+        self, task: str, character: Character
+    ) -> List[LlmMessageContentItem]:
+        """Functions relevant to the task, the same in every iteration"""
+        if self.api_guide is None or character != Character.GENERATE_CODE:
+            return []
+        functions = self.api_guide.retrieve(task, API_GUIDE_TOP_K)
+        return [
+            TextItem(
+                type="text",
+                text=self.API_GUIDE_PREAMBLE + self.api_guide.render(functions),
+            )
+        ]
+
+    def get_related_api_guide_content(
+        self,
+        task: str,
+        notebook_state: List[LlmMessageContentItem],
+        character: Character,
+    ) -> List[LlmMessageContentItem]:
+        """Functions relevant to the notebook, not in `get_api_guide_content`"""
+        if self.api_guide is None or character != Character.GENERATE_CODE:
+            return []
+        context = " ".join(
+            item["text"] for item in notebook_state if item["type"] == "text"
+        )
+        task_functions = {
+            function.name for function in self.api_guide.retrieve(task, API_GUIDE_TOP_K)
+        }
+        functions = [
+            function
+            for function in self.api_guide.retrieve(
+                task, API_GUIDE_TOP_K, context=context
+            )
+            if function.name not in task_functions
+        ]
+        if not functions:
+            return []
+        return [
+            TextItem(
+                type="text",
+                text=self.RELATED_API_GUIDE_PREAMBLE + self.api_guide.render(functions),
+            )
+        ]
+
     def get_notebook_state_content(
         self, notebook_state: List[LlmMessageContentItem]
     ) -> List[LlmMessageContentItem]:
@@ -80,33 +145,71 @@ The following is the task we need to complete:
             + [TextItem(type="text", text=self.NOTEBOOK_STATE_POSTAMBLE)]
         )
 
+    def get_system_prompt(self, character: Character) -> List[LlmMessageContentItem]:
+        return [
+            TextItem(
+                type="text",
+                text=(
+                    self.GENERATE_CODE_SYSTEM_PROMPT
+                    if character == Character.GENERATE_CODE
+                    else self.CRITIQUE_CODE_SYSTEM_PROMPT
+                ),
+            ),
+            TextItem(type="text", text=self.ADDITIONAL_SYSTEM_PROMPT),
+        ]
+
+    def get_token_counts(
+        self,
+        task: str,
+        notebook_state: List[LlmMessageContentItem],
+        character: Character = Character.GENERATE_CODE,
+    ) -> Dict[str, int]:
+        """Estimated tokens of each component of the prompt"""
+        return {
+            "system": estimate_tokens(self.get_system_prompt(character)),
+            "api_guide": estimate_tokens(
+                self.get_api_guide_content(task, character)
+                + self.get_related_api_guide_content(task, notebook_state, character)
+            ),
+            "task": estimate_tokens(self.get_task_statement(task)),
+            "notebook": estimate_tokens(
+                self.get_notebook_state_content(notebook_state)
+            ),
+        }
+
     def forward(
         self,
         task: str,
         notebook_state: List[LlmMessageContentItem],
         character: Character = Character.GENERATE_CODE,
     ) -> List[LlmMessage]:
+        """Prompt with the content that is the same in every iteration first
+
+        Cache breakpoints mark the end of the task and of the last cell, so
+        providers with prompt caching can reuse the prefix of the previous
+        iteration, see `LlmProviderConfig.prompt_caching`.
+        """
         llm_messages = [
             LlmMessage(
                 role="system",
-                content=[
-                    TextItem(
-                        type="text",
-                        text=(
-                            self.GENERATE_CODE_SYSTEM_PROMPT
-                            if character == Character.GENERATE_CODE
-                            else self.CRITIQUE_CODE_SYSTEM_PROMPT
-                        ),
-                    ),
-                    TextItem(type="text", text=self.ADDITIONAL_SYSTEM_PROMPT),
-                ],
+                content=self.get_system_prompt(character),
             )
         ]
-        user_message_content: List[LlmMessageContentItem] = [
-            TextItem(type="text", text=self.get_task_statement(task))
-        ]
+        user_message_content = self.get_api_guide_content(task, character)
+        user_message_content.append(
+            mark_cacheable(TextItem(type="text", text=self.get_task_statement(task)))
+        )
         notebook_state_content = self.get_notebook_state_content(notebook_state)
+        # new cells are rendered after the last cell, before the closing fence
+        if len(notebook_state) > 2:
+            last_cell_idx = len(notebook_state_content) - 3
+            notebook_state_content[last_cell_idx] = mark_cacheable(
+                notebook_state_content[last_cell_idx]
+            )
         user_message_content.extend(notebook_state_content)
+        user_message_content.extend(
+            self.get_related_api_guide_content(task, notebook_state, character)
+        )
         llm_messages.append(
             LlmMessage(
                 role="user",
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import math
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+
+from collections import Counter
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+from utils.persistence import atomic_write
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "for", "from",
+    "how", "i", "in", "is", "it", "me", "my", "of", "on", "or", "the", "to",
+    "what", "with",
+}  # fmt: skip
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words, identifiers are split on `_` and plurals stripped"""
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+class ApiParam(BaseModel):
+    name: str
+    type: str
+    description: str
+
+
+class ApiFunction(BaseModel):
+    name: str
+    params: List[ApiParam]
+    returns_type: str
+    returns: str
+    description: str
+    notes: str = ""
+
+    def get_search_text(self) -> str:
+        params = " ".join(f"{p.name} {p.description}" for p in self.params)
+        return f"{self.name} {self.description} {self.returns} {params} {self.notes}"
+
+    def to_xml(self) -> str:
+        params = "".join(
+            f'\n            <param name="{p.name}" type="{p.type}">{p.description}</param>'
+            for p in self.params
+        )
+        params = f"{params}\n        " if params else ""
+        notes = f"\n        <notes>{self.notes}</notes>" if self.notes else ""
+        return f"""    <function>
+        <name>{self.name}</name>
+        <params>{params}</params>
+        <returns type="{self.returns_type}">{self.returns}</returns>
+        <description>{self.description}</description>{notes}
+    </function>"""
+
+
+class BM25:
+    """Okapi BM25 ranking over tokenized documents"""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.term_frequencies = [Counter(document) for document in documents]
+        self.lengths = [len(document) for document in documents]
+        self.average_length = sum(self.lengths) / max(len(documents), 1)
+        document_frequencies = Counter(
+            term for document in documents for term in set(document)
+        )
+        self.idf = {
+            term: math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+            for term, df in document_frequencies.items()
+        }
+
+    def get_scores(self, query: List[str]) -> List[float]:
+        scores = [0.0] * len(self.term_frequencies)
+        for term in set(query):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for idx, frequencies in enumerate(self.term_frequencies):
+                tf = frequencies.get(term)
+                if not tf:
+                    continue
+                norm = 1 - self.b + self.b * self.lengths[idx] / self.average_length
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+
+class ApiGuide:
+    """Functions of an API guide, searchable by keywords
+
+    The guide XML is parsed once and cached in `cache_dir` by content hash.
+    """
+
+    def __init__(self, name: str, description: str, functions: List[ApiFunction]):
+        self.name = name
+        self.description = description
+        self.functions = functions
+        self._index = BM25(
+            [tokenize(function.get_search_text()) for function in functions]
+        )
+
+    @staticmethod
+    def _parse_function(function: ElementTree.Element) -> Dict:
+        returns = function.find("returns")
+        return {
+            "name": function.findtext("name", ""),
+            "params": [
+                {
+                    "name": param.get("name", ""),
+                    "type": param.get("type", ""),
+                    "description": param.text or "",
+                }
+                for param in function.iter("param")
+            ],
+            "returns_type": returns.get("type", "") if returns is not None else "",
+            "returns": function.findtext("returns", ""),
+            "description": function.findtext("description", ""),
+            "notes": function.findtext("notes", ""),
+        }
+
+    @classmethod
+    def parse(cls, content: str) -> Dict:
+        root = ElementTree.fromstring(content)
+        return {
+            "name": root.findtext("name", ""),
+            "description": root.findtext("description", ""),
+            "functions": [
+                cls._parse_function(function) for function in root.iter("function")
+            ],
+        }
+
+    @classmethod
+    def load(cls, path: str, cache_dir: Optional[str] = None) -> "ApiGuide":
+        with open(path, "r") as f:
+            content = f.read()
+        cache_path = None
+        parsed = None
+        if cache_dir is not None:
+            key = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            cache_path = os.path.join(cache_dir, f"{key}.json")
+            if os.path.exists(cache_path):
+                with open(cache_path, "r") as f:
+                    parsed = json.load(f)
+        if parsed is None:
+            parsed = cls.parse(content)
+            if cache_dir is not None and cache_path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                atomic_write(cache_path, json.dumps(parsed))
+        return cls(
+            parsed["name"],
+            parsed["description"],
+            [ApiFunction(**function) for function in parsed["functions"]],
+        )
+
+    def retrieve(
+        self, query: str, k: int, context: str = "", context_weight: float = 0.5
+    ) -> List[ApiFunction]:
+        """The `k` functions most relevant to the query and optional context
+
+        Functions referenced by a retrieved function, e.g. the API method
+        whose responses a helper converts, are included as well.
+        """
+        scores = self._index.get_scores(tokenize(query))
+        if context:
+            context_scores = self._index.get_scores(tokenize(context))
+            scores = [
+                score + context_weight * context_score
+                for score, context_score in zip(scores, context_scores)
+            ]
+        ranked = sorted(range(len(scores)), key=lambda idx: -scores[idx])
+        selected = {idx for idx in ranked[:k] if scores[idx] > 0}
+        pending = list(selected)
+        while pending:
+            referenced = self.functions[pending.pop()].get_search_text()
+            for idx, function in enumerate(self.functions):
+                if idx not in selected and re.search(
+                    rf"\b{re.escape(function.name)}\b", referenced
+                ):
+                    selected.add(idx)
+                    pending.append(idx)
+        # keep the guide order, related functions are listed together
+        return [self.functions[idx] for idx in sorted(selected)]
+
+    def render(self, functions: List[ApiFunction]) -> str:
+        body = "\n\n".join(function.to_xml() for function in functions)
+        return f"""<class>
+    <name>{self.name}</name>
+    <description>{self.description}</description>
+
+{body}
+</class>"""
@@ -0,0 +1,34 @@
+from agent.cache import LlmResponseCache
+from agent.models import LlmMessage
+
+
+def make_prompt(image_url: str):
+    return [
+        LlmMessage(
+            role="user",
+            content=[
+                {"type": "text", "text": "plot my sleep"},
+                {"type": "image_url", "image_url": {"url": image_url}},
+            ],
+        )
+    ]
+
+
+def test_llm_response_cache_keys_and_counters(tmp_path):
+    cache = LlmResponseCache(str(tmp_path), size_limit=2**20, namespace="a")
+    image = "data:image/png;base64," + "A" * 10_000
+
+    key = cache.get_key(make_prompt(image), model="m", temperature=0.0)
+    # the key does not grow with the image and depends on every part of the request
+    assert key == cache.get_key(make_prompt(image), model="m", temperature=0.0)
+    assert key != cache.get_key(make_prompt(image + "B"), model="m", temperature=0.0)
+    assert key != cache.get_key(make_prompt(image), model="m", temperature=0.5)
+    other = LlmResponseCache(str(tmp_path), size_limit=2**20, namespace="b")
+    assert key != other.get_key(make_prompt(image), model="m", temperature=0.0)
+
+    assert cache.get(key) is None
+    cache.set(key, "<stop></stop>")
+    assert cache.get(key) == "<stop></stop>"
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+    other.close()
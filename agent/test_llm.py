@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import json
+import nbformat
+import pytest
+
+from agent import llm
+from agent.cache import LlmResponseCache
+from agent.llm import LlmClient
+from agent.models import LlmModel, LlmParameterConfig, LlmProviderConfig
+from agent.prompts import Character, JupyterCodeAgentPrompt
+from agent.tokens import estimate_tokens
+from agent.tools import JupyterCodeParser
+from litellm import ModelResponse
+from litellm.types.utils import (
+    ModelResponseStream,
+    PromptTokensDetailsWrapper,
+    Usage,
+)
+from typing import List, Optional, Set
+
+
+class MockPrefixCachingProvider:
+    """Stand-in for `completion` caching prompt prefixes like anthropic does
+
+    Prefixes ending at a `cache_control` block are stored, a request is
+    billed as cached up to the longest stored prefix of its blocks.
+    """
+
+    def __init__(self, answer: str = "<stop></stop>"):
+        self.answer = answer
+        self.prefixes: Set[str] = set()
+        self.temperatures: List[Optional[float]] = []
+
+    def __call__(self, messages, stream=False, temperature=None, **kwargs):
+        self.temperatures.append(temperature)
+        blocks = [
+            (message["role"], item)
+            for message in messages
+            for item in message["content"]
+        ]
+        hashes, tokens = [], [0]
+        digest = hashlib.sha256()
+        for role, item in blocks:
+            # the breakpoints are not part of the cached content
+            content = {
+                key: value for key, value in item.items() if key != "cache_control"
+            }
+            digest.update(json.dumps([role, content], sort_keys=True).encode("utf-8"))
+            hashes.append(digest.copy().hexdigest())
+            tokens.append(tokens[-1] + estimate_tokens([item]))
+        cached = max(
+            (tokens[idx + 1] for idx, key in enumerate(hashes) if key in self.prefixes),
+            default=0,
+        )
+        for idx, (_, item) in enumerate(blocks):
+            if "cache_control" in item:
+                self.prefixes.add(hashes[idx])
+        usage = Usage(
+            prompt_tokens=tokens[-1],
+            completion_tokens=estimate_tokens(self.answer),
+            total_tokens=tokens[-1] + estimate_tokens(self.answer),
+            prompt_tokens_details=PromptTokensDetailsWrapper(cached_tokens=cached),
+        )
+        if not stream:
+            return ModelResponse(
+                choices=[{"message": {"role": "assistant", "content": self.answer}}],
+                usage=usage,
+            )
+        return iter(
+            [
+                ModelResponseStream(choices=[{"delta": {"content": self.answer}}]),
+                ModelResponseStream(choices=[], usage=usage),
+            ]
+        )
+
+
+def make_client(prompt_caching: bool, cache=None) -> LlmClient:
+    return LlmClient(
+        id="test",
+        provider_config=LlmProviderConfig(
+            model=LlmModel.GEMINI_2_0_FLASH,
+            api_key="",
+            prompt_caching=prompt_caching,
+        ),
+        parameter_config=LlmParameterConfig(temperature=0.1),
+        cache=cache,
+    )
+
+
+@pytest.mark.parametrize("prompt_caching", [True, False])
+def test_prompt_prefix_is_cached_across_iterations(monkeypatch, prompt_caching):
+    provider = MockPrefixCachingProvider()
+    monkeypatch.setattr(llm, "completion", provider)
+    client = make_client(prompt_caching)
+    prompt = JupyterCodeAgentPrompt(ADDITIONAL_SYSTEM_PROMPT="")
+    notebook = nbformat.v4.new_notebook()
+    notebook.cells = [nbformat.v4.new_code_cell("x = 1  # prefix")]
+
+    first = prompt.forward("Plot my steps", JupyterCodeParser.render_notebook(notebook))
+    assert client.get_single_answer(first) == "<stop></stop>"
+    assert client.last_usage["cached_tokens"] == 0
+
+    # the next iteration appends a cell, everything up to it is cached
+    notebook.cells.append(nbformat.v4.new_code_cell("y = 2"))
+    second = prompt.forward(
+        "Plot my steps", JupyterCodeParser.render_notebook(notebook)
+    )
+    assert "".join(client.stream_answer(second)) == "<stop></stop>"
+    usage = client.last_usage
+    if prompt_caching:
+        cached_items = first[0].content + first[1].content[:-2]
+        assert usage["cached_tokens"] == estimate_tokens(cached_items)
+        assert 0 < usage["cached_tokens"] < usage["prompt_tokens"]
+    else:
+        assert usage["cached_tokens"] == 0
+
+
+def test_critique_prompt_prefix_excludes_notebook(monkeypatch):
+    provider = MockPrefixCachingProvider()
+    monkeypatch.setattr(llm, "completion", provider)
+    client = make_client(prompt_caching=True)
+    prompt = JupyterCodeAgentPrompt(ADDITIONAL_SYSTEM_PROMPT="")
+    empty = JupyterCodeParser.render_notebook(nbformat.v4.new_notebook())
+
+    client.get_single_answer(prompt.forward("Plot my steps", empty))
+    messages = prompt.forward("Plot my steps", empty, Character.CRITIQUE_CODE)
+    client.get_single_answer(messages)
+    # a different system prompt, nothing is shared
+    assert client.last_usage["cached_tokens"] == 0
+    client.get_single_answer(messages)
+    assert client.last_usage["cached_tokens"] == estimate_tokens(
+        messages[0].content + messages[1].content[:1]
+    )
+
+
+def test_candidate_answers_are_sampled_and_cached_separately(monkeypatch, tmp_path):
+    provider = MockPrefixCachingProvider()
+    monkeypatch.setattr(llm, "completion", provider)
+    cache = LlmResponseCache(str(tmp_path), size_limit=2**20)
+    client = make_client(prompt_caching=False, cache=cache)
+    messages = JupyterCodeAgentPrompt(ADDITIONAL_SYSTEM_PROMPT="").forward(
+        "Plot my steps", []
+    )
+
+    answers = client.get_candidate_answers(messages, n=3, temperature=0.7)
+    assert [answer for answer, _ in answers] == ["<stop></stop>"] * 3
+    assert all(usage["prompt_tokens"] > 0 for _, usage in answers)
+    assert sorted(provider.temperatures) == [0.1, 0.7, 0.7]
+    cached = client.get_candidate_answers(messages, n=3, temperature=0.7)
+    assert [usage for _, usage in cached] == [None] * 3
+    assert len(provider.temperatures) == 3
+    assert cache.hits == 3
+    cache.close()
+
+
+def test_async_answer_shares_cache_with_sync(monkeypatch, tmp_path):
+    provider = MockPrefixCachingProvider()
+
+    async def acompletion(**kwargs):
+        return provider(**kwargs)
+
+    monkeypatch.setattr(llm, "acompletion", acompletion)
+    cache = LlmResponseCache(str(tmp_path), size_limit=2**20)
+    client = make_client(prompt_caching=False, cache=cache)
+    messages = JupyterCodeAgentPrompt(ADDITIONAL_SYSTEM_PROMPT="").forward(
+        "Plot my steps", []
+    )
+
+    assert asyncio.run(client.aget_single_answer(messages)) == "<stop></stop>"
+    assert client.last_usage["completion_tokens"] > 0
+    assert client.get_single_answer(messages) == "<stop></stop>"
+    assert len(provider.temperatures) == 1
+    cache.close()
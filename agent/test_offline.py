@@ -0,0 +1,77 @@
+import pytest
+
+from agent import llm
+from agent.llm import LlmClient
+from agent.models import LlmModel, LlmParameterConfig, LlmProviderConfig
+from agent.offline import (
+    MissingRecordedResponse,
+    RecordedBackend,
+    ResponseRecordings,
+    ScriptedBackend,
+)
+from agent.prompts import Character, JupyterCodeAgentPrompt
+from agent.test_llm import MockPrefixCachingProvider
+from agent.tools import AddCellAction, JupyterCodeActionParser, StopAction
+
+
+def make_client(**kwargs) -> LlmClient:
+    return LlmClient(
+        id="test",
+        provider_config=LlmProviderConfig(model=LlmModel.GEMINI_2_0_FLASH, api_key=""),
+        parameter_config=LlmParameterConfig(),
+        **kwargs,
+    )
+
+
+def get_metadata(iteration: int, character: Character = Character.GENERATE_CODE):
+    return {
+        "task": "Plot my steps",
+        "iteration": iteration,
+        "character": character.value,
+    }
+
+
+def test_recorded_answers_are_replayed_regardless_of_prompt(monkeypatch, tmp_path):
+    monkeypatch.setattr(llm, "completion", MockPrefixCachingProvider("<stop></stop>"))
+    path = str(tmp_path / "recordings.jsonl")
+    prompt = JupyterCodeAgentPrompt(ADDITIONAL_SYSTEM_PROMPT="")
+    live = make_client(recordings=ResponseRecordings(path))
+    live.get_single_answer(
+        prompt.forward("Plot my steps", []), metadata=get_metadata(1)
+    )
+    assert (
+        "".join(
+            live.stream_answer(prompt.forward("Plot my steps", []), get_metadata(2))
+        )
+        == "<stop></stop>"
+    )
+
+    replay = make_client(backend=RecordedBackend(ResponseRecordings(path)))
+    other_prompt = prompt.forward("Plot my steps daily", [])
+    assert replay.get_single_answer(other_prompt, metadata=get_metadata(1)) == (
+        "<stop></stop>"
+    )
+    assert "".join(replay.stream_answer(other_prompt, get_metadata(2))) == (
+        "<stop></stop>"
+    )
+    assert replay.last_usage["prompt_tokens"] > 0
+    with pytest.raises(MissingRecordedResponse):
+        replay.get_single_answer(other_prompt, metadata=get_metadata(3))
+
+
+def test_scripted_answers_add_cells_then_stop():
+    backend = ScriptedBackend(cells_per_turn=3, turns=2, chunk_size=16)
+    client = make_client(backend=backend)
+    messages = JupyterCodeAgentPrompt(ADDITIONAL_SYSTEM_PROMPT="").forward("x", [])
+
+    chunks = list(client.stream_answer(messages, get_metadata(2)))
+    assert len(chunks) > 1
+    actions = JupyterCodeActionParser.parse_actions("".join(chunks))
+    assert [type(action) for action in actions] == [AddCellAction] * 3
+    assert all(action.cell_content.strip() == "print(1)" for action in actions)
+
+    for metadata in [get_metadata(3), get_metadata(1, Character.CRITIQUE_CODE)]:
+        actions = JupyterCodeActionParser.parse_actions(
+            client.get_single_answer(messages, metadata=metadata)
+        )
+        assert [type(action) for action in actions] == [StopAction]
@@ -0,0 +1,40 @@
+import os
+
+from agent.prompts import Character, JupyterCodeAgentPrompt
+from agent.retrieval import ApiGuide
+from app.constants import GARMIN_API_GUIDE_PATH
+
+GUIDE_PATH = os.path.join(os.path.dirname(__file__), "..", GARMIN_API_GUIDE_PATH)
+
+
+def test_api_guide_retrieves_relevant_functions(tmp_path):
+    guide = ApiGuide.load(GUIDE_PATH, cache_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+    cached = ApiGuide.load(GUIDE_PATH, cache_dir=str(tmp_path))
+    assert [f.name for f in cached.functions] == [f.name for f in guide.functions]
+
+    names = [f.name for f in guide.retrieve("Plot my sleep times for last week", 4)]
+    assert "get_sleep_data" in names
+    assert "analytics.sleep_frame" in names
+    assert "get_activities" not in names
+    # the api method a retrieved helper converts is included
+    names = [f.name for f in guide.retrieve("bicep curl reps", 3)]
+    assert {"get_activities", "get_activity_exercise_sets"} <= set(names)
+
+
+def test_prompt_includes_guide_only_for_generate():
+    guide = ApiGuide.load(GUIDE_PATH)
+    prompt = JupyterCodeAgentPrompt(ADDITIONAL_SYSTEM_PROMPT="", api_guide=guide)
+    generate = prompt.get_token_counts("Plot my steps", [], Character.GENERATE_CODE)
+    critique = prompt.get_token_counts("Plot my steps", [], Character.CRITIQUE_CODE)
+    assert 0 < generate["api_guide"] < len(guide.render(guide.functions)) // 8
+    assert critique["api_guide"] == 0
+    messages = prompt.forward("Plot my steps", [], Character.GENERATE_CODE)
+    assert "<name>get_steps_data</name>" in messages[1].content[0]["text"]
+
+
+def test_api_guide_parses_functions_without_returns():
+    parsed = ApiGuide.parse(
+        "<api><name>x</name><function><name>ping</name></function></api>"
+    )
+    assert parsed["functions"][0]["returns_type"] == ""
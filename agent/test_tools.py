@@ -0,0 +1,113 @@
+import nbformat
+
+from agent.tokens import estimate_tokens
+from agent.tools import (
+    AddCellAction,
+    DeleteCellAction,
+    JupyterCodeActionParser,
+    JupyterCodeParser,
+    JupyterCritiqueActionsParser,
+    StopAction,
+)
+from sandbox.notebook import CellType, JupyterSandbox
+
+
+def test_actions_are_applied_in_document_order():
+    response = """
+<delete_cell><idx>0</idx></delete_cell>
+<add_cell><type> code</type><idx>0</idx><content>b = 2</content></add_cell>
+<add_cell><type>code</type><idx>-1</idx><content>print("<stop></stop>")</content></add_cell>
+<modify_cell><idx>not an int</idx><content>ignored</content></modify_cell>
+<delete_cell><idx>5</idx></delete_cell>
+"""
+    actions = JupyterCodeActionParser.parse_actions(response)
+    assert [type(action) for action in actions] == [
+        DeleteCellAction,
+        AddCellAction,
+        AddCellAction,
+        DeleteCellAction,
+    ]
+
+    with JupyterSandbox() as sandbox:
+        notebook = sandbox.create_notebook()
+        sandbox.add_cell(notebook, "a = 1", CellType.CODE)
+        notebook, should_stop = JupyterCodeActionParser.response_to_actions(
+            response, sandbox, notebook
+        )
+    # the delete applies before the adds, the out of range delete is skipped
+    assert [cell.source for cell in notebook.cells] == [
+        "b = 2",
+        'print("<stop></stop>")',
+    ]
+    assert not should_stop
+
+
+def test_critique_response_to_actions():
+    feedback, should_stop = JupyterCritiqueActionsParser.response_to_actions(
+        f"<feedback>Label the axes</feedback>\n<{StopAction.name}></{StopAction.name}>"
+    )
+    assert feedback == "Label the axes"
+    assert should_stop
+
+
+def test_render_notebook_deduplicates_images():
+    image = {"output_type": "display_data", "data": {"image/png": "not a png"}}
+    notebook = nbformat.v4.new_notebook()
+    for _ in range(2):
+        cell = nbformat.v4.new_code_cell("plt.show()")
+        cell.outputs = [nbformat.from_dict(image)]
+        notebook.cells.append(cell)
+
+    state = JupyterCodeParser.render_notebook(notebook)
+    images = [item for item in state if item["type"] == "image_url"]
+    assert len(images) == 1
+    assert {"type": "text", "text": "(same image as shown above)"} in state
+
+
+def test_render_notebook_reuses_unchanged_cells(monkeypatch):
+    rendered = []
+    render_cell = JupyterCodeParser.render_cell
+
+    def counting_render_cell(idx, cell, include_outputs=True):
+        rendered.append(idx)
+        return render_cell(idx, cell, include_outputs)
+
+    monkeypatch.setattr(JupyterCodeParser, "render_cell", counting_render_cell)
+    notebook = nbformat.v4.new_notebook()
+    notebook.cells = [nbformat.v4.new_code_cell(f"x = {i}  # memo") for i in range(3)]
+    first = JupyterCodeParser.render_notebook(notebook)
+    notebook.cells[1].outputs = [
+        nbformat.v4.new_output("stream", name="stdout", text="1\n")
+    ]
+    second = JupyterCodeParser.render_notebook(notebook)
+
+    assert rendered == [0, 1, 2, 1]
+    assert first[1] is second[1]
+    assert {"type": "text", "text": "1\n"} in second
+
+
+def test_render_notebook_compacts_older_outputs_to_budget():
+    notebook = nbformat.v4.new_notebook()
+    for i in range(6):
+        cell = nbformat.v4.new_code_cell(f"print({i})")
+        cell.outputs = [
+            nbformat.v4.new_output("stream", name="stdout", text=f"{i}" * 400)
+        ]
+        notebook.cells.append(cell)
+    notebook.cells[1].outputs = [
+        nbformat.v4.new_output("error", ename="ValueError", evalue="bad", traceback=[])
+    ]
+
+    full = JupyterCodeParser.render_notebook(notebook)
+    compacted = JupyterCodeParser.render_notebook(
+        notebook, token_budget=estimate_tokens(full) - 150
+    )
+    omitted = [
+        item["text"] for item in compacted if "output omitted" in item.get("text", "")
+    ]
+    # the oldest successful cells go first, failed and recent cells are kept
+    assert omitted == [
+        "\n# <cell 0: output omitted>\n",
+        "\n# <cell 2: output omitted>\n",
+    ]
+    assert estimate_tokens(compacted) < estimate_tokens(full) - 150
@@ -0,0 +1,24 @@
+from agent.models import LlmMessage, LlmMessageContentItem
+from typing import List, Union
+
+# rough averages, exact counts need the provider's tokenizer
+CHARS_PER_TOKEN = 4
+# gemini bills a fixed amount per image tile, see `IMAGE_MAX_DIMENSION`
+IMAGE_TOKENS = 258
+
+
+def estimate_tokens(
+    content: Union[str, List[LlmMessageContentItem], List[LlmMessage]],
+) -> int:
+    """Estimated number of tokens of a text, content items or messages"""
+    if isinstance(content, str):
+        return -(-len(content) // CHARS_PER_TOKEN)
+    tokens = 0
+    for item in content:
+        if isinstance(item, LlmMessage):
+            tokens += estimate_tokens(item.content)
+        elif item["type"] == "image_url":
+            tokens += IMAGE_TOKENS
+        else:
+            tokens += estimate_tokens(item["text"])
+    return tokens
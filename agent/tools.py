@@ -1,4 +1,6 @@
+import json
 import logging
+import threading
 
 from agent.models import (
     CellOutputTypes,
@@ -6,14 +8,43 @@ from agent.models import (
     LlmMessageContentItem,
     TextItem,
 )
-from app.constants import MAX_CELL_OUTPUT_LENGTH
+from agent.tokens import estimate_tokens
+from app.constants import (
+    COMPACTION_KEEP_RECENT_CELLS,
+    IMAGE_FORMAT,
+    IMAGE_MAX_DIMENSION,
+    IMAGE_QUALITY,
+    MAX_CELL_OUTPUT_LENGTH,
+    RENDER_MEMO_SIZE,
+)
+from collections import OrderedDict
 from nbformat import NotebookNode
 from pydantic import BaseModel
-from sandbox.notebook import CellType, JupyterSandbox
-from typing import Any, ClassVar, Dict, List, Tuple
+from sandbox.notebook import (
+    CellType,
+    JupyterSandbox,
+    NotebookSandbox,
+    has_error,
+    hash_cell_outputs,
+    hash_cell_source,
+)
+from typing import (
+    Any,
+    ClassVar,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
+from utils.images import ImageEncoder
 from utils.parsing import (
-    extract_block_from_tags,
-    extract_blocks_from_tags,
+    StreamingTagParser,
+    extract_fields_from_tags,
+    tokenize_tags,
     try_to_parse_as_int,
 )
 
@@ -23,6 +54,8 @@ logger = logging.getLogger(__name__)
 class ProvideFeedbackAction(BaseModel):
     name: ClassVar[str] = "feedback"
 
+    feedback: str
+
     @staticmethod
     def get_response_template() -> str:
         return f"""
@@ -34,12 +67,8 @@ Feedback i.e. the feedback to provide. Type: str
 """
 
     @staticmethod
-    def handle_provide_feedback_action(response: str) -> str:
-        feedback_entries = extract_blocks_from_tags(
-            response, ProvideFeedbackAction.name
-        )
-        feedback = "".join(feedback_entries)
-        return feedback
+    def from_block(block: str) -> "ProvideFeedbackAction":
+        return ProvideFeedbackAction(feedback=block)
 
 
 class JupyterCritiqueActionsParser:
@@ -54,10 +83,18 @@ Possible actions:
 """
 
     @staticmethod
-    def response_to_actions(response: str) -> Tuple[bool, str]:
-        stop = StopAction.handle_stop_action(response)
-        feedback = ProvideFeedbackAction.handle_provide_feedback_action(response)
-        return stop, feedback
+    def response_to_actions(response: str) -> Tuple[str, bool]:
+        """Returns the feedback and whether to stop"""
+        feedback = ""
+        stop = False
+        for name, block in tokenize_tags(
+            response, [StopAction.name, ProvideFeedbackAction.name]
+        ):
+            if name == StopAction.name:
+                stop = True
+            else:
+                feedback += ProvideFeedbackAction.from_block(block).feedback
+        return feedback, stop
 
 
 class AddCellAction(BaseModel):
@@ -66,6 +103,10 @@ class AddCellAction(BaseModel):
     idx: ClassVar[str] = "idx"
     content: ClassVar[str] = "content"
 
+    cell_type: CellType
+    cell_idx: int
+    cell_content: str
+
     @staticmethod
     def get_response_template() -> str:
         return f"""
@@ -81,21 +122,23 @@ Cell content i.e. the content of the cell to add. Type: str
 """
 
     @staticmethod
-    def handle_add_action(
-        response: str, sandbox: JupyterSandbox, notebook: NotebookNode
-    ) -> NotebookNode:
-        add_entries = extract_blocks_from_tags(response, AddCellAction.name)
-        for add_entry in add_entries:
-            add_type = extract_block_from_tags(add_entry, AddCellAction.type)
-            add_content = extract_block_from_tags(add_entry, AddCellAction.content)
-            add_idx_str = extract_block_from_tags(add_entry, AddCellAction.idx)
-            add_idx = try_to_parse_as_int(add_idx_str)
-            if not add_type or not add_content or add_idx is None:
-                continue
-            notebook = sandbox.add_cell(
-                notebook, add_content, cell_type=CellType(add_type), idx=add_idx
-            )
-        return notebook
+    def from_block(block: str) -> Optional["AddCellAction"]:
+        fields = extract_fields_from_tags(
+            block, [AddCellAction.type, AddCellAction.idx, AddCellAction.content]
+        )
+        cell_type = (fields.get(AddCellAction.type) or "").strip()
+        cell_idx = try_to_parse_as_int(fields.get(AddCellAction.idx))
+        cell_content = fields.get(AddCellAction.content)
+        if not cell_type or cell_idx is None or not cell_content:
+            return None
+        return AddCellAction(
+            cell_type=CellType(cell_type), cell_idx=cell_idx, cell_content=cell_content
+        )
+
+    def apply(self, sandbox: NotebookSandbox, notebook: NotebookNode) -> NotebookNode:
+        return sandbox.add_cell(
+            notebook, self.cell_content, cell_type=self.cell_type, idx=self.cell_idx
+        )
 
 
 class ModifyCellAction(BaseModel):
@@ -104,6 +147,9 @@ class ModifyCellAction(BaseModel):
     idx: ClassVar[str] = "idx"
     content: ClassVar[str] = "content"
 
+    cell_idx: int
+    cell_content: str
+
     @staticmethod
     def get_response_template() -> str:
         return f"""
@@ -119,26 +165,26 @@ Cell content i.e. the content of the cell to modify. Type: str
 """
 
     @staticmethod
-    def handle_modify_action(
-        response: str, sandbox: JupyterSandbox, notebook: NotebookNode
-    ) -> NotebookNode:
-        modify_entries = extract_blocks_from_tags(response, ModifyCellAction.name)
-        for modify_entry in modify_entries:
-            modify_idx_str = extract_block_from_tags(modify_entry, ModifyCellAction.idx)
-            modify_idx = try_to_parse_as_int(modify_idx_str)
-            modify_content = extract_block_from_tags(
-                modify_entry, ModifyCellAction.content
-            )
-            if modify_idx is None or not modify_content:
-                continue
-            notebook = sandbox.modify_cell(notebook, modify_idx, modify_content)
-        return notebook
+    def from_block(block: str) -> Optional["ModifyCellAction"]:
+        fields = extract_fields_from_tags(
+            block, [ModifyCellAction.idx, ModifyCellAction.content]
+        )
+        cell_idx = try_to_parse_as_int(fields.get(ModifyCellAction.idx))
+        cell_content = fields.get(ModifyCellAction.content)
+        if cell_idx is None or not cell_content:
+            return None
+        return ModifyCellAction(cell_idx=cell_idx, cell_content=cell_content)
+
+    def apply(self, sandbox: NotebookSandbox, notebook: NotebookNode) -> NotebookNode:
+        return sandbox.modify_cell(notebook, self.cell_idx, self.cell_content)
 
 
 class DeleteCellAction(BaseModel):
     name: ClassVar[str] = "delete_cell"
     idx: ClassVar[str] = "idx"
 
+    cell_idx: int
+
     @staticmethod
     def get_response_template() -> str:
         return f"""
@@ -150,17 +196,15 @@ class DeleteCellAction(BaseModel):
 """
 
     @staticmethod
-    def handle_delete_action(
-        response: str, sandbox: JupyterSandbox, notebook: NotebookNode
-    ) -> NotebookNode:
-        delete_entries = extract_blocks_from_tags(response, DeleteCellAction.name)
-        for delete_entry in delete_entries:
-            delete_idx_str = extract_block_from_tags(delete_entry, DeleteCellAction.idx)
-            delete_idx = try_to_parse_as_int(delete_idx_str)
-            if delete_idx is None:
-                continue
-            notebook = sandbox.delete_cell(notebook, delete_idx)
-        return notebook
+    def from_block(block: str) -> Optional["DeleteCellAction"]:
+        fields = extract_fields_from_tags(block, [DeleteCellAction.idx])
+        cell_idx = try_to_parse_as_int(fields.get(DeleteCellAction.idx))
+        if cell_idx is None:
+            return None
+        return DeleteCellAction(cell_idx=cell_idx)
+
+    def apply(self, sandbox: NotebookSandbox, notebook: NotebookNode) -> NotebookNode:
+        return sandbox.delete_cell(notebook, self.cell_idx)
 
 
 class StopAction(BaseModel):
@@ -176,14 +220,21 @@ class StopAction(BaseModel):
 """
 
     @staticmethod
-    def handle_stop_action(response: str) -> bool:
-        stop_entries = extract_blocks_from_tags(response, StopAction.name)
-        if stop_entries:
-            return True
-        return False
+    def from_block(block: str) -> "StopAction":
+        return StopAction()
+
+
+CodeAction = Union[AddCellAction, ModifyCellAction, DeleteCellAction, StopAction]
 
 
 class JupyterCodeActionParser:
+    action_types: ClassVar[List[Type[CodeAction]]] = [
+        AddCellAction,
+        ModifyCellAction,
+        DeleteCellAction,
+        StopAction,
+    ]
+
     @staticmethod
     def get_actions_response_template() -> str:
         return f"""
@@ -198,19 +249,71 @@ Possible actions:
 {StopAction.get_response_template()}
 """
 
+    @staticmethod
+    def parse_block(name: str, block: str) -> Optional[CodeAction]:
+        for action_type in JupyterCodeActionParser.action_types:
+            if action_type.name == name:
+                return action_type.from_block(block)
+        return None
+
+    @staticmethod
+    def parse_actions(response: str) -> List[CodeAction]:
+        """Actions of the response in document order, malformed ones are dropped"""
+        names = [
+            action_type.name for action_type in JupyterCodeActionParser.action_types
+        ]
+        actions = [
+            JupyterCodeActionParser.parse_block(name, block)
+            for name, block in tokenize_tags(response, names)
+        ]
+        return [action for action in actions if action is not None]
+
+    @staticmethod
+    def stream_actions(chunks: Iterable[str]) -> Iterator[CodeAction]:
+        """Yield actions as soon as their block is complete"""
+        parser = StreamingTagParser(
+            [action_type.name for action_type in JupyterCodeActionParser.action_types]
+        )
+        for chunk in chunks:
+            for name, block in parser.feed(chunk):
+                action = JupyterCodeActionParser.parse_block(name, block)
+                if action is not None:
+                    yield action
+
+    @staticmethod
+    def apply_action(
+        action: CodeAction, sandbox: NotebookSandbox, notebook: NotebookNode
+    ) -> NotebookNode:
+        if isinstance(action, StopAction):
+            return notebook
+        try:
+            return action.apply(sandbox, notebook)
+        except ValueError as e:
+            logger.warning(f"Skipping {action.name} action: {e}")
+            return notebook
+
     @staticmethod
     def response_to_actions(
-        response: str, sandbox: JupyterSandbox, notebook: NotebookNode
+        response: str, sandbox: NotebookSandbox, notebook: NotebookNode
     ) -> Tuple[NotebookNode, bool]:
-        print()
-        notebook = AddCellAction.handle_add_action(response, sandbox, notebook)
-        notebook = ModifyCellAction.handle_modify_action(response, sandbox, notebook)
-        notebook = DeleteCellAction.handle_delete_action(response, sandbox, notebook)
-        should_stop = StopAction.handle_stop_action(response)
+        """Apply the actions in the order they appear, returns whether to stop"""
+        should_stop = False
+        for action in JupyterCodeActionParser.parse_actions(response):
+            if isinstance(action, StopAction):
+                should_stop = True
+            notebook = JupyterCodeActionParser.apply_action(action, sandbox, notebook)
         return notebook, should_stop
 
 
 class JupyterCodeParser:
+    image_encoder: ClassVar[ImageEncoder] = ImageEncoder(
+        IMAGE_MAX_DIMENSION, image_format=IMAGE_FORMAT, quality=IMAGE_QUALITY
+    )
+    # rendering key of a cell -> rendered content of the cell
+    render_memo: ClassVar[OrderedDict[str, List[LlmMessageContentItem]]] = OrderedDict()
+    # prompts of concurrent tasks are rendered in threads
+    render_memo_lock: ClassVar[threading.Lock] = threading.Lock()
+
     @staticmethod
     def convert_output_to_string(output: Dict[str, Any]) -> LlmMessageContentItem:
         if output.get("output_type", "") == CellOutputTypes.STREAM.value:
@@ -228,80 +331,159 @@ class JupyterCodeParser:
                 image_data = output.get("data", {}).get("image/png", None)
                 return ImageItem(
                     type="image_url",
-                    image_url={"url": f"data:image/png;base64,{image_data}"},
+                    image_url={
+                        "url": JupyterCodeParser.image_encoder.to_data_url(image_data)
+                    },
                 )
         return TextItem(type="text", text="")
 
     @staticmethod
-    def render_notebook(
-        notebook: NotebookNode, include_outputs=True
+    def deduplicate_images(
+        state: List[LlmMessageContentItem],
     ) -> List[LlmMessageContentItem]:
-        state: List[LlmMessageContentItem] = []
-        for idx, cell in enumerate(notebook.cells):
-            content = cell.source
-            if CellType(cell.cell_type) == CellType.MARKDOWN:
-                state.append(
-                    TextItem(
-                        type="text",
-                        text=f"""# <cell {idx}>\n{content}\n# </cell {idx}>""",
+        """Replace images identical to an earlier one with a reference to it"""
+        seen = set()
+        deduplicated: List[LlmMessageContentItem] = []
+        for item in state:
+            if item["type"] == "image_url":
+                url = item["image_url"]["url"]
+                if url in seen:
+                    deduplicated.append(
+                        TextItem(type="text", text="(same image as shown above)")
                     )
+                    continue
+                seen.add(url)
+            deduplicated.append(item)
+        return deduplicated
+
+    @staticmethod
+    def render_cell(
+        idx: int, cell: NotebookNode, include_outputs: bool = True
+    ) -> List[LlmMessageContentItem]:
+        state: List[LlmMessageContentItem] = []
+        content = cell.source
+        if CellType(cell.cell_type) == CellType.MARKDOWN:
+            state.append(
+                TextItem(
+                    type="text",
+                    text=f"""# <cell {idx}>\n{content}\n# </cell {idx}>""",
                 )
+            )
 
-            elif CellType(cell.cell_type) == CellType.CODE:
-                state.append(
-                    TextItem(
-                        type="text",
-                        text=f"""# <cell {idx}: input>\n{content}\n# </cell {idx}: input>""",
-                    )
+        elif CellType(cell.cell_type) == CellType.CODE:
+            state.append(
+                TextItem(
+                    type="text",
+                    text=f"""# <cell {idx}: input>\n{content}\n# </cell {idx}: input>""",
                 )
-                if include_outputs:
-                    outputs = cell.outputs if hasattr(cell, "outputs") else []
-                    output_repr = []
-                    total_output_length = 0
-                    for output in outputs:
-                        current_output_repr = (
-                            JupyterCodeParser.convert_output_to_string(output)
-                        )
-                        if current_output_repr["type"] == "text":
-                            # skip empty text outputs
-                            if current_output_repr["text"] == "":
-                                continue
-                            if total_output_length > MAX_CELL_OUTPUT_LENGTH:
-                                continue
-                            if (
-                                total_output_length + len(current_output_repr["text"])
-                                > (MAX_CELL_OUTPUT_LENGTH)
-                                # make sure to print error outputs
-                                and not output.get("output_type", "")
-                                == CellOutputTypes.ERROR.value
-                            ):
-                                available_space = (
-                                    MAX_CELL_OUTPUT_LENGTH - total_output_length
-                                )
-                                current_output_repr["text"] = (
-                                    current_output_repr["text"][:available_space]
-                                    + "... (truncated)"
-                                )
-                            total_output_length += len(current_output_repr["text"])
-                        output_repr.append(current_output_repr)
-                    if output_repr:
-                        state += (
-                            [
-                                TextItem(
-                                    type="text",
-                                    text=f"""\n# <cell {idx}: output>\n""",
-                                )
-                            ]
-                            + output_repr
-                            + [
-                                TextItem(
-                                    type="text",
-                                    text=f"""\n# </cell {idx}: output>\n""",
-                                )
-                            ]
-                        )
-            else:
-                logger.error(f"Invalid cell type: {cell.cell_type}")
+            )
+            if include_outputs:
+                outputs = cell.outputs if hasattr(cell, "outputs") else []
+                output_repr = []
+                total_output_length = 0
+                for output in outputs:
+                    current_output_repr = JupyterCodeParser.convert_output_to_string(
+                        output
+                    )
+                    if current_output_repr["type"] == "text":
+                        # skip empty text outputs
+                        if current_output_repr["text"] == "":
+                            continue
+                        if total_output_length > MAX_CELL_OUTPUT_LENGTH:
+                            continue
+                        if (
+                            total_output_length + len(current_output_repr["text"])
+                            > (MAX_CELL_OUTPUT_LENGTH)
+                            # make sure to print error outputs
+                            and not output.get("output_type", "")
+                            == CellOutputTypes.ERROR.value
+                        ):
+                            available_space = (
+                                MAX_CELL_OUTPUT_LENGTH - total_output_length
+                            )
+                            current_output_repr["text"] = (
+                                current_output_repr["text"][:available_space]
+                                + "... (truncated)"
+                            )
+                        total_output_length += len(current_output_repr["text"])
+                    output_repr.append(current_output_repr)
+                if output_repr:
+                    state += (
+                        [
+                            TextItem(
+                                type="text",
+                                text=f"""\n# <cell {idx}: output>\n""",
+                            )
+                        ]
+                        + output_repr
+                        + [
+                            TextItem(
+                                type="text",
+                                text=f"""\n# </cell {idx}: output>\n""",
+                            )
+                        ]
+                    )
+        else:
+            logger.error(f"Invalid cell type: {cell.cell_type}")
+        return state
+
+    @staticmethod
+    def _get_render_key(idx: int, cell: NotebookNode, include_outputs: bool) -> str:
+        """Outputs are keyed by the hash stored when the sandbox set them"""
+        outputs_hash = hash_cell_outputs(cell) if include_outputs else ""
+        return f"{idx}:{cell.cell_type}:{hash_cell_source(cell)}:{outputs_hash}"
+
+    @staticmethod
+    def _render_memoized(
+        idx: int, cell: NotebookNode, include_outputs: bool
+    ) -> List[LlmMessageContentItem]:
+        """`render_cell`, unchanged cells reuse their memoized rendering"""
+        memo = JupyterCodeParser.render_memo
+        key = JupyterCodeParser._get_render_key(idx, cell, include_outputs)
+        with JupyterCodeParser.render_memo_lock:
+            rendered = memo.get(key)
+            if rendered is not None:
+                memo.move_to_end(key)
+                return rendered
+        # rendered outside the lock, a concurrent render of the cell is kept
+        rendered = JupyterCodeParser.render_cell(idx, cell, include_outputs)
+        with JupyterCodeParser.render_memo_lock:
+            rendered = memo.setdefault(key, rendered)
+            memo.move_to_end(key)
+            if len(memo) > RENDER_MEMO_SIZE:
+                memo.popitem(last=False)
+        return rendered
+
+    @staticmethod
+    def render_notebook(
+        notebook: NotebookNode,
+        include_outputs=True,
+        token_budget: Optional[int] = None,
+    ) -> List[LlmMessageContentItem]:
+        """Render the notebook, compacted to fit `token_budget` if given
+
+        Compaction omits the outputs of the oldest cells first. Failed cells
+        and the latest `COMPACTION_KEEP_RECENT_CELLS` cells are kept whole.
+        """
+        cells = [
+            JupyterCodeParser._render_memoized(idx, cell, include_outputs)
+            for idx, cell in enumerate(notebook.cells)
+        ]
+        if include_outputs and token_budget is not None:
+            total_tokens = sum(estimate_tokens(cell) for cell in cells)
+            compactable = notebook.cells[: -COMPACTION_KEEP_RECENT_CELLS or None]
+            for idx, cell in enumerate(compactable):
+                if total_tokens <= token_budget:
+                    break
+                if not cell.get("outputs") or has_error(cell):
+                    continue
+                compacted = JupyterCodeParser._render_memoized(idx, cell, False) + [
+                    TextItem(type="text", text=f"\n# <cell {idx}: output omitted>\n")
+                ]
+                total_tokens += estimate_tokens(compacted) - estimate_tokens(cells[idx])
+                cells[idx] = compacted
+        state: List[LlmMessageContentItem] = [item for cell in cells for item in cell]
+        state = JupyterCodeParser.deduplicate_images(state)
         # wrap in python code block
         state = (
             [TextItem(type="text", text="```python\n")]
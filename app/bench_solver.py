@@ -0,0 +1,77 @@
+import argparse
+import nbformat
+import tempfile
+import time
+
+from agent.llm import LlmClient
+from agent.models import LlmModel, LlmParameterConfig, LlmProviderConfig
+from agent.offline import ScriptedBackend
+from agent.prompts import JupyterCodeAgentPrompt
+from app.garmin import Solver
+from sandbox.notebook import CellType, JupyterSandbox, NotebookSandbox
+
+
+class BenchSolver(Solver):
+    """Solver without an API, answered by a `ScriptedBackend`"""
+
+    def init_api(self):
+        pass
+
+    def _get_prompt_factory(self) -> JupyterCodeAgentPrompt:
+        return JupyterCodeAgentPrompt(ADDITIONAL_SYSTEM_PROMPT="")
+
+    def _init_notebook(self, sandbox: NotebookSandbox) -> nbformat.NotebookNode:
+        notebook = sandbox.create_notebook()
+        sandbox.add_cell(notebook, content=self.task, cell_type=CellType.MARKDOWN)
+        return notebook
+
+    def _resume_notebook(
+        self, sandbox: NotebookSandbox, notebook: nbformat.NotebookNode
+    ) -> nbformat.NotebookNode:
+        return notebook
+
+
+def bench(backend: ScriptedBackend, incremental: bool) -> float:
+    """Seconds `Solver.solve` takes for the scripted task
+
+    The artifacts of the run are thrown away.
+    """
+    task_id = f"bench_{time.time_ns()}"
+    llm_client = LlmClient(
+        id=task_id,
+        provider_config=LlmProviderConfig(model=LlmModel.GEMINI_2_0_FLASH, api_key=""),
+        parameter_config=LlmParameterConfig(),
+        backend=backend,
+    )
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        solver = BenchSolver(
+            task="Benchmark", task_id=task_id, artifact_dir=artifact_dir
+        )
+        solver.init_solver(handle_signals=False, llm_client=llm_client)
+        with JupyterSandbox(incremental=incremental) as sandbox:
+            start = time.perf_counter()
+            solver.solve(sandbox)
+            return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--cells-per-turn", type=int, default=2)
+    parser.add_argument("--cell-code", type=str, default="import time; time.sleep(0.1)")
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--time-to-first-token", type=float, default=None)
+    args = parser.parse_args()
+
+    backend = ScriptedBackend(
+        cells_per_turn=args.cells_per_turn,
+        turns=args.turns,
+        cell_code=args.cell_code,
+        latency=args.latency,
+        time_to_first_token=args.time_to_first_token,
+    )
+    print(f"{'mode':>12} {'total s':>8} {'per turn s':>11}")
+    for incremental in [False, True]:
+        seconds = bench(backend, incremental)
+        mode = "incremental" if incremental else "full"
+        print(f"{mode:>12} {seconds:>8.2f} {seconds / (args.turns + 1):>11.2f}")
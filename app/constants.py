@@ -1,6 +1,46 @@
 ARTIFACT_DIR = "./artifacts"
 GARMIN_API_GUIDE_PATH = "./training/apis/garminconnect.xml"
+CELL_CACHE_DIR = f"{ARTIFACT_DIR}/cell_cache"
+GARMIN_CACHE_DIR = f"{ARTIFACT_DIR}/garmin_cache"
+WEARABLE_STORE_PATH = f"{ARTIFACT_DIR}/wearables.sqlite"
+WEARABLE_SERIES_DIR = f"{ARTIFACT_DIR}/wearable_series"
+LLM_CACHE_DIR = f"{ARTIFACT_DIR}/llm_cache"
+API_GUIDE_CACHE_DIR = f"{ARTIFACT_DIR}/api_guide_cache"
+LLM_RECORDINGS_PATH = f"{ARTIFACT_DIR}/llm_recordings.jsonl"
 
 MAX_ITERATIONS = 15
 MAX_GOAL_ITERATIONS = 2
 MAX_CELL_OUTPUT_LENGTH = 1000
+# apply actions and execute new cells while the answer is generated
+LLM_STREAMING = True
+CELL_CACHE_SIZE_LIMIT = 512 * 1024 * 1024  # bytes
+KERNEL_POOL_SIZE = 1
+GARMIN_CACHE_SIZE_LIMIT = 1024 * 1024 * 1024  # bytes
+GARMIN_CACHE_TODAY_TTL = 15 * 60  # seconds
+FETCH_MAX_WORKERS = 8
+FETCH_RATE_LIMIT = 20  # calls per second
+FETCH_MAX_RETRIES = 3
+LLM_CACHE_SIZE_LIMIT = 256 * 1024 * 1024  # bytes
+LLM_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+# images sent to the LLM are downscaled to fit this size in pixels
+IMAGE_MAX_DIMENSION = 768
+IMAGE_FORMAT = "JPEG"
+IMAGE_QUALITY = 80
+RENDER_MEMO_SIZE = 256  # rendered cells kept in memory
+# older cell outputs are omitted from prompts estimated to be larger
+PROMPT_TOKEN_BUDGET = 32_000
+# the outputs of the latest cells are always kept
+COMPACTION_KEEP_RECENT_CELLS = 3
+# functions of the API guide retrieved for each prompt
+API_GUIDE_TOP_K = 6
+# answers tried in parallel kernels per iteration, more than 1 needs a pool
+NUM_CANDIDATES = 1
+CANDIDATE_TEMPERATURE = 0.7
+# tasks solved concurrently by `main.solve_many`, each runs a kernel
+MAX_CONCURRENT_TASKS = 16
+TASK_TIMEOUT = 30 * 60  # seconds
+TASK_LIST_PATH = "./training/task_list.csv"
+EVALUATION_DIR = f"{ARTIFACT_DIR}/evaluation"
+EVAL_MAX_WORKERS = 4  # processes, each runs a task in a kernel of its own
+# seconds a replayed LLM answer takes, see `agent.offline`
+OFFLINE_LLM_LATENCY = 1.0
@@ -0,0 +1,196 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import shutil
+import time
+
+from agent.offline import LlmMode
+from app.constants import (
+    ARTIFACT_DIR,
+    EVAL_MAX_WORKERS,
+    EVALUATION_DIR,
+    TASK_LIST_PATH,
+)
+from app.garmin import KERNEL_PRELOAD, GarminSolver
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from sandbox.notebook import JupyterSandbox, has_error
+from typing import Dict, List, Optional
+from utils.persistence import atomic_write
+from utils.profiling import profile
+from wearables.cache import CacheMode
+
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+@dataclass
+class EvalTask:
+    task: str
+    # the "solved?" column, as judged by hand
+    expected: str
+    notes: str
+
+
+@dataclass
+class EvalReport:
+    task_id: str
+    task: str
+    expected: str
+    passed: bool
+    # the solver stopped on its own, before the iteration limits
+    finished: bool
+    error: Optional[str]
+    iterations: int
+    failed_cells: int
+    wall_time: float
+    # seconds per solver phase, phases may overlap, see `Solver._timed`
+    timings: Dict[str, float] = field(default_factory=dict)
+    llm_requests: int = 0
+    # as reported by the provider, answers from the LLM cache have none
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    completion_tokens: int = 0
+    estimated_prompt_tokens: int = 0
+
+
+def load_tasks(path: str) -> List[EvalTask]:
+    """Tasks of the hand maintained `task, solved?, notes` CSV
+
+    Notes are not quoted, so any further columns belong to them.
+    """
+    with open(path, "r", newline="") as f:
+        rows = list(csv.reader(f, skipinitialspace=True))
+    return [
+        EvalTask(row[0].strip(), row[1].strip(), ", ".join(row[2:]).strip())
+        for row in rows[1:]
+        if row and row[0].strip()
+    ]
+
+
+def get_report(
+    solver: GarminSolver,
+    eval_task: EvalTask,
+    error: Optional[str],
+    wall_time: float,
+) -> EvalReport:
+    notebook = getattr(solver, "notebook", None)
+    failed_cells = sum(has_error(cell) for cell in notebook.cells) if notebook else 0
+    finished = getattr(solver, "finished", False)
+    token_counts = getattr(solver, "token_counts", [])
+    usages = [counts["usage"] for counts in token_counts if counts.get("usage")]
+    return EvalReport(
+        task_id=solver.task_id,
+        task=eval_task.task,
+        expected=eval_task.expected,
+        passed=error is None and finished and failed_cells == 0,
+        finished=finished,
+        error=error,
+        iterations=getattr(solver, "total_iterations", 0),
+        failed_cells=failed_cells,
+        wall_time=wall_time,
+        timings=getattr(solver, "timings", {}),
+        llm_requests=len(token_counts),
+        prompt_tokens=sum(usage["prompt_tokens"] for usage in usages),
+        cached_tokens=sum(usage["cached_tokens"] for usage in usages),
+        completion_tokens=sum(usage["completion_tokens"] for usage in usages),
+        estimated_prompt_tokens=sum(
+            counts[key]
+            for counts in token_counts
+            for key in ("system", "api_guide", "task", "notebook")
+        ),
+    )
+
+
+def run_task(
+    idx: int, eval_task: EvalTask, run_dir: str, profile_run: bool = False
+) -> EvalReport:
+    """Solve a task from scratch in a fresh kernel and write its report"""
+    task_id = f"eval_{idx}"
+    shutil.rmtree(os.path.join(ARTIFACT_DIR, task_id), ignore_errors=True)
+    solver = GarminSolver(task=eval_task.task, task_id=task_id)
+    error = None
+    start = time.perf_counter()
+    try:
+        # no cell output cache, kernel time is part of the measurement
+        with JupyterSandbox(incremental=True) as sandbox:
+            for code in KERNEL_PRELOAD:
+                sandbox.preload(code)
+            solver.init_solver(handle_signals=False)
+            profile_path = os.path.join(run_dir, f"{task_id}.prof")
+            with profile(profile_path if profile_run else None):
+                solver.solve(sandbox)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    report = get_report(solver, eval_task, error, time.perf_counter() - start)
+    atomic_write(
+        os.path.join(run_dir, f"{task_id}.json"), json.dumps(asdict(report), indent=2)
+    )
+    return report
+
+
+def evaluate(
+    task_list_path: str = TASK_LIST_PATH,
+    max_workers: int = EVAL_MAX_WORKERS,
+    offline: bool = True,
+    profile_run: bool = False,
+) -> List[EvalReport]:
+    """Run every task of the list in a pool of processes
+
+    Offline, recorded Garmin responses and LLM answers are replayed. Live
+    runs record both, so they can be replayed offline afterwards. Reports are
+    written to a directory of the run in `EVALUATION_DIR`.
+    """
+    # inherited by the workers and their kernels
+    if offline:
+        os.environ["GARMIN_CACHE_MODE"] = CacheMode.REPLAY.value
+        os.environ["LLM_MODE"] = LlmMode.REPLAY.value
+    else:
+        os.environ["GARMIN_CACHE_MODE"] = CacheMode.RECORD.value
+        os.environ["LLM_MODE"] = LlmMode.RECORD.value
+    run_dir = os.path.join(EVALUATION_DIR, datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+    os.makedirs(run_dir, exist_ok=True)
+    tasks = load_tasks(task_list_path)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(run_task, idx, eval_task, run_dir, profile_run)
+            for idx, eval_task in enumerate(tasks)
+        ]
+        reports = [future.result() for future in futures]
+
+    summary = {
+        "task_list": task_list_path,
+        "offline": offline,
+        "passed": sum(report.passed for report in reports),
+        "total": len(reports),
+        "reports": [asdict(report) for report in reports],
+    }
+    atomic_write(os.path.join(run_dir, "summary.json"), json.dumps(summary, indent=2))
+    logger.info(
+        f"Passed {summary['passed']} of {summary['total']} tasks, reports in {run_dir}"
+    )
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--task-list", type=str, default=TASK_LIST_PATH)
+    parser.add_argument("--max-workers", type=int, default=EVAL_MAX_WORKERS)
+    # fetch Garmin responses and request LLM answers instead of replaying them,
+    # both are recorded for later offline runs
+    parser.add_argument("--live", action="store_true")
+    # cProfile each task into the run directory
+    parser.add_argument("--profile", action="store_true")
+    args = parser.parse_args()
+    evaluate(
+        args.task_list,
+        args.max_workers,
+        offline=not args.live,
+        profile_run=args.profile,
+    )
@@ -1,33 +1,54 @@
+import asyncio
 import copy
 import json
 import logging
 import nbformat
 import os
 import signal
+import sys
+import threading
 import time
 
 from abc import abstractmethod
-from agent.llm import get_llm_client
+from agent.llm import LlmClient, get_llm_client
+from agent.models import LlmMessage
 from agent.prompts import Character, JupyterCodeAgentPrompt
+from agent.retrieval import ApiGuide
 from agent.tools import (
+    DeleteCellAction,
     JupyterCodeActionParser,
     JupyterCodeParser,
     JupyterCritiqueActionsParser,
+    StopAction,
 )
+from concurrent.futures import ThreadPoolExecutor
 from constants import (
+    API_GUIDE_CACHE_DIR,
     ARTIFACT_DIR,
+    CANDIDATE_TEMPERATURE,
     GARMIN_API_GUIDE_PATH,
+    LLM_STREAMING,
     MAX_GOAL_ITERATIONS,
     MAX_ITERATIONS,
+    NUM_CANDIDATES,
+    PROMPT_TOKEN_BUDGET,
 )
+from contextlib import contextmanager
 from dataclasses import dataclass
+from datetime import datetime
 from garminconnect import (
     Garmin,
     GarminConnectAuthenticationError,
 )
 from garth.exc import GarthHTTPError
-from sandbox.notebook import CellType, JupyterSandbox
-from typing import List, Optional, Tuple
+from sandbox.async_notebook import AsyncJupyterSandbox
+from sandbox.notebook import CellType, JupyterSandbox, NotebookSandbox, has_error
+from sandbox.pool import KernelPool
+from sandbox.trajectory import TrajectoryStore
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from utils.persistence import BackgroundWriter, atomic_write
+from utils.profiling import Tracer
+from wearables.cache import CacheMode, get_cache_mode
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -36,14 +57,41 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+# `api` caches responses on disk, see `wearables.cache`
+LOGIN_CODE = """
+import os
+from wearables import analytics
+from wearables.cache import login
+from wearables.fetch import fetch_range
+from wearables.store import WearableStore
+
+tokenstore = os.getenv("GARMINTOKENSTORE")
+api = login(tokenstore)
+store = WearableStore(api)
+load, series = store.load, store.series
+"""
+
+# Run in pooled kernels ahead of time, see `KernelPool`
+KERNEL_PRELOAD = [
+    """
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+""",
+    LOGIN_CODE,
+]
+
+
 @dataclass
 class Solver:
     task: str
     task_id: str
     feedback: str = ""
+    # state of every task is saved in a directory of its id here
+    artifact_dir: str = ARTIFACT_DIR
 
     def _get_save_dir(self):
-        return os.path.join(ARTIFACT_DIR, self.task_id)
+        return os.path.join(self.artifact_dir, self.task_id)
 
     def _get_last_state_path(self):
         return os.path.join(self._get_save_dir(), "last.ipynb")
@@ -54,162 +102,594 @@ class Solver:
     def _get_state_trajectory_dir(self):
         return os.path.join(self._get_save_dir(), "state_trajectory")
 
-    def _get_state_trajectory_path(self, idx: int):
-        return os.path.join(self._get_state_trajectory_dir(), f"{idx}.ipynb")
+    def _get_trace_path(self):
+        return os.path.join(self._get_save_dir(), "trace.jsonl")
+
+    def init_solver(
+        self, handle_signals: bool = True, llm_client: Optional[LlmClient] = None
+    ):
+        """Set up the solver, `handle_signals` saves state on SIGINT and SIGTERM
 
-    def init_solver(self):
+        Signal handlers can only be set from the main thread, solvers of
+        concurrent tasks are cancelled instead. `llm_client` replaces the
+        client of the configured model, e.g. with an offline backend.
+        """
         self.session_id = f"garmin_agent_{self.task_id}"
-        self.save_dir = os.path.join(ARTIFACT_DIR, self.session_id)
+        self.save_dir = self._get_save_dir()
 
         # Initialize components
         self.init_api()
         self.prompt_factory = self._get_prompt_factory()
-        self.llm_client = get_llm_client(session_id=self.session_id)
-
-        if os.path.exists(self.save_dir):
+        self.llm_client = llm_client or get_llm_client(session_id=self.session_id)
+        self.state_writer = BackgroundWriter()
+        # seconds spent per phase, see `_timed`
+        self.timings: Dict[str, float] = {}
+        self._timings_lock = threading.Lock()
+        self.tracer = Tracer(self._get_trace_path())
+        # whether the last solve stopped on its own, before the iteration limits
+        self.finished = False
+
+        if os.path.exists(self._get_metadata_path()):
             self._load_state()
         else:
             # State
             self.notebook: Optional[nbformat.NotebookNode] = None
-            self.state_trajectory: List[nbformat.NotebookNode] = []
+            self.state_trajectory = TrajectoryStore(self._get_state_trajectory_dir())
             self.total_iterations = 0
+            self.token_counts: List[Dict[str, Any]] = []
 
-        # Set up signal handlers
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        if handle_signals:
+            signal.signal(signal.SIGINT, self._signal_handler)
+            signal.signal(signal.SIGTERM, self._signal_handler)
 
         logger.info(f"[{self.session_id}]: Solver initialized")
 
     def _load_state(self):
-        self.notebook = sandbox.load_notebook(self._get_last_state_path())
+        """Resume from the last notebook, historic states are read on access"""
+        with open(self._get_last_state_path(), "r", encoding="utf-8") as f:
+            self.notebook = nbformat.read(f, as_version=4)
         with open(self._get_metadata_path(), "r") as f:
             metadata = json.load(f)
             self.total_iterations = metadata["total_iterations"]
-            if metadata["total_states"] != metadata["total_iterations"]:
+            self.token_counts = metadata.get("token_counts", [])
+            if metadata["total_states"] > metadata["total_iterations"]:
                 raise Exception(
-                    f"Total states {metadata['total_states']} != total iterations {metadata['total_iterations']}"
+                    f"Total states {metadata['total_states']} > total iterations {metadata['total_iterations']}"
+                )
+            if metadata["total_states"] < metadata["total_iterations"]:
+                # saved before interrupted iterations were snapshotted
+                logger.warning(
+                    f"[{self.session_id}]: Missing states of {metadata['total_iterations'] - metadata['total_states']} iterations"
                 )
-        self.state_trajectory = [
-            sandbox.load_notebook(self._get_state_trajectory_path(idx))
-            for idx in range(metadata["total_states"])
-        ]
+        self.state_trajectory = TrajectoryStore(self._get_state_trajectory_dir())
+        logger.info(
+            f"[{self.session_id}]: Resuming after {self.total_iterations} iterations"
+        )
 
-    def _save_state(self):
-        """Save current solver state."""
-        os.makedirs(self.save_dir, exist_ok=True)
-        notebook_save_path = self._get_last_state_path()
+    def _save_state(self, snapshot: bool = False):
+        """Save current solver state in the background, see `_wait_for_state`
+
+        The notebook must not change until the save is done, with `snapshot`
+        it is also recorded in the trajectory.
+        """
+        total_iterations = self.total_iterations
+        # usage is added to the counts while the writer serializes them
+        token_counts = copy.deepcopy(self.token_counts)
+        self.state_writer.submit(
+            lambda: self._write_state(total_iterations, token_counts, snapshot)
+        )
 
-        # Save current notebook
-        with open(notebook_save_path, "w", encoding="utf-8") as f:
-            nbformat.write(self.notebook, f)
+    def _write_state(
+        self,
+        total_iterations: int,
+        token_counts: List[Dict[str, Any]],
+        snapshot: bool,
+    ):
+        if self.notebook is None:
+            return
+        with self._timed("persistence", snapshot=snapshot) as span:
+            span["bytes"] = self._write_state_files(
+                total_iterations, token_counts, snapshot
+            )
 
-        # Save trajectory
-        traj_save_path = self._get_state_trajectory_dir()
-        os.makedirs(traj_save_path, exist_ok=True)
+    def _write_state_files(
+        self,
+        total_iterations: int,
+        token_counts: List[Dict[str, Any]],
+        snapshot: bool,
+    ) -> int:
+        """Returns the bytes of the notebook and metadata written"""
+        os.makedirs(self._get_save_dir(), exist_ok=True)
 
-        # Save new states
-        state_save_path = self._get_state_trajectory_path(self.total_iterations)
-        with open(state_save_path, "w", encoding="utf-8") as f:
-            nbformat.write(self.state_trajectory[-1], f)
+        # Save current notebook
+        content = nbformat.writes(self.notebook)
+        atomic_write(self._get_last_state_path(), content)
 
-        # Save metadata
+        # Save new states, an iteration interrupted before its snapshot gets one
+        if snapshot or len(self.state_trajectory) < total_iterations:
+            self.state_trajectory.append(self.notebook)
+        self.state_trajectory.flush()
+
+        # Save metadata last, it marks the checkpoint as complete
         metadata = {
             "last_save": time.time(),
             "task_id": self.task_id,
             "total_states": len(self.state_trajectory),
-            "total_iterations": self.total_iterations,
+            "total_iterations": total_iterations,
+            "token_counts": token_counts,
+        }
+        metadata_content = json.dumps(metadata)
+        atomic_write(self._get_metadata_path(), metadata_content)
+        return len(content) + len(metadata_content)
+
+    def _get_llm_prompt(self, character: Character) -> List[LlmMessage]:
+        """Prompt for the current notebook, compacted to `PROMPT_TOKEN_BUDGET`"""
+        with self._timed("prompt", character=character.value) as span:
+            token_counts = self.prompt_factory.get_token_counts(
+                self.task, [], character
+            )
+            with self._timed("render", cells=len(self.notebook.cells)) as render_span:
+                notebook_state = JupyterCodeParser.render_notebook(
+                    self.notebook,
+                    token_budget=PROMPT_TOKEN_BUDGET - sum(token_counts.values()),
+                )
+                render_span["items"] = len(notebook_state)
+            token_counts = self.prompt_factory.get_token_counts(
+                self.task, notebook_state, character
+            )
+            messages = self.prompt_factory.forward(
+                self.task, notebook_state, character=character
+            )
+            span["tokens"] = sum(token_counts.values())
+        logger.info(
+            f"[{self.session_id}]: Estimated prompt tokens {sum(token_counts.values())} {token_counts}"
+        )
+        self.token_counts.append(
+            {
+                "iteration": self.total_iterations,
+                "character": character.value,
+                **token_counts,
+            }
+        )
+        return messages
+
+    def _get_llm_metadata(self, character: Character) -> Dict[str, Any]:
+        """Identifies the request, e.g. to replay recorded answers"""
+        return {
+            "task": self.task,
+            "iteration": self.total_iterations,
+            "character": character.value,
         }
-        with open(self._get_metadata_path(), "w") as f:
-            json.dump(metadata, f)
+
+    def _get_answer(self, llm_prompt: List[LlmMessage], character: Character) -> str:
+        with self._timed("llm", character=character.value) as span:
+            answer = self.llm_client.get_single_answer(
+                llm_prompt, metadata=self._get_llm_metadata(character)
+            )
+            span.update(answer_bytes=len(answer), **(self.llm_client.last_usage or {}))
+        self._record_llm_usage(self.llm_client.last_usage)
+        return answer
+
+    async def _aget_answer(
+        self, llm_prompt: List[LlmMessage], character: Character
+    ) -> str:
+        with self._timed("llm", character=character.value) as span:
+            answer = await self.llm_client.aget_single_answer(
+                llm_prompt, metadata=self._get_llm_metadata(character)
+            )
+            span.update(answer_bytes=len(answer), **(self.llm_client.last_usage or {}))
+        self._record_llm_usage(self.llm_client.last_usage)
+        return answer
+
+    def _apply_actions(self, sandbox: NotebookSandbox, answer: str) -> bool:
+        """Apply the actions of a complete answer, returns whether to stop"""
+        with self._timed("actions", answer_bytes=len(answer)) as span:
+            self.notebook, should_stop = JupyterCodeActionParser.response_to_actions(
+                answer, sandbox=sandbox, notebook=self.notebook
+            )
+            span["cells"] = len(self.notebook.cells)
+        return should_stop
+
+    def _execute_notebook(
+        self, sandbox: JupyterSandbox, notebook: nbformat.NotebookNode
+    ) -> nbformat.NotebookNode:
+        with self._timed("kernel", cells=len(notebook.cells)) as span:
+            notebook = sandbox.execute_notebook(notebook)
+            span["executed_cells"] = len(sandbox.last_executed_cells)
+        self._trace_cells(notebook, sandbox.last_executed_cells)
+        return notebook
+
+    def _trace_cells(self, notebook: nbformat.NotebookNode, executed_cells: List[int]):
+        """Spans of the executed cells, as timed by the kernel"""
+        for idx in executed_cells:
+            cell = notebook.cells[idx]
+            execution = cell.metadata.get("execution", {})
+            if "iopub.status.busy" not in execution:
+                continue
+            if "iopub.status.idle" not in execution:
+                continue
+            start = datetime.fromisoformat(execution["iopub.status.busy"]).timestamp()
+            end = datetime.fromisoformat(execution["iopub.status.idle"]).timestamp()
+            self.tracer.add(
+                "cell",
+                start,
+                end - start,
+                iteration=self.total_iterations,
+                cell=idx,
+                source_bytes=len(cell.source),
+                output_bytes=len(json.dumps(cell.outputs)),
+                error=has_error(cell),
+            )
+
+    @staticmethod
+    def _trace_chunks(chunks: Iterator[str], span: Dict[str, Any]) -> Iterator[str]:
+        """Pass the chunks on, recording the time to the first and the size on `span`"""
+        start = time.perf_counter()
+        size = 0
+        for chunk in chunks:
+            if not size:
+                span["time_to_first_token"] = time.perf_counter() - start
+            size += len(chunk)
+            yield chunk
+        span["answer_bytes"] = size
+
+    def _record_llm_usage(self, usage: Optional[Dict[str, int]]):
+        """Add the token usage reported for the last prompt to its counts"""
+        if usage is None:
+            return
+        logger.info(
+            f"[{self.session_id}]: Prompt tokens {usage['prompt_tokens']} ({usage['cached_tokens']} cached)"
+        )
+        self.token_counts[-1]["usage"] = usage
+
+    def _wait_for_state(self):
+        """Block until all queued saves are on disk"""
+        with self._timed("persistence_wait"):
+            self.state_writer.wait()
+
+    @contextmanager
+    def _timed(self, phase: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        """Trace the block as a span, adding its time to `timings[phase]`
+
+        Sizes and such can be set on the yielded span attributes. Phases may
+        overlap, e.g. kernel execution while an answer streams in.
+        """
+        start = time.perf_counter()
+        try:
+            with self.tracer.span(
+                phase, iteration=self.total_iterations, **attributes
+            ) as span:
+                yield span
+        finally:
+            elapsed = time.perf_counter() - start
+            # candidates are timed from several threads
+            with self._timings_lock:
+                self.timings[phase] = self.timings.get(phase, 0.0) + elapsed
 
     def _signal_handler(self, signum, frame):
         """Handle interruption by saving current state."""
         logger.info(f"[{self.session_id}]: Received interrupt signal, saving state...")
         self._save_state()
+        self._wait_for_state()
         logger.info(f"[{self.session_id}]: State saved, exiting...")
         raise KeyboardInterrupt
 
-    def _current_attempt_towards_goal(
-        self,
-        sandbox: JupyterSandbox,
-        goal_idx: int,
+    def _apply_streamed_actions(
+        self, sandbox: JupyterSandbox, llm_prompt: List[LlmMessage]
+    ) -> bool:
+        """Apply actions as the answer streams in, returns whether to stop
+
+        In incremental mode added and modified cells are executed in the
+        background right away, so the kernel runs while the LLM generates.
+        """
+        should_stop = False
+        lock = threading.Lock()
+
+        def execute():
+            with lock:
+                try:
+                    self._execute_notebook(sandbox, self.notebook)
+                except Exception as e:
+                    logger.warning(f"[{self.session_id}]: Early execution failed: {e}")
+
+        with (
+            ThreadPoolExecutor(max_workers=1) as executor,
+            self._timed("llm", character=Character.GENERATE_CODE.value) as span,
+        ):
+            chunks = self.llm_client.stream_answer(
+                llm_prompt, metadata=self._get_llm_metadata(Character.GENERATE_CODE)
+            )
+            for action in JupyterCodeActionParser.stream_actions(
+                self._trace_chunks(chunks, span)
+            ):
+                if isinstance(action, StopAction):
+                    should_stop = True
+                    continue
+                self._wait_for_state()
+                with lock:
+                    self.notebook = JupyterCodeActionParser.apply_action(
+                        action, sandbox=sandbox, notebook=self.notebook
+                    )
+                if sandbox.incremental and not isinstance(action, DeleteCellAction):
+                    executor.submit(execute)
+            span.update(self.llm_client.last_usage or {})
+        self._wait_for_state()
+        return should_stop
+
+    def _run_candidate(
+        self, sandbox: JupyterSandbox, answer: str
     ) -> Tuple[nbformat.NotebookNode, bool]:
-        should_stop_goal = False
-        for idx in range(MAX_ITERATIONS):
-            self.total_iterations += 1
-            logger.info(
-                f"[{self.session_id}]: Goal iteration {goal_idx} - Solver iteration {idx} (Total: {self.total_iterations}) ..."
+        """Apply an answer to a copy of the notebook and execute it in `sandbox`"""
+        notebook = copy.deepcopy(self.notebook)
+        notebook, should_stop = JupyterCodeActionParser.response_to_actions(
+            answer, sandbox=sandbox, notebook=notebook
+        )
+        return self._execute_notebook(sandbox, notebook), should_stop
+
+    def _apply_best_candidate(
+        self, sandbox: JupyterSandbox, llm_prompt: List[LlmMessage]
+    ) -> Tuple[JupyterSandbox, bool]:
+        """Apply the best of several answers, returns its sandbox and whether to stop
+
+        The first answer runs in `sandbox`, whose kernel is at the current
+        notebook. Kernels can not be forked, so the other answers run in
+        kernels of the pool that first catch up on the notebook with the help
+        of the cell output cache. The first candidate without failed cells is
+        kept, otherwise the one with the fewest, and its kernel carries on.
+        Other pooled kernels go back to the pool.
+        """
+        assert self.candidate_pool is not None
+        with self._timed("llm", character=Character.GENERATE_CODE.value) as span:
+            answers = self.llm_client.get_candidate_answers(
+                llm_prompt,
+                NUM_CANDIDATES,
+                CANDIDATE_TEMPERATURE,
+                metadata=self._get_llm_metadata(Character.GENERATE_CODE),
             )
+            usages = [usage for _, usage in answers if usage is not None]
+            usage = (
+                {key: sum(u[key] for u in usages) for key in usages[0]}
+                if usages
+                else None
+            )
+            span.update(candidates=len(answers), **(usage or {}))
+        self._record_llm_usage(usage)
 
-            self.notebook = sandbox.execute_notebook(self.notebook)
-            self.state_trajectory.append(copy.deepcopy(self.notebook))
+        sandboxes = [sandbox]
+        # on errors only the current sandbox is kept
+        best = 0
+        try:
+            sandboxes += [self.candidate_pool.acquire() for _ in answers[1:]]
+            # the kernel time of each candidate is traced by `_execute_notebook`
+            with ThreadPoolExecutor(max_workers=len(answers)) as executor:
+                candidates = list(
+                    executor.map(
+                        self._run_candidate,
+                        sandboxes,
+                        [answer for answer, _ in answers],
+                    )
+                )
+            failed_cells = [
+                sum(has_error(cell) for cell in notebook.cells)
+                for notebook, _ in candidates
+            ]
+            best = failed_cells.index(min(failed_cells))
+        finally:
+            for idx, candidate_sandbox in enumerate(sandboxes):
+                if idx != best:
+                    self._release_sandbox(candidate_sandbox)
+        logger.info(
+            f"[{self.session_id}]: Failed cells per candidate {failed_cells}, keeping candidate {best}"
+        )
+        self._wait_for_state()
+        self.notebook, should_stop = candidates[best]
+        return sandboxes[best], should_stop
+
+    def _release_sandbox(self, sandbox: JupyterSandbox):
+        """Return a kernel taken for candidates, the one given to `solve` is kept"""
+        if sandbox is not self.sandbox and self.candidate_pool is not None:
+            self.candidate_pool.release(sandbox)
+
+    def _begin_iteration(self, goal_idx: int, idx: int):
+        self.total_iterations += 1
+        logger.info(
+            f"[{self.session_id}]: Goal iteration {goal_idx} - Solver iteration {idx} (Total: {self.total_iterations}) ..."
+        )
 
-            logger.info(
-                f"[{self.session_id}]: Saving state at iteration {self.total_iterations}..."
-            )
-            self._save_state()
+    def _save_iteration(self):
+        logger.info(
+            f"[{self.session_id}]: Saving state at iteration {self.total_iterations}..."
+        )
+        # Written while the LLM request is in flight
+        self._save_state(snapshot=True)
 
-            notebook_state = JupyterCodeParser.render_notebook(self.notebook)
-            llm_prompt = self.prompt_factory.forward(
-                self.task,
-                notebook_state,
-                character=Character.GENERATE_CODE,
-            )
-            actions = self.llm_client.get_single_answer(llm_prompt)
-            self.notebook, should_stop = JupyterCodeActionParser.response_to_actions(
-                actions, sandbox=sandbox, notebook=self.notebook
-            )
-            if should_stop:
-                should_stop_goal = True
-                break
+    def _start_notebook(self, sandbox: NotebookSandbox):
+        if self.notebook is None:
+            self.notebook = self._init_notebook(sandbox)
+        else:
+            self.notebook = self._resume_notebook(sandbox, self.notebook)
+
+    def _update_goal(self, goal: str, answer: str) -> Tuple[str, bool]:
+        """The goal with the feedback of a critique answer, and whether to stop"""
+        feedback, should_stop = JupyterCritiqueActionsParser.response_to_actions(answer)
+        if should_stop:
+            return goal, True
+        logger.info(
+            f"[{self.session_id}]: Updating task with new goal - Feedback: {feedback}"
+        )
+        return self._combine_task_with_feedback(goal, feedback), False
+
+    def _generate(
+        self, sandbox: JupyterSandbox, llm_prompt: List[LlmMessage]
+    ) -> Tuple[JupyterSandbox, bool]:
+        """Apply the answer to the prompt, returns the sandbox that carries on
+
+        That is the sandbox of the kept candidate with several candidates, see
+        `_apply_best_candidate`, and whether to stop.
+        """
+        if self.candidate_pool is not None and NUM_CANDIDATES > 1:
+            return self._apply_best_candidate(sandbox, llm_prompt)
+        if LLM_STREAMING:
+            should_stop = self._apply_streamed_actions(sandbox, llm_prompt)
+            self._record_llm_usage(self.llm_client.last_usage)
+            return sandbox, should_stop
+        answer = self._get_answer(llm_prompt, Character.GENERATE_CODE)
+        self._wait_for_state()
+        return sandbox, self._apply_actions(sandbox, answer)
+
+    async def _agenerate(
+        self, sandbox: AsyncJupyterSandbox, llm_prompt: List[LlmMessage]
+    ) -> bool:
+        """`_generate` with a single complete answer, returns whether to stop
+
+        Streamed answers and candidates need blocking sandboxes, see `solve`.
+        """
+        answer = await self._aget_answer(llm_prompt, Character.GENERATE_CODE)
+        await asyncio.to_thread(self._wait_for_state)
+        return self._apply_actions(sandbox, answer)
+
+    async def _aexecute_notebook(
+        self, sandbox: AsyncJupyterSandbox, notebook: nbformat.NotebookNode
+    ) -> nbformat.NotebookNode:
+        with self._timed("kernel", cells=len(notebook.cells)) as span:
+            notebook = await sandbox.aexecute_notebook(notebook)
+            span["executed_cells"] = len(sandbox.last_executed_cells)
+        self._trace_cells(notebook, sandbox.last_executed_cells)
+        return notebook
 
-        return should_stop_goal
+    def solve(
+        self, sandbox: JupyterSandbox, candidate_pool: Optional[KernelPool] = None
+    ) -> nbformat.NotebookNode:
+        """Main solving loop.
 
-    def solve(self, sandbox: JupyterSandbox) -> nbformat.NotebookNode:
-        """Main solving loop."""
+        With a `candidate_pool`, `NUM_CANDIDATES` answers are tried in parallel
+        in kernels of the pool each iteration, see `_apply_best_candidate`.
+        """
+        self.sandbox = sandbox
+        self.candidate_pool = candidate_pool
         try:
-            # Initialize or load notebook
-            self.notebook = self._init_notebook(sandbox)
+            self._prepare_sandbox(sandbox)
+            self._start_notebook(sandbox)
             goal = self.task
 
             for goal_idx in range(MAX_GOAL_ITERATIONS):
-                should_stop = self._current_attempt_towards_goal(sandbox, goal_idx)
-                if should_stop:
+                for idx in range(MAX_ITERATIONS):
+                    self._begin_iteration(goal_idx, idx)
+                    self.notebook = self._execute_notebook(sandbox, self.notebook)
+                    llm_prompt = self._get_llm_prompt(Character.GENERATE_CODE)
+                    self._save_iteration()
+                    sandbox, self.finished = self._generate(sandbox, llm_prompt)
+                    if self.finished:
+                        break
+                if self.finished:
                     break
 
                 # Get feedback and update goal
-                notebook_state = JupyterCodeParser.render_notebook(self.notebook)
-                llm_prompt = self.prompt_factory.forward(
-                    self.task,
-                    notebook_state,
-                    character=Character.CRITIQUE_CODE,
-                )
-                actions = self.llm_client.get_single_answer(llm_prompt)
-                feedback, should_stop = (
-                    JupyterCritiqueActionsParser.response_to_actions(actions)
-                )
-                if should_stop:
+                llm_prompt = self._get_llm_prompt(Character.CRITIQUE_CODE)
+                answer = self._get_answer(llm_prompt, Character.CRITIQUE_CODE)
+                goal, self.finished = self._update_goal(goal, answer)
+                if self.finished:
+                    break
+
+        except Exception as e:
+            logger.error(f"Error solving task {self.task} with garmin agent: {e}")
+            raise
+        finally:
+            self._release_sandbox(sandbox)
+            self._finish_solve(sys.exc_info()[1])
+
+        return self.notebook
+
+    async def asolve(self, sandbox: AsyncJupyterSandbox) -> nbformat.NotebookNode:
+        """`solve` on an asyncio event loop, to run many tasks in one process
+
+        Cells are executed and answers requested without blocking the loop,
+        answers are applied once complete. Prompts are built and the final
+        state saved in threads. Cancelling the task, e.g. by a timeout, saves
+        the state like an interrupt does.
+        """
+        try:
+            await self._aprepare_sandbox(sandbox)
+            self._start_notebook(sandbox)
+            goal = self.task
+
+            for goal_idx in range(MAX_GOAL_ITERATIONS):
+                for idx in range(MAX_ITERATIONS):
+                    self._begin_iteration(goal_idx, idx)
+                    self.notebook = await self._aexecute_notebook(
+                        sandbox, self.notebook
+                    )
+                    llm_prompt = await asyncio.to_thread(
+                        self._get_llm_prompt, Character.GENERATE_CODE
+                    )
+                    self._save_iteration()
+                    self.finished = await self._agenerate(sandbox, llm_prompt)
+                    if self.finished:
+                        break
+                if self.finished:
                     break
 
-                logger.info(
-                    f"[{self.session_id}]: Updating task with new goal - Feedback: {feedback}"
+                llm_prompt = await asyncio.to_thread(
+                    self._get_llm_prompt, Character.CRITIQUE_CODE
                 )
-                goal = self._combine_task_with_feedback(goal, feedback)
+                answer = await self._aget_answer(llm_prompt, Character.CRITIQUE_CODE)
+                goal, self.finished = self._update_goal(goal, answer)
+                if self.finished:
+                    break
 
         except Exception as e:
             logger.error(f"Error solving task {self.task} with garmin agent: {e}")
-            self._save_state()
             raise
         finally:
-            self._save_state()
+            await asyncio.to_thread(self._finish_solve, sys.exc_info()[1])
 
         return self.notebook
 
+    def _finish_solve(self, error: Optional[BaseException] = None):
+        """Save the final state, `error` is the exception ending the solve
+
+        An error saving the state is only logged when it would mask `error`.
+        """
+        self._save_state()
+        try:
+            self.state_writer.close()
+        except Exception as e:
+            if error is None:
+                raise
+            logger.error(
+                f"[{self.session_id}]: Error saving state after {error!r}: {e}"
+            )
+        finally:
+            self.tracer.close()
+        cache = self.llm_client.cache
+        if cache is not None:
+            logger.info(
+                f"[{self.session_id}]: LLM cache hits: {cache.hits}, misses: {cache.misses}"
+            )
+
     def _combine_task_with_feedback(self, task: str, feedback: str) -> str:
         return f"{task}\n(feedback: {feedback})\n"
 
+    def _prepare_sandbox(self, sandbox: JupyterSandbox):
+        """Set up the kernel before `_init_notebook` or `_resume_notebook`
+
+        Those only edit the notebook, so they work with either sandbox.
+        """
+        pass
+
+    async def _aprepare_sandbox(self, sandbox: AsyncJupyterSandbox):
+        """`_prepare_sandbox` for an async sandbox"""
+        pass
+
     @abstractmethod
-    def _init_notebook(self, sandbox: JupyterSandbox) -> nbformat.NotebookNode:
+    def _init_notebook(self, sandbox: NotebookSandbox) -> nbformat.NotebookNode:
+        pass
+
+    @abstractmethod
+    def _resume_notebook(
+        self, sandbox: NotebookSandbox, notebook: nbformat.NotebookNode
+    ) -> nbformat.NotebookNode:
+        """The saved `notebook` to continue from"""
         pass
 
     @abstractmethod
@@ -223,18 +703,20 @@ class Solver:
 
 class GarminSolver(Solver):
     def _get_prompt_factory(self) -> JupyterCodeAgentPrompt:
-        with open(GARMIN_API_GUIDE_PATH, "r") as f:
-            api_guide = f.read()
-
         return JupyterCodeAgentPrompt(
-            ADDITIONAL_SYSTEM_PROMPT=f"""
-The following is the API guide for the Garmin Connect API:
-{api_guide}
-"""
+            ADDITIONAL_SYSTEM_PROMPT="""
+The notebook is logged in to the Garmin Connect API as `api`.
+""",
+            api_guide=ApiGuide.load(
+                GARMIN_API_GUIDE_PATH, cache_dir=API_GUIDE_CACHE_DIR
+            ),
         )
 
     def init_api(self):
         """Initialize Garmin API with credentials."""
+        if get_cache_mode() == CacheMode.REPLAY:
+            # Responses are served from the cache, no login needed
+            return
         tokenstore = os.getenv("GARMINTOKENSTORE")
         tokenstore_base64 = os.getenv("GARMINTOKENSTORE_BASE64")
         if not tokenstore and not tokenstore_base64:
@@ -254,29 +736,30 @@ The following is the API guide for the Garmin Connect API:
             garmin.login()
             garmin.garth.dump(tokenstore)
 
-    def _init_notebook(self, sandbox: JupyterSandbox) -> nbformat.NotebookNode:
-        notebook = sandbox.create_notebook()
-        sandbox.add_cell(notebook, content=f"{self.task}", cell_type=CellType.MARKDOWN)
-        sandbox.add_cell(
-            notebook,
-            content="""
-import os
-from garminconnect import Garmin
+    def _prepare_sandbox(self, sandbox: JupyterSandbox):
+        # The login cell is skipped, so login in the kernel directly
+        if not sandbox.has_preloaded(LOGIN_CODE) and not sandbox.preload(LOGIN_CODE):
+            raise Exception("Login failed. Try again in a few minutes.")
 
-tokenstore = os.getenv("GARMINTOKENSTORE")
-api = Garmin()
-api.login(tokenstore)
-""",
-            cell_type=CellType.CODE,
-        )
-        # Execute once to login
-        notebook = sandbox.execute_notebook(notebook)
-        if notebook.cells[1].outputs[0]["output_type"] == "error":
+    async def _aprepare_sandbox(self, sandbox: AsyncJupyterSandbox):
+        if not sandbox.has_preloaded(LOGIN_CODE) and not await sandbox.apreload(
+            LOGIN_CODE
+        ):
             raise Exception("Login failed. Try again in a few minutes.")
-        # Skip the login cell for next iterations
+
+    def _init_notebook(self, sandbox: NotebookSandbox) -> nbformat.NotebookNode:
+        notebook = sandbox.create_notebook()
+        sandbox.add_cell(notebook, content=f"{self.task}", cell_type=CellType.MARKDOWN)
+        sandbox.add_cell(notebook, content=LOGIN_CODE, cell_type=CellType.CODE)
+        # The kernel logged in when it was prepared
         notebook = sandbox.skip_cell_execution(notebook, 1)
         return notebook
 
+    def _resume_notebook(
+        self, sandbox: NotebookSandbox, notebook: nbformat.NotebookNode
+    ) -> nbformat.NotebookNode:
+        return notebook
+
 
 if __name__ == "__main__":
     with JupyterSandbox() as sandbox:
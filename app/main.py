@@ -1,9 +1,23 @@
 import argparse
+import asyncio
 import logging
+import os
 
-from app.garmin import GarminSolver
-from datetime import datetime
-from sandbox.notebook import JupyterSandbox
+from app.constants import (
+    CELL_CACHE_DIR,
+    CELL_CACHE_SIZE_LIMIT,
+    KERNEL_POOL_SIZE,
+    MAX_CONCURRENT_TASKS,
+    NUM_CANDIDATES,
+    TASK_TIMEOUT,
+)
+from app.garmin import KERNEL_PRELOAD, GarminSolver
+from datetime import date, datetime
+from sandbox.async_notebook import AsyncJupyterSandbox
+from sandbox.cache import CellOutputCache
+from sandbox.pool import KernelPool
+from typing import List
+from utils.profiling import profile
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -12,24 +26,108 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
-def solve(task: str, task_id: str, feedback: str):
+def solve(task: str, task_id: str, feedback: str, profile_run: bool = False):
     # timestamp
     unique_task_id = task_id or str(datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
 
-    with JupyterSandbox() as sandbox:
+    # cells fetch live data, so cached outputs are only reused on the same day
+    cell_cache = CellOutputCache(
+        CELL_CACHE_DIR, CELL_CACHE_SIZE_LIMIT, salt=date.today().isoformat()
+    )
+    # candidates run in kernels of their own
+    candidate_kernels = NUM_CANDIDATES if NUM_CANDIDATES > 1 else 0
+    # kernels boot and login while the solver initializes
+    with KernelPool(
+        KERNEL_POOL_SIZE + candidate_kernels,
+        preload=KERNEL_PRELOAD,
+        incremental=True,
+        cell_cache=cell_cache,
+    ) as pool:
         logger.info(f"Solving task {task} with garmin agent")
         solver = GarminSolver(task=task, task_id=unique_task_id, feedback=feedback)
         solver.init_solver()
-        solver.solve(sandbox)
+        with pool.sandbox() as sandbox:
+            # spans are always traced, see `Solver._timed`, cProfile on request
+            profile_path = os.path.join(solver.save_dir, "solve.prof")
+            with profile(profile_path if profile_run else None):
+                solver.solve(
+                    sandbox, candidate_pool=pool if candidate_kernels else None
+                )
+
+
+async def solve_task(
+    task: str,
+    task_id: str,
+    cell_cache: CellOutputCache,
+    timeout: float,
+    semaphore: asyncio.Semaphore,
+) -> bool:
+    """Solve a task in a kernel of its own, returns whether it finished in time"""
+    async with semaphore:
+        logger.info(f"Solving task {task_id}: {task}")
+        try:
+            async with AsyncJupyterSandbox(
+                incremental=True, cell_cache=cell_cache
+            ) as sandbox:
+                for code in KERNEL_PRELOAD:
+                    await sandbox.apreload(code)
+                solver = GarminSolver(task=task, task_id=task_id)
+                await asyncio.to_thread(solver.init_solver, handle_signals=False)
+                await asyncio.wait_for(solver.asolve(sandbox), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.error(f"Task {task_id} timed out after {timeout}s")
+        except Exception as e:
+            logger.error(f"Task {task_id} failed: {e}")
+        return False
+
+
+async def solve_many(
+    tasks: List[str],
+    timeout: float = TASK_TIMEOUT,
+    max_concurrency: int = MAX_CONCURRENT_TASKS,
+) -> List[bool]:
+    """Solve tasks concurrently in one event loop
+
+    At most `max_concurrency` kernels run at a time. A task that fails or
+    times out is logged and does not affect the others.
+    """
+    batch_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    cell_cache = CellOutputCache(
+        CELL_CACHE_DIR, CELL_CACHE_SIZE_LIMIT, salt=date.today().isoformat()
+    )
+    semaphore = asyncio.Semaphore(max_concurrency)
+    return await asyncio.gather(
+        *(
+            solve_task(task, f"{batch_id}_{idx}", cell_cache, timeout, semaphore)
+            for idx, task in enumerate(tasks)
+        )
+    )
 
 
 if __name__ == "__main__":
     # args
     parser = argparse.ArgumentParser()
-    parser.add_argument("--task", type=str, required=True)
+    tasks_group = parser.add_mutually_exclusive_group(required=True)
+    tasks_group.add_argument("--task", type=str)
+    # one task per line, solved concurrently
+    tasks_group.add_argument("--tasks-file", type=str)
     parser.add_argument("--task-id", type=str, required=False)
     parser.add_argument("--feedback", type=str, required=False)
+    parser.add_argument("--timeout", type=float, default=TASK_TIMEOUT)
+    # cProfile the solver into the artifacts of the task
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENT_TASKS)
     args = parser.parse_args()
-    solve(args.task, args.task_id, args.feedback or "")
+    if args.tasks_file and args.profile:
+        # cProfile follows a single thread, not the tasks of an event loop
+        parser.error("--profile only works with --task")
+    if args.tasks_file:
+        with open(args.tasks_file, "r") as f:
+            tasks = [line.strip() for line in f if line.strip()]
+        results = asyncio.run(solve_many(tasks, args.timeout, args.max_concurrency))
+        logger.info(f"Finished {sum(results)} of {len(tasks)} tasks")
+    else:
+        solve(args.task, args.task_id, args.feedback or "", args.profile)
 
     # solve("Plot my sleep times for last week")
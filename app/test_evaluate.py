@@ -0,0 +1,62 @@
+from app.evaluate import EvalTask, get_report, load_tasks
+from nbformat.v4 import new_code_cell, new_notebook, new_output
+from types import SimpleNamespace
+
+
+def test_load_tasks_merges_unquoted_notes(tmp_path):
+    path = tmp_path / "tasks.csv"
+    path.write_text(
+        "task, solved?, notes\n"
+        "Plot my sleep, yes, uses sleep_frame, not the raw api\n"
+        "\n"
+        "Count my steps, no,\n"
+    )
+    tasks = load_tasks(str(path))
+    assert tasks == [
+        EvalTask("Plot my sleep", "yes", "uses sleep_frame, not the raw api"),
+        EvalTask("Count my steps", "no", ""),
+    ]
+
+
+def make_solver(failed: bool, finished: bool = True) -> SimpleNamespace:
+    outputs = [new_output("error", ename="E", evalue="", traceback=[])]
+    notebook = new_notebook(
+        cells=[
+            new_code_cell("x = 1"),
+            new_code_cell("x", outputs=outputs if failed else []),
+        ]
+    )
+    counts = {"system": 10, "api_guide": 5, "task": 2, "notebook": 3}
+    return SimpleNamespace(
+        task_id="eval_0",
+        notebook=notebook,
+        finished=finished,
+        total_iterations=2,
+        token_counts=[
+            {
+                **counts,
+                "usage": {
+                    "prompt_tokens": 20,
+                    "cached_tokens": 8,
+                    "completion_tokens": 4,
+                },
+            },
+            # answered from the LLM cache
+            counts,
+        ],
+    )
+
+
+def test_get_report_passes_finished_solves_without_failed_cells():
+    task = EvalTask("Plot my sleep", "yes", "")
+    report = get_report(make_solver(failed=False), task, None, 1.5)
+    assert report.passed and report.failed_cells == 0
+    assert report.llm_requests == 2
+    assert (report.prompt_tokens, report.cached_tokens) == (20, 8)
+    assert report.completion_tokens == 4
+    assert report.estimated_prompt_tokens == 40
+
+    assert not get_report(make_solver(failed=True), task, None, 1.5).passed
+    assert get_report(make_solver(failed=True), task, None, 1.5).failed_cells == 1
+    assert not get_report(make_solver(False, finished=False), task, None, 1.5).passed
+    assert not get_report(make_solver(failed=False), task, "Error: x", 1.5).passed
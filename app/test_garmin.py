@@ -0,0 +1,30 @@
+from agent.llm import LlmClient
+from agent.models import LlmModel, LlmParameterConfig, LlmProviderConfig
+from app.bench_solver import BenchSolver
+from nbformat.v4 import new_markdown_cell, new_notebook
+
+
+def get_solver(artifact_dir: str) -> BenchSolver:
+    solver = BenchSolver(task="Benchmark", task_id="t", artifact_dir=artifact_dir)
+    llm_client = LlmClient(
+        id="t",
+        provider_config=LlmProviderConfig(model=LlmModel.GEMINI_2_0_FLASH, api_key=""),
+        parameter_config=LlmParameterConfig(),
+    )
+    solver.init_solver(handle_signals=False, llm_client=llm_client)
+    return solver
+
+
+def test_interrupted_iteration_leaves_a_resumable_checkpoint(tmp_path):
+    solver = get_solver(str(tmp_path))
+    solver.notebook = new_notebook(cells=[new_markdown_cell("Benchmark")])
+    solver._begin_iteration(0, 0)
+    solver._save_iteration()
+    # interrupted while the cells of the second iteration execute
+    solver._begin_iteration(0, 1)
+    solver._finish_solve(KeyboardInterrupt())
+
+    resumed = get_solver(str(tmp_path))
+    assert resumed.total_iterations == 2
+    assert len(resumed.state_trajectory) == 2
+    assert resumed.state_trajectory[-1].cells[0].source == "Benchmark"
@@ -0,0 +1,133 @@
+import logging
+import nbformat
+
+from jupyter_client import AsyncKernelManager
+from jupyter_client.asynchronous import AsyncKernelClient
+from jupyter_client.session import Session
+from jupyter_core.utils import run_sync
+from nbclient import NotebookClient
+from nbformat.v4 import new_notebook
+from sandbox.cache import CellOutputCache
+from sandbox.notebook import NotebookSandbox, is_executable_cell
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncJupyterSandbox(NotebookSandbox):
+    """Sandbox whose kernel is driven by an asyncio event loop
+
+    Uses jupyter_client's async kernel manager and client, so one event loop
+    can execute the notebooks of many sandboxes concurrently. The kernel is
+    started by `start` (or `async with`) and shut down by `aclose`. Notebook
+    editing is shared with `JupyterSandbox`, execution is `aexecute_notebook`.
+    """
+
+    def __init__(
+        self,
+        kernel_name="python3",
+        incremental: bool = False,
+        cell_cache: Optional[CellOutputCache] = None,
+    ):
+        super().__init__(kernel_name, incremental, cell_cache)
+        self._kernel_manager: Optional[AsyncKernelManager] = None
+        self._kernel_client: Optional[AsyncKernelClient] = None
+        self._notebook_client: Optional[NotebookClient] = None
+
+    async def start(self) -> "AsyncJupyterSandbox":
+        kernel_manager = AsyncKernelManager(kernel_name=self.kernel_name)
+        self._kernel_manager = kernel_manager
+        await kernel_manager.start_kernel()
+        # A separate session keeps this client's zmq identity distinct from the
+        # executor's client, see `JupyterSandbox`
+        kernel_client = kernel_manager.client(
+            session=Session(
+                key=kernel_manager.session.key,
+                signature_scheme=kernel_manager.session.signature_scheme,
+            )
+        )
+        self._kernel_client = kernel_client
+        kernel_client.start_channels()
+        await kernel_client.wait_for_ready(timeout=self.timeout)
+
+        notebook_client = NotebookClient(
+            new_notebook(),
+            km=kernel_manager,
+            kernel_name=self.kernel_name,
+            timeout=self.timeout,
+            allow_errors=False,
+        )
+        self._notebook_client = notebook_client
+        await notebook_client.async_start_new_kernel_client()
+        return self
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+        return False
+
+    async def aclose(self):
+        """Shutdown the kernel"""
+        if self._notebook_client is not None and self._notebook_client.kc:
+            self._notebook_client.kc.stop_channels()
+            self._notebook_client = None
+        if self._kernel_client:
+            self._kernel_client.stop_channels()
+            self._kernel_client = None
+        if self._kernel_manager:
+            await self._kernel_manager.shutdown_kernel(now=True)
+            self._kernel_manager = None
+
+    def shutdown(self):
+        """Blocking `aclose`, e.g. when the sandbox is garbage collected"""
+        if self._kernel_manager is not None:
+            run_sync(self.aclose)()
+
+    def _get_clients(self) -> Tuple[AsyncKernelClient, NotebookClient]:
+        if self._kernel_client is None or self._notebook_client is None:
+            raise RuntimeError("The sandbox is not started, see `start`")
+        return self._kernel_client, self._notebook_client
+
+    async def apreload(self, code: str) -> bool:
+        """Run code in the kernel ahead of any notebook, returns whether it succeeded"""
+        kernel_client, _ = self._get_clients()
+        reply = await kernel_client.execute_interactive(
+            code, timeout=self.timeout, output_hook=lambda msg: None
+        )
+        if reply["content"]["status"] != "ok":
+            logger.warning(
+                f"Error preloading kernel: {reply['content'].get('ename')}: "
+                f"{reply['content'].get('evalue')}"
+            )
+            return False
+        self.preloaded_code.append(code)
+        return True
+
+    async def aexecute_notebook(
+        self, notebook: nbformat.NotebookNode
+    ) -> nbformat.NotebookNode:
+        """Execute all cells in the notebook, or only the stale ones if incremental
+
+        Execution stops at the first failing cell, like `execute_notebook`.
+        """
+        _, client = self._get_clients()
+        to_execute, cache_keys = self._prepare_execution(notebook)
+        if not to_execute:
+            return notebook
+        client.nb = notebook
+        client.reset_execution_trackers()
+        executed_cells: List[int] = []
+        try:
+            for idx in sorted(to_execute):
+                cell = notebook.cells[idx]
+                if not is_executable_cell(cell):
+                    continue
+                await client.async_execute_cell(cell, idx, store_history=True)
+                executed_cells.append(idx)
+        except Exception as e:
+            logger.debug(f"Execution stopped at cell {idx}: {e}")
+        finally:
+            self._finish_execution(notebook, to_execute, executed_cells, cache_keys)
+        return notebook
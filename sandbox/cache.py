@@ -0,0 +1,40 @@
+import diskcache
+import hashlib
+import json
+import nbformat
+
+from typing import List, Optional
+
+
+class CellOutputCache:
+    """On-disk cache of cell outputs, keyed by cell source and upstream state
+
+    Entries are evicted least-recently-used once the cache grows past
+    `size_limit` bytes. Outputs of cells fetching live data go stale, so
+    `salt` can be used to scope entries, e.g. to the current day.
+    """
+
+    def __init__(self, directory: str, size_limit: int, salt: str = ""):
+        self.salt = salt
+        self._cache = diskcache.Cache(
+            directory,
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+
+    def get_key(self, source: str, upstream_keys: List[str]) -> str:
+        """Content address of a cell given the keys of the cells it depends on"""
+        content = "\n".join([self.salt, source, *sorted(upstream_keys)])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[nbformat.NotebookNode]]:
+        outputs = self._cache.get(key)
+        if outputs is None:
+            return None
+        return [nbformat.from_dict(output) for output in json.loads(outputs)]
+
+    def set(self, key: str, outputs: List[nbformat.NotebookNode]):
+        self._cache.set(key, json.dumps(outputs))
+
+    def close(self):
+        self._cache.close()
@@ -1,15 +1,25 @@
+import ast
+import hashlib
+import json
 import logging
 import nbformat
 import time
 
+from abc import abstractmethod
+from dataclasses import dataclass
 from enum import Enum
 from jupyter_client import KernelManager
+from jupyter_client.session import Session
 from nbconvert.preprocessors import ExecutePreprocessor
 from nbformat.v4 import new_code_cell, new_markdown_cell, new_notebook
-from typing import Any, Dict
+from sandbox.cache import CellOutputCache
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
+# Cell metadata holding the hash of the outputs, set along with them
+OUTPUTS_HASH = "outputs_hash"
+
 
 class CellType(Enum):
     CODE = "code"
@@ -20,11 +30,300 @@ class CellType(Enum):
         return cls.CODE
 
 
+def get_cell_key(cell: nbformat.NotebookNode, idx: int) -> str:
+    """Stable identifier of a cell, falling back to its position for old notebooks"""
+    return cell.get("id") or f"idx-{idx}"
+
+
+def hash_cell_source(cell: nbformat.NotebookNode) -> str:
+    return hashlib.sha256(cell.source.encode("utf-8")).hexdigest()
+
+
+def hash_cell_outputs(cell: nbformat.NotebookNode) -> str:
+    """Hash of the outputs, the stored one if a sandbox set them"""
+    if OUTPUTS_HASH in cell.metadata:
+        return cell.metadata[OUTPUTS_HASH]
+    content = json.dumps(cell.get("outputs", []), sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def store_outputs_hash(cell: nbformat.NotebookNode):
+    """Hash the outputs once when they are set, instead of on every read"""
+    cell.metadata.pop(OUTPUTS_HASH, None)
+    cell.metadata[OUTPUTS_HASH] = hash_cell_outputs(cell)
+
+
+def is_executable_cell(cell: nbformat.NotebookNode) -> bool:
+    return CellType(cell.cell_type) == CellType.CODE and cell.metadata.get(
+        "execute", True
+    )
+
+
+def has_error(cell: nbformat.NotebookNode) -> bool:
+    return any(
+        output.get("output_type") == "error" for output in cell.get("outputs", [])
+    )
+
+
+# Methods that mutate their object in place, so calling them redefines its name
+MUTATING_METHODS = {
+    "add",
+    "append",
+    "clear",
+    "discard",
+    "extend",
+    "insert",
+    "pop",
+    "popitem",
+    "remove",
+    "reverse",
+    "setdefault",
+    "sort",
+    "update",
+}
+
+
+@dataclass
+class CellDefUse:
+    """Global names a cell (re)defines and reads"""
+
+    defs: Set[str]
+    uses: Set[str]
+    # the cell could not be analysed and may define / read any name
+    opaque: bool = False
+
+
+def _root_name(node: ast.expr) -> Optional[str]:
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Starred)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+class _DefUseVisitor(ast.NodeVisitor):
+    def __init__(self):
+        self.defs: Set[str] = set()
+        self.uses: Set[str] = set()
+        self.opaque = False
+        # depth of function / class / comprehension scopes
+        self._depth = 0
+        self._globals: Set[str] = set()
+
+    def _define(self, name: str):
+        if self._depth == 0 or name in self._globals:
+            self.defs.add(name)
+
+    def _visit_scope(self, node: ast.AST):
+        self._depth += 1
+        self.generic_visit(node)
+        self._depth -= 1
+
+    def visit_Name(self, node: ast.Name):
+        if isinstance(node.ctx, ast.Load):
+            self.uses.add(node.id)
+        else:
+            self._define(node.id)
+
+    def visit_AugAssign(self, node: ast.AugAssign):
+        name = _root_name(node.target)
+        if name:
+            self.uses.add(name)
+        self.generic_visit(node)
+
+    def _visit_target(self, node: Union[ast.Attribute, ast.Subscript]):
+        # `df["x"] = ...` or `obj.attr = ...` mutates `df` / `obj`
+        name = _root_name(node)
+        if name and not isinstance(node.ctx, ast.Load):
+            self.uses.add(name)
+            self._define(name)
+        self.generic_visit(node)
+
+    visit_Attribute = _visit_target
+    visit_Subscript = _visit_target
+
+    def visit_Call(self, node: ast.Call):
+        if isinstance(node.func, ast.Attribute) and (
+            node.func.attr in MUTATING_METHODS
+            or any(
+                keyword.arg == "inplace"
+                and isinstance(keyword.value, ast.Constant)
+                and keyword.value.value is True
+                for keyword in node.keywords
+            )
+        ):
+            name = _root_name(node.func.value)
+            if name:
+                self._define(name)
+        self.generic_visit(node)
+
+    def visit_Import(self, node: Union[ast.Import, ast.ImportFrom]):
+        for alias in node.names:
+            if alias.name == "*":
+                self.opaque = True
+            else:
+                self._define(alias.asname or alias.name.split(".")[0])
+
+    visit_ImportFrom = visit_Import
+
+    def visit_Global(self, node: ast.Global):
+        self._globals.update(node.names)
+
+    def _visit_definition(
+        self, node: Union[ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]
+    ):
+        self._define(node.name)
+        self._visit_scope(node)
+
+    visit_FunctionDef = _visit_definition
+    visit_AsyncFunctionDef = _visit_definition
+    visit_ClassDef = _visit_definition
+    visit_Lambda = _visit_scope
+    visit_ListComp = _visit_scope
+    visit_SetComp = _visit_scope
+    visit_DictComp = _visit_scope
+    visit_GeneratorExp = _visit_scope
+
+
+def analyse_cell_source(source: str) -> CellDefUse:
+    """Find the global names a code cell defines and reads
+
+    Names read inside function bodies count as reads of the cell, so a cell
+    defining a function depends on the globals the function uses.
+    """
+    if source.lstrip().startswith("%%"):
+        # cell magics run arbitrary code
+        return CellDefUse(defs=set(), uses=set(), opaque=True)
+    # line magics and shell commands are not python
+    lines = [
+        line[: len(line) - len(line.lstrip())] + "pass"
+        if line.lstrip().startswith(("%", "!"))
+        else line
+        for line in source.splitlines()
+    ]
+    try:
+        tree = ast.parse("\n".join(lines))
+    except SyntaxError:
+        return CellDefUse(defs=set(), uses=set(), opaque=True)
+    visitor = _DefUseVisitor()
+    visitor.visit(tree)
+    return CellDefUse(defs=visitor.defs, uses=visitor.uses, opaque=visitor.opaque)
+
+
+class CellDependencyGraph:
+    """Def/use dependencies between the executable cells of a notebook
+
+    A cell depends on the last cell before it that defines a name it reads.
+    Opaque cells depend on, and are depended on by, every other cell.
+    """
+
+    def __init__(self, notebook: nbformat.NotebookNode):
+        self.cells: Dict[int, CellDefUse] = {
+            idx: analyse_cell_source(cell.source)
+            for idx, cell in enumerate(notebook.cells)
+            if is_executable_cell(cell)
+        }
+        self._upstream: Dict[int, Set[int]] = {}
+        last_definition: Dict[str, int] = {}
+        opaque_cells: Set[int] = set()
+        for idx, cell in self.cells.items():
+            if cell.opaque:
+                self._upstream[idx] = set(self._upstream)
+                opaque_cells.add(idx)
+            else:
+                self._upstream[idx] = opaque_cells | {
+                    last_definition[name]
+                    for name in cell.uses
+                    if name in last_definition
+                }
+            for name in cell.defs:
+                last_definition[name] = idx
+
+    def upstream(self, idx: int) -> Set[int]:
+        """Cells whose definitions the cell at `idx` reads"""
+        return self._upstream[idx]
+
+    def stale_cells(
+        self, changed: Dict[int, Set[str]], removed_names: Set[str]
+    ) -> Set[int]:
+        """Cells to re-execute after some cells changed
+
+        Args:
+            changed: indices of new / modified cells, mapped to the names their
+                previous version defined in the kernel
+            removed_names: names defined in the kernel by deleted cells
+
+        A stale cell taints the names it defines; every later cell reading or
+        redefining a tainted name is stale too. Names whose kernel value is ahead
+        of the position they are needed at are tainted from the first cell on, so
+        their earlier definitions are re-executed to restore them.
+        """
+        # names the kernel holds from each cell or a cell after it
+        defined_after: Dict[int, Set[str]] = {}
+        opaque_after: Dict[int, bool] = {}
+        names: Set[str] = set()
+        opaque = False
+        for idx in reversed(list(self.cells)):
+            cell = self.cells[idx]
+            kernel_defs = changed[idx] if idx in changed else cell.defs
+            names = names | kernel_defs
+            opaque = opaque or (cell.opaque and idx not in changed)
+            defined_after[idx] = names
+            opaque_after[idx] = opaque
+
+        tainted = set(removed_names)
+        for idx, previous_defs in changed.items():
+            cell = self.cells[idx]
+            # previously defined names which the new source no longer redefines
+            tainted |= previous_defs - cell.defs
+            # names read by the cell which were redefined since it originally ran
+            tainted |= cell.uses & (
+                cell.uses if opaque_after[idx] else defined_after[idx]
+            )
+
+        stale: Set[int] = set()
+        taint_all = False
+        for idx, cell in self.cells.items():
+            if not (
+                idx in changed
+                or taint_all
+                or cell.defs & tainted
+                or cell.uses & tainted
+                or (cell.opaque and tainted)
+            ):
+                continue
+            stale.add(idx)
+            tainted |= cell.defs | changed.get(idx, set())
+            taint_all = taint_all or cell.opaque
+        return stale
+
+
+@dataclass
+class ExecutedCell:
+    """A cell which has been run in the live kernel"""
+
+    key: str
+    source_hash: str
+    # global names the cell defined when it ran
+    defs: Set[str]
+    # an upstream cell changed since and the cell is yet to re-run
+    stale: bool = False
+
+
 class SkipCellExecutePreprocessor(ExecutePreprocessor):
     """
     https://stackoverflow.com/a/38064506
     """
 
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        # indices of the cells to run in the next preprocess call, None runs all
+        self.cells_to_execute: Optional[Set[int]] = None
+        # indices of the cells that ran to completion in the last preprocess call
+        self.executed_cells: List[int] = []
+
+    def preprocess(self, nb, resources=None, km=None):
+        self.executed_cells = []
+        return super().preprocess(nb, resources=resources, km=km)
+
     def preprocess_cell(self, cell, resources, cell_index):
         """
         Executes a single code cell. See base.py for details.
@@ -32,52 +331,52 @@ class SkipCellExecutePreprocessor(ExecutePreprocessor):
 
         Checks cell.metadata for 'execute' key. If set, and maps to False,
           the cell is not executed.
+        Cells not in `cells_to_execute` are not executed either.
         """
 
         if not cell.metadata.get("execute", True):
             # Don't execute this cell in output
             return cell, resources
 
-        return super().preprocess_cell(cell, resources, cell_index)
-
-
-class JupyterSandbox:
-    def __init__(self, kernel_name="python3"):
-        self.kernel_name = kernel_name
-        self.timeout = 600  # timeout in seconds
+        if (
+            self.cells_to_execute is not None
+            and cell_index not in self.cells_to_execute
+        ):
+            return cell, resources
 
-        # Initialize kernel manager
-        self._kernel_manager = KernelManager(kernel_name=self.kernel_name)
-        self._kernel_manager.start_kernel()
-        self._kernel_client = self._kernel_manager.client()
-        self._kernel_client.start_channels()
+        cell, resources = super().preprocess_cell(cell, resources, cell_index)
+        self.executed_cells.append(cell_index)
+        return cell, resources
 
-        self._executor = SkipCellExecutePreprocessor(
-            timeout=self.timeout,
-            kernel_name=self.kernel_name,
-            kernel_manager=self._kernel_manager,
-        )
-        self._executor.allow_errors = False
 
-    def __enter__(self):
-        """Support for context manager protocol"""
-        return self
+class NotebookSandbox:
+    """Notebook editing and the bookkeeping of what ran in a kernel
 
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        """Cleanup when exiting context manager"""
-        self.shutdown()
-        return False  # Don't suppress any exceptions
+    Subclasses own the kernel, see `JupyterSandbox` and `AsyncJupyterSandbox`.
+    """
 
+    def __init__(
+        self,
+        kernel_name: str = "python3",
+        incremental: bool = False,
+        cell_cache: Optional[CellOutputCache] = None,
+    ):
+        self.kernel_name = kernel_name
+        self.timeout = 600  # timeout in seconds
+        # Only execute new / modified cells and the cells depending on them
+        self.incremental = incremental
+        # Reattach previously computed outputs instead of executing cells
+        self.cell_cache = cell_cache
+        # Cells run in the live kernel, by cell key
+        self._executed_cells: Dict[str, ExecutedCell] = {}
+        # Code run in the live kernel outside of any notebook
+        self.preloaded_code: List[str] = []
+        # Indices of the cells run by the last execution, e.g. for profiling
+        self.last_executed_cells: List[int] = []
+
+    @abstractmethod
     def shutdown(self):
-        """Properly shutdown the kernel"""
-        if self._kernel_client:
-            self._kernel_client.stop_channels()
-            # Add a small delay to allow channels to close
-            time.sleep(0.5)
-            self._kernel_client = None
-        if self._kernel_manager:
-            self._kernel_manager.shutdown_kernel(now=True)
-            self._kernel_manager = None
+        pass
 
     def __del__(self):
         """Ensure kernel is shutdown when object is deleted"""
@@ -87,6 +386,9 @@ class JupyterSandbox:
             # Avoid raising exceptions during garbage collection
             logger.warning(f"Error during kernel shutdown: {e}")
 
+    def has_preloaded(self, code: str) -> bool:
+        return code in self.preloaded_code
+
     def create_notebook(self) -> nbformat.NotebookNode:
         """Create a new empty notebook"""
         return new_notebook()
@@ -145,8 +447,223 @@ class JupyterSandbox:
         with open(filepath, "r", encoding="utf-8") as f:
             return nbformat.read(f, as_version=4)
 
+    def plan_execution(
+        self,
+        notebook: nbformat.NotebookNode,
+        graph: Optional[CellDependencyGraph] = None,
+    ) -> Set[int]:
+        """Indices of the cells that need to run to bring the kernel up to date
+
+        New and modified cells are re-executed along with the cells that depend
+        on them, see `CellDependencyGraph.stale_cells`.
+        """
+        graph = graph or CellDependencyGraph(notebook)
+        changed: Dict[int, Set[str]] = {}
+        current_keys = set()
+        for idx in graph.cells:
+            cell = notebook.cells[idx]
+            key = get_cell_key(cell, idx)
+            current_keys.add(key)
+            executed = self._executed_cells.get(key)
+            if executed is None:
+                changed[idx] = set()
+            elif executed.stale or executed.source_hash != hash_cell_source(cell):
+                changed[idx] = executed.defs
+        removed_names: Set[str] = set()
+        for key, executed in self._executed_cells.items():
+            if key not in current_keys:
+                removed_names |= executed.defs
+        return graph.stale_cells(changed, removed_names)
+
+    def _reattach_cached_outputs(
+        self,
+        notebook: nbformat.NotebookNode,
+        graph: CellDependencyGraph,
+        to_execute: Set[int],
+        cache_keys: Dict[int, str],
+    ) -> Set[int]:
+        """Reattach cached outputs to the cells no executed cell depends on
+
+        Returns the cells left to execute. Cells served from the cache are not
+        run in the kernel, so they stay stale and are executed as soon as a cell
+        reading their definitions has to run.
+        """
+        assert self.cell_cache is not None
+        cached_outputs = {}
+        for idx in to_execute:
+            outputs = self.cell_cache.get(cache_keys[idx])
+            if outputs is not None:
+                cached_outputs[idx] = outputs
+        left_to_execute = to_execute - cached_outputs.keys()
+        pending = list(left_to_execute)
+        while pending:
+            for upstream_idx in graph.upstream(pending.pop()):
+                if (
+                    upstream_idx in cached_outputs
+                    and upstream_idx not in left_to_execute
+                ):
+                    left_to_execute.add(upstream_idx)
+                    pending.append(upstream_idx)
+        for idx, outputs in cached_outputs.items():
+            if idx not in left_to_execute:
+                notebook.cells[idx].outputs = outputs
+                store_outputs_hash(notebook.cells[idx])
+        logger.info(
+            f"Reattached cached outputs of {len(to_execute) - len(left_to_execute)} cells"
+        )
+        return left_to_execute
+
+    def _record_execution(
+        self,
+        notebook: nbformat.NotebookNode,
+        to_execute: Set[int],
+        executed_cells: List[int],
+    ):
+        """Update the bookkeeping with the cells that ran to completion"""
+        executed = set(executed_cells)
+        completed = True
+        current: Dict[str, ExecutedCell] = {}
+        for idx, cell in enumerate(notebook.cells):
+            if not is_executable_cell(cell):
+                continue
+            key = get_cell_key(cell, idx)
+            if idx in executed:
+                current[key] = ExecutedCell(
+                    key=key,
+                    source_hash=hash_cell_source(cell),
+                    defs=analyse_cell_source(cell.source).defs,
+                )
+            elif idx in to_execute:
+                # execution stopped at an error, the rest is stale
+                completed = False
+                if key in self._executed_cells:
+                    self._executed_cells[key].stale = True
+                    current[key] = self._executed_cells[key]
+            elif key in self._executed_cells:
+                current[key] = self._executed_cells[key]
+        if not completed:
+            # keep deleted cells around until their dependents re-ran
+            for key, executed_cell in self._executed_cells.items():
+                current.setdefault(key, executed_cell)
+        self._executed_cells = current
+
+    def _prepare_execution(
+        self, notebook: nbformat.NotebookNode
+    ) -> Tuple[Set[int], Dict[int, str]]:
+        """Cells to execute and their cell cache keys, cached outputs are reattached"""
+        self.last_executed_cells = []
+        graph = CellDependencyGraph(notebook)
+        if self.incremental:
+            to_execute = self.plan_execution(notebook, graph)
+        else:
+            to_execute = set(graph.cells)
+        cache_keys: Dict[int, str] = {}
+        if self.cell_cache is not None:
+            for idx in graph.cells:
+                cache_keys[idx] = self.cell_cache.get_key(
+                    notebook.cells[idx].source,
+                    [cache_keys[upstream] for upstream in graph.upstream(idx)],
+                )
+            to_execute = self._reattach_cached_outputs(
+                notebook, graph, to_execute, cache_keys
+            )
+        return to_execute, cache_keys
+
+    def _finish_execution(
+        self,
+        notebook: nbformat.NotebookNode,
+        to_execute: Set[int],
+        executed_cells: List[int],
+        cache_keys: Dict[int, str],
+    ):
+        self._record_execution(notebook, to_execute, executed_cells)
+        self.last_executed_cells = list(executed_cells)
+        # the cell execution stopped at has new outputs too
+        for idx in to_execute:
+            store_outputs_hash(notebook.cells[idx])
+        if self.cell_cache is not None:
+            for idx in executed_cells:
+                self.cell_cache.set(cache_keys[idx], notebook.cells[idx].outputs)
+
+
+class JupyterSandbox(NotebookSandbox):
+    def __init__(
+        self,
+        kernel_name="python3",
+        incremental: bool = False,
+        cell_cache: Optional[CellOutputCache] = None,
+    ):
+        super().__init__(kernel_name, incremental, cell_cache)
+
+        # Initialize kernel manager
+        self._kernel_manager = KernelManager(kernel_name=self.kernel_name)
+        self._kernel_manager.start_kernel()
+        # A separate session keeps this client's zmq identity distinct from the
+        # executor's client, otherwise kernel replies can be routed to either one
+        self._kernel_client = self._kernel_manager.client(
+            session=Session(
+                key=self._kernel_manager.session.key,
+                signature_scheme=self._kernel_manager.session.signature_scheme,
+            )
+        )
+        self._kernel_client.start_channels()
+        # Make sure iopub is subscribed, messages published before are lost
+        self._kernel_client.wait_for_ready(timeout=self.timeout)
+
+        self._executor = SkipCellExecutePreprocessor(
+            timeout=self.timeout,
+            kernel_name=self.kernel_name,
+            kernel_manager=self._kernel_manager,
+        )
+        self._executor.allow_errors = False
+
+    def __enter__(self):
+        """Support for context manager protocol"""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Cleanup when exiting context manager"""
+        self.shutdown()
+        return False  # Don't suppress any exceptions
+
+    def shutdown(self):
+        """Properly shutdown the kernel"""
+        if self._kernel_client:
+            self._kernel_client.stop_channels()
+            # Add a small delay to allow channels to close
+            time.sleep(0.5)
+            self._kernel_client = None
+        if self._kernel_manager:
+            self._kernel_manager.shutdown_kernel(now=True)
+            self._kernel_manager = None
+
+    def restart(self):
+        """Restart the kernel, dropping all state"""
+        self._kernel_manager.restart_kernel(now=True)
+        self._kernel_client.wait_for_ready(timeout=self.timeout)
+        self._executed_cells = {}
+        self.preloaded_code = []
+
+    def preload(self, code: str) -> bool:
+        """Run code in the kernel ahead of any notebook, returns whether it succeeded"""
+        reply = self._kernel_client.execute_interactive(
+            code, timeout=self.timeout, output_hook=lambda msg: None
+        )
+        if reply["content"]["status"] != "ok":
+            logger.warning(
+                f"Error preloading kernel: {reply['content'].get('ename')}: "
+                f"{reply['content'].get('evalue')}"
+            )
+            return False
+        self.preloaded_code.append(code)
+        return True
+
     def execute_notebook(self, notebook: nbformat.NotebookNode):
-        """Execute all cells in the notebook"""
+        """Execute all cells in the notebook, or only the stale ones if incremental"""
+        to_execute, cache_keys = self._prepare_execution(notebook)
+        if not to_execute:
+            return notebook
+        self._executor.cells_to_execute = to_execute
         try:
             # Execute the notebook
             # The input argument *nb* is modified in-place.
@@ -156,6 +673,10 @@ class JupyterSandbox:
             return executed_notebook
         except Exception as _:
             return notebook
+        finally:
+            self._finish_execution(
+                notebook, to_execute, self._executor.executed_cells, cache_keys
+            )
 
     def execute_cell(
         self, notebook: nbformat.NotebookNode, cell_index: int
@@ -177,6 +698,7 @@ class JupyterSandbox:
             self._executor.preprocess_cell(
                 notebook.cells[cell_index], resources={}, cell_index=cell_index
             )
+            store_outputs_hash(notebook.cells[cell_index])
 
             return {
                 "success": True,
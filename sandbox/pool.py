@@ -0,0 +1,119 @@
+import logging
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from sandbox.notebook import JupyterSandbox
+from typing import Any, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class KernelPool:
+    """Pool of sandboxes whose kernels are started and preloaded ahead of time
+
+    Each sandbox is handed out to one task at a time. Once released, its kernel
+    is restarted and preloaded again in the background, so the next task gets
+    a clean kernel without waiting for it to boot.
+    """
+
+    def __init__(
+        self, size: int, preload: Optional[List[str]] = None, **sandbox_kwargs: Any
+    ):
+        self.size = size
+        # code run in every kernel before it is handed out, e.g. imports
+        self.preload = preload or []
+        self._sandbox_kwargs = sandbox_kwargs
+        self._sandboxes: List[JupyterSandbox] = []
+        # None once no kernel is left and none is starting, see `acquire`
+        self._ready: queue.Queue[Optional[JupyterSandbox]] = queue.Queue()
+        self._closed = False
+        # guards `_sandboxes` and the number of kernels still starting
+        self._lock = threading.Lock()
+        self._starting = size
+        self._executor = ThreadPoolExecutor(max_workers=size)
+        for _ in range(size):
+            self._executor.submit(self._start_sandbox)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        return False
+
+    def _preload(self, sandbox: JupyterSandbox):
+        for code in self.preload:
+            if self._closed:
+                return
+            sandbox.preload(code)
+        self._ready.put(sandbox)
+
+    def _start_sandbox(self):
+        try:
+            sandbox = JupyterSandbox(**self._sandbox_kwargs)
+        except Exception as e:
+            logger.error(f"Error starting pooled kernel: {e}")
+            with self._lock:
+                self._starting -= 1
+                if not self._starting and not self._sandboxes:
+                    self._ready.put(None)
+            return
+        with self._lock:
+            self._starting -= 1
+            self._sandboxes.append(sandbox)
+        self._preload(sandbox)
+
+    def _recycle(self, sandbox: JupyterSandbox):
+        if self._closed:
+            return
+        try:
+            sandbox.restart()
+        except Exception as e:
+            # replace the sandbox rather than handing out a broken kernel
+            logger.warning(f"Error restarting pooled kernel, replacing it: {e}")
+            with self._lock:
+                self._sandboxes.remove(sandbox)
+                self._starting += 1
+            sandbox.shutdown()
+            self._start_sandbox()
+            return
+        self._preload(sandbox)
+
+    def acquire(self, timeout: Optional[float] = None) -> JupyterSandbox:
+        """Take a preloaded sandbox, waiting for one to be ready if needed
+
+        Raises a RuntimeError if every kernel of the pool failed to start.
+        """
+        if self._closed:
+            raise RuntimeError("Kernel pool is shut down")
+        sandbox = self._ready.get(timeout=timeout)
+        if sandbox is None:
+            # left for the other waiting callers
+            self._ready.put(None)
+            raise RuntimeError("No kernel of the pool could be started")
+        return sandbox
+
+    def release(self, sandbox: JupyterSandbox):
+        """Give a sandbox back to be restarted for the next task"""
+        if self._closed:
+            return
+        self._executor.submit(self._recycle, sandbox)
+
+    @contextmanager
+    def sandbox(self, timeout: Optional[float] = None) -> Iterator[JupyterSandbox]:
+        sandbox = self.acquire(timeout=timeout)
+        try:
+            yield sandbox
+        finally:
+            self.release(sandbox)
+
+    def shutdown(self):
+        """Shutdown all kernels of the pool"""
+        self._closed = True
+        # a recycle in progress stops before preloading
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for sandbox in self._sandboxes:
+            sandbox.shutdown()
+        self._sandboxes = []
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+from sandbox.async_notebook import AsyncJupyterSandbox
+from sandbox.notebook import CellType
+
+
+async def run_notebook(value: int, ready: asyncio.Barrier):
+    async with AsyncJupyterSandbox(incremental=True) as sandbox:
+        assert await sandbox.apreload(f"x = {value}")
+        nb = sandbox.create_notebook()
+        sandbox.add_cell(
+            nb, "import time\nprint(x, time.time())\ntime.sleep(1)", CellType.CODE
+        )
+        sandbox.add_cell(nb, "1 / 0", CellType.CODE)
+        sandbox.add_cell(nb, "print('not run')", CellType.CODE)
+        # kernels may take different times to start
+        await ready.wait()
+        nb = await sandbox.aexecute_notebook(nb)
+        # only the failed cell and the cells after it are stale
+        sandbox.modify_cell(nb, 1, "y = x + 1")
+        sandbox.modify_cell(nb, 2, "print(y)")
+        start = time.perf_counter()
+        nb = await sandbox.aexecute_notebook(nb)
+        assert time.perf_counter() - start < 1
+        return [cell.outputs for cell in nb.cells]
+
+
+def test_sandboxes_execute_concurrently_in_one_event_loop():
+    async def main():
+        ready = asyncio.Barrier(2)
+        return await asyncio.gather(run_notebook(1, ready), run_notebook(2, ready))
+
+    results = asyncio.run(main())
+
+    started = []
+    for value, outputs in zip([1, 2], results):
+        printed_value, timestamp = outputs[0][0]["text"].split()
+        assert printed_value == str(value)
+        started.append(float(timestamp))
+        assert outputs[2][0]["text"] == f"{value + 1}\n"
+    # the cells sleeping for a second ran at the same time
+    assert abs(started[0] - started[1]) < 1
@@ -1,5 +1,13 @@
+import copy
+
 from agent.models import ErrorOutput, StreamOutput
-from sandbox.notebook import CellType, JupyterSandbox
+from sandbox.cache import CellOutputCache
+from sandbox.notebook import (
+    OUTPUTS_HASH,
+    CellType,
+    JupyterSandbox,
+    hash_cell_outputs,
+)
 
 
 def test_notebook_without_errors():
@@ -28,6 +36,9 @@ def test_notebook_with_errors():
     assert error_output["output_type"] == "error"
     assert error_output["ename"] == "ZeroDivisionError"
     assert error_output["evalue"] == "division by zero"
+    # the outputs of the cell execution stopped at are hashed too
+    outputs_hash = executed_nb.cells[0].metadata.pop(OUTPUTS_HASH)
+    assert outputs_hash == hash_cell_outputs(executed_nb.cells[0])
 
 
 def test_notebook_state_across_executions():
@@ -42,3 +53,64 @@ def test_notebook_state_across_executions():
     assert answer_output["output_type"] == "stream"
     assert answer_output["name"] == "stdout"
     assert answer_output["text"] == "5\n"
+
+
+def test_incremental_execution_skips_unchanged_cells():
+    sandbox = JupyterSandbox(incremental=True)
+    nb = sandbox.create_notebook()
+    sandbox.add_cell(nb, "count = globals().get('count', 0) + 1", CellType.CODE)
+    nb = sandbox.execute_notebook(nb)
+    sandbox.add_cell(nb, "print(count)", CellType.CODE)
+    nb = sandbox.execute_notebook(nb)
+    assert nb.cells[1].outputs[0]["text"] == "1\n"
+
+    # modifying an upstream cell re-executes the cells after it
+    sandbox.modify_cell(nb, 0, "count = globals().get('count', 0) + 10")
+    nb = sandbox.execute_notebook(nb)
+    assert nb.cells[1].outputs[0]["text"] == "11\n"
+    assert sandbox.plan_execution(nb) == set()
+
+
+def test_incremental_execution_follows_cell_dependencies():
+    sandbox = JupyterSandbox(incremental=True)
+    nb = sandbox.create_notebook()
+    sandbox.add_cell(nb, "a = 1", CellType.CODE)
+    sandbox.add_cell(nb, "b = 2", CellType.CODE)
+    sandbox.add_cell(nb, "print(a)", CellType.CODE)
+    sandbox.add_cell(
+        nb, "runs = globals().get('runs', 0) + 1\nprint(b, runs)", CellType.CODE
+    )
+    nb = sandbox.execute_notebook(nb)
+
+    # only the cells reading `a` are re-executed
+    sandbox.modify_cell(nb, 0, "a = 10")
+    assert sandbox.plan_execution(nb) == {0, 2}
+    nb = sandbox.execute_notebook(nb)
+    assert nb.cells[2].outputs[0]["text"] == "10\n"
+    assert nb.cells[3].outputs[0]["text"] == "2 1\n"
+
+    # deleting the definition of `b` re-executes its readers
+    sandbox.delete_cell(nb, 1)
+    assert sandbox.plan_execution(nb) == {2}
+
+
+def test_cell_output_cache_across_kernels(tmp_path):
+    cell_cache = CellOutputCache(str(tmp_path), size_limit=2**20)
+    sandbox = JupyterSandbox(incremental=True, cell_cache=cell_cache)
+    nb = sandbox.create_notebook()
+    sandbox.add_cell(nb, "x = 1", CellType.CODE)
+    sandbox.add_cell(nb, "import random\nprint(x, random.random())", CellType.CODE)
+    nb = sandbox.execute_notebook(nb)
+    printed = nb.cells[1].outputs[0]["text"]
+
+    # a fresh kernel reattaches the cached outputs without executing
+    fresh_sandbox = JupyterSandbox(incremental=True, cell_cache=cell_cache)
+    fresh_nb = copy.deepcopy(nb)
+    fresh_nb.cells[1].outputs = []
+    fresh_nb = fresh_sandbox.execute_notebook(fresh_nb)
+    assert fresh_nb.cells[1].outputs[0]["text"] == printed
+
+    # cells reading definitions of cached cells force them to execute
+    fresh_sandbox.add_cell(fresh_nb, "print(x + 1)", CellType.CODE)
+    fresh_nb = fresh_sandbox.execute_notebook(fresh_nb)
+    assert fresh_nb.cells[2].outputs[0]["text"] == "2\n"
@@ -0,0 +1,29 @@
+import pytest
+
+from sandbox.notebook import CellType
+from sandbox.pool import KernelPool
+
+
+def test_pool_hands_out_preloaded_clean_kernels():
+    with KernelPool(1, preload=["x = 41"], incremental=True) as pool:
+        with pool.sandbox() as sandbox:
+            assert sandbox.has_preloaded("x = 41")
+            nb = sandbox.create_notebook()
+            sandbox.add_cell(nb, "y = x + 1\nprint(y)", CellType.CODE)
+            nb = sandbox.execute_notebook(nb)
+            assert nb.cells[0].outputs[0]["text"] == "42\n"
+
+        # the kernel is restarted and preloaded again once released
+        with pool.sandbox(timeout=60) as sandbox:
+            nb = sandbox.create_notebook()
+            sandbox.add_cell(nb, "print('y' in globals(), x)", CellType.CODE)
+            nb = sandbox.execute_notebook(nb)
+            assert nb.cells[0].outputs[0]["text"] == "False 41\n"
+
+
+def test_pool_without_kernels_fails_to_acquire():
+    with KernelPool(2, kernel_name="no-such-kernel") as pool:
+        with pytest.raises(RuntimeError):
+            pool.acquire(timeout=60)
+        with pytest.raises(RuntimeError):
+            pool.acquire(timeout=60)
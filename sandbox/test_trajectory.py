@@ -0,0 +1,61 @@
+import base64
+import os
+
+from nbformat.v4 import new_code_cell, new_notebook, new_output
+from sandbox.trajectory import TrajectoryStore
+
+
+def test_trajectory_store_rebuilds_snapshots_from_deltas(tmp_path):
+    image = base64.b64encode(os.urandom(4096)).decode("ascii")
+    plot_cell = new_code_cell(
+        "plt.plot(x)",
+        outputs=[new_output("display_data", data={"image/png": image})],
+    )
+    notebook = new_notebook(cells=[new_code_cell("x = 1"), plot_cell])
+
+    store = TrajectoryStore(str(tmp_path))
+    store.append(notebook)
+    notebook.cells.append(new_code_cell("print(x)"))
+    store.append(notebook)
+    notebook.cells[0].source = "x = 2"
+    store.append(notebook)
+    # Snapshots can be rebuilt before they are flushed
+    assert [cell.source for cell in store[1].cells][0] == "x = 1"
+    store.flush()
+
+    # Unchanged cells are only stored once and the image becomes a single blob
+    assert len(os.listdir(tmp_path / "blobs")) == 1
+    assert (tmp_path / "log.jsonl").read_text().count(image) == 0
+
+    reloaded = TrajectoryStore(str(tmp_path))
+    assert len(reloaded) == 3
+    assert [cell.source for cell in reloaded[0].cells] == ["x = 1", "plt.plot(x)"]
+    assert [cell.source for cell in reloaded[-1].cells] == [
+        "x = 2",
+        "plt.plot(x)",
+        "print(x)",
+    ]
+    assert reloaded[1].cells[1].outputs[0]["data"]["image/png"] == image
+    assert reloaded[2] == notebook
+
+
+def test_trajectory_store_resumes_without_reading_the_log(tmp_path):
+    notebook = new_notebook(cells=[new_code_cell("x = 1")])
+    store = TrajectoryStore(str(tmp_path))
+    store.append(notebook)
+    store.flush()
+
+    resumed = TrajectoryStore(str(tmp_path))
+    notebook.cells.append(new_code_cell("print(x)"))
+    resumed.append(notebook)
+    resumed.flush()
+    assert len(resumed) == 2
+    assert not resumed._indexed
+    # The unchanged cell is not stored again
+    assert (tmp_path / "log.jsonl").read_text().count("x = 1") == 1
+
+    # A log written past its index, e.g. by a crash in between, is scanned
+    (tmp_path / "index.json").write_text('{"entries": 1, "size": 1, "last_offset": 0}')
+    reloaded = TrajectoryStore(str(tmp_path))
+    assert len(reloaded) == 2
+    assert reloaded[-1] == notebook
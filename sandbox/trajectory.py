@@ -0,0 +1,254 @@
+import hashlib
+import json
+import logging
+import nbformat
+import os
+
+from collections.abc import Sequence
+from nbformat.v4 import new_notebook
+from typing import Any, Dict, List, Optional, Set, Union, overload
+from utils.persistence import atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Output data at least this long is stored once under `blobs/`
+BLOB_MIN_SIZE = 1024
+BLOB_REF = "$blob"
+
+
+def hash_content(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class TrajectoryStore(Sequence):
+    """Append-only log of notebook snapshots stored as cell-level deltas
+
+    Every entry of `log.jsonl` lists the cells of a snapshot by content hash
+    and only carries the cells that no earlier entry introduced. Large output
+    data such as images is moved to `blobs/` and deduplicated by content hash.
+    Snapshots are rebuilt on demand with `store[idx]`. The end of the log is
+    kept in `index.json`, so appending to an existing log does not read it,
+    only the first `store[idx]` indexes the whole log.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._log_path = os.path.join(directory, "log.jsonl")
+        self._blob_dir = os.path.join(directory, "blobs")
+        self._index_path = os.path.join(directory, "index.json")
+        # byte offset of each flushed entry in the log
+        self._offsets: List[int] = []
+        # cell hash -> index of the entry introducing the cell
+        self._cell_entries: Dict[str, int] = {}
+        # serialized entries and blobs not yet written to disk
+        self._pending: List[str] = []
+        self._pending_blobs: Dict[str, str] = {}
+        self._indexed = False
+        # number of flushed entries, size of the log and offset of the last entry
+        self._flushed = 0
+        self._size = 0
+        self._last_offset = 0
+        # hashes of the cells some entry already carries
+        self._stored_cells: Set[str] = set()
+        self._loaded = False
+
+    def _load(self):
+        """Find the end of the log from `index.json`, scan it if that is stale"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self._log_path):
+            return
+        index = self._read_index()
+        if index is not None and index["size"] == os.path.getsize(self._log_path):
+            self._flushed = index["entries"]
+            self._size = index["size"]
+            self._last_offset = index["last_offset"]
+            # Cells of earlier snapshots may be stored again, that is only space
+            if self._flushed:
+                self._stored_cells.update(self._read_line(self._last_offset)["cells"])
+            return
+        self._index_log()
+        self._flushed = len(self._offsets)
+        self._size = os.path.getsize(self._log_path)
+        self._last_offset = self._offsets[-1] if self._offsets else 0
+
+    def _read_index(self) -> Optional[Dict[str, int]]:
+        if not os.path.exists(self._index_path):
+            return None
+        try:
+            with open(self._index_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logger.warning(f"Ignoring unreadable trajectory index {self._index_path}")
+            return None
+
+    def _index_log(self):
+        if self._indexed:
+            return
+        self._indexed = True
+        if not os.path.exists(self._log_path):
+            self._index_pending()
+            return
+        offset = 0
+        truncated = False
+        with open(self._log_path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written last entry, e.g. after a crash
+                    logger.warning(
+                        f"Ignoring truncated trajectory entry {len(self._offsets)}"
+                    )
+                    truncated = True
+                    break
+                for key in entry["new"]:
+                    self._cell_entries.setdefault(key, len(self._offsets))
+                self._offsets.append(offset)
+                offset += len(line)
+        if truncated:
+            with open(self._log_path, "ab") as f:
+                f.truncate(offset)
+        self._index_pending()
+
+    def _index_pending(self):
+        for idx, line in enumerate(self._pending, start=len(self._offsets)):
+            for key in json.loads(line)["new"]:
+                self._cell_entries.setdefault(key, idx)
+        self._stored_cells.update(self._cell_entries)
+
+    def _encode_output(self, output: Dict[str, Any]) -> Dict[str, Any]:
+        if "data" not in output:
+            return output
+        data = {}
+        for mime, value in output["data"].items():
+            if isinstance(value, str) and len(value) >= BLOB_MIN_SIZE:
+                key = hash_content(value)
+                if not os.path.exists(self._get_blob_path(key)):
+                    self._pending_blobs[key] = value
+                data[mime] = {BLOB_REF: key}
+            else:
+                data[mime] = value
+        return {**output, "data": data}
+
+    def _decode_output(self, output: Dict[str, Any]) -> Dict[str, Any]:
+        if "data" not in output:
+            return output
+        data = {}
+        for mime, value in output["data"].items():
+            if isinstance(value, dict) and BLOB_REF in value:
+                data[mime] = self._read_blob(value[BLOB_REF])
+            else:
+                data[mime] = value
+        return {**output, "data": data}
+
+    def _get_blob_path(self, key: str) -> str:
+        return os.path.join(self._blob_dir, key)
+
+    def _read_blob(self, key: str) -> str:
+        if key in self._pending_blobs:
+            return self._pending_blobs[key]
+        with open(self._get_blob_path(key), "r", encoding="utf-8") as f:
+            return f.read()
+
+    def _read_line(self, offset: int) -> Dict[str, Any]:
+        with open(self._log_path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def _read_entry(self, idx: int) -> Dict[str, Any]:
+        if idx >= len(self._offsets):
+            return json.loads(self._pending[idx - len(self._offsets)])
+        return self._read_line(self._offsets[idx])
+
+    def append(self, notebook: nbformat.NotebookNode):
+        """Record a snapshot of the notebook, call `flush` to persist it"""
+        self._load()
+        idx = len(self)
+        cells = []
+        new_cells = {}
+        for cell in notebook.cells:
+            encoded = dict(cell)
+            if "outputs" in cell:
+                encoded["outputs"] = [self._encode_output(o) for o in cell.outputs]
+            key = hash_content(json.dumps(encoded, sort_keys=True))
+            cells.append(key)
+            if key not in self._stored_cells:
+                self._stored_cells.add(key)
+                new_cells[key] = encoded
+                if self._indexed:
+                    self._cell_entries[key] = idx
+        entry = {
+            "nbformat": notebook.nbformat,
+            "nbformat_minor": notebook.nbformat_minor,
+            "metadata": notebook.metadata,
+            "cells": cells,
+            "new": new_cells,
+        }
+        self._pending.append(json.dumps(entry))
+
+    def flush(self):
+        """Write pending snapshots, blobs first so entries never dangle"""
+        if not self._pending:
+            return
+        os.makedirs(self._blob_dir, exist_ok=True)
+        for key, value in self._pending_blobs.items():
+            atomic_write(self._get_blob_path(key), value)
+        self._pending_blobs.clear()
+
+        with open(self._log_path, "ab") as f:
+            for line in self._pending:
+                self._last_offset = f.tell()
+                if self._indexed:
+                    self._offsets.append(self._last_offset)
+                f.write(line.encode("utf-8") + b"\n")
+            self._size = f.tell()
+        self._flushed += len(self._pending)
+        self._pending.clear()
+        # Written after the log, a stale index is detected by its size
+        index = {
+            "entries": self._flushed,
+            "size": self._size,
+            "last_offset": self._last_offset,
+        }
+        atomic_write(self._index_path, json.dumps(index))
+
+    def __len__(self) -> int:
+        self._load()
+        return self._flushed + len(self._pending)
+
+    @overload
+    def __getitem__(self, idx: int) -> nbformat.NotebookNode: ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> List[nbformat.NotebookNode]: ...
+
+    def __getitem__(
+        self, idx: Union[int, slice]
+    ) -> Union[nbformat.NotebookNode, List[nbformat.NotebookNode]]:
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Snapshot {idx} out of range")
+        self._index_log()
+
+        entry = self._read_entry(idx)
+        entries = {idx: entry}
+        cells = []
+        for key in entry["cells"]:
+            entry_idx = self._cell_entries[key]
+            if entry_idx not in entries:
+                entries[entry_idx] = self._read_entry(entry_idx)
+            cell = dict(entries[entry_idx]["new"][key])
+            if "outputs" in cell:
+                cell["outputs"] = [self._decode_output(o) for o in cell["outputs"]]
+            cells.append(cell)
+
+        notebook = new_notebook(metadata=entry["metadata"])
+        notebook.nbformat = entry["nbformat"]
+        notebook.nbformat_minor = entry["nbformat_minor"]
+        notebook.cells = nbformat.from_dict(cells)
+        return notebook
@@ -0,0 +1,70 @@
+import base64
+import hashlib
+import io
+import threading
+
+from collections import OrderedDict
+from PIL import Image
+
+
+class ImageEncoder:
+    """Downscales and re-encodes base64 images into data URLs
+
+    Images are resized to fit `max_dimension` and re-encoded as
+    `image_format`, the original is kept if it is already smaller.
+    Results are memoized by content hash, so the unchanged plots of a
+    notebook are only re-encoded once across iterations.
+    """
+
+    def __init__(
+        self,
+        max_dimension: int,
+        image_format: str = "JPEG",
+        quality: int = 80,
+        max_entries: int = 256,
+    ):
+        self.max_dimension = max_dimension
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.max_entries = max_entries
+        self._memo: OrderedDict[str, str] = OrderedDict()
+        # prompts of concurrent tasks are rendered in threads
+        self._lock = threading.Lock()
+
+    def to_data_url(self, data: str, mime_type: str = "image/png") -> str:
+        key = hashlib.sha256(data.encode("ascii")).hexdigest()
+        with self._lock:
+            url = self._memo.get(key)
+            if url is not None:
+                self._memo.move_to_end(key)
+                return url
+        url = self._encode(data, mime_type)
+        with self._lock:
+            self._memo[key] = url
+            self._memo.move_to_end(key)
+            if len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+        return url
+
+    def _encode(self, data: str, mime_type: str) -> str:
+        original = f"data:{mime_type};base64,{data}"
+        try:
+            image: Image.Image = Image.open(io.BytesIO(base64.b64decode(data)))
+            image.load()
+        except Exception:
+            return original
+        resized = max(image.size) > self.max_dimension
+        if resized:
+            image.thumbnail((self.max_dimension, self.max_dimension))
+        if self.image_format == "JPEG" and image.mode != "RGB":
+            # jpeg has no alpha channel, plots are drawn on white
+            background = Image.new("RGB", image.size, "white")
+            image = image.convert("RGBA")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.image_format, quality=self.quality)
+        encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+        if not resized and len(encoded) >= len(data):
+            return original
+        return f"data:image/{self.image_format.lower()};base64,{encoded}"
@@ -1,6 +1,6 @@
 import re
 
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 
 def try_to_parse_as_int(s: Optional[str]) -> Optional[int]:
@@ -43,3 +43,73 @@ def extract_blocks_from_tags(raw_response: str, tag: str) -> List[str]:
 def extract_block_from_tags(raw_response: str, tag: str) -> Optional[str]:
     blocks = extract_blocks_from_tags(raw_response, tag)
     return blocks[0] if blocks else None
+
+
+def tokenize_tags(raw_response: str, tags: List[str]) -> List[Tuple[str, str]]:
+    """(tag, block) of every top level block of any of the tags, in document order
+
+    The response is walked once for all tags, tags inside a block are left
+    to the block.
+    """
+    tag_set = set(tags)
+    max_tag_length = max(len(tag) for tag in tags) + 1
+    blocks: List[Tuple[str, str]] = []
+    pos = 0
+    while True:
+        start = raw_response.find("<", pos)
+        if start == -1:
+            return blocks
+        candidate = raw_response[start + 1 : start + 1 + max_tag_length]
+        tag = candidate.partition(">")[0] if ">" in candidate else None
+        if tag not in tag_set:
+            pos = start + 1
+            continue
+        content_start = start + len(tag) + 2
+        end = raw_response.find(f"</{tag}>", content_start)
+        if end == -1:
+            pos = start + 1
+            continue
+        blocks.append((tag, raw_response[content_start:end]))
+        pos = end + len(tag) + 3
+
+
+def extract_fields_from_tags(raw_response: str, tags: List[str]) -> Dict[str, str]:
+    """First block of each of the tags, scanning the response once"""
+    fields: Dict[str, str] = {}
+    for tag, block in tokenize_tags(raw_response, tags):
+        fields.setdefault(tag, block)
+    return fields
+
+
+class StreamingTagParser:
+    """Extracts `<tag>...</tag>` blocks from text arriving in chunks
+
+    `feed` returns the blocks completed by the chunk, in document order, as
+    soon as their closing tag has arrived.
+    """
+
+    def __init__(self, tags: List[str]):
+        self.tags = tags
+        self._buffer = ""
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        self._buffer += chunk
+        blocks: List[Tuple[str, str]] = []
+        while True:
+            opening = [
+                (self._buffer.find(f"<{tag}>"), tag)
+                for tag in self.tags
+                if f"<{tag}>" in self._buffer
+            ]
+            if not opening:
+                # keep a possibly incomplete opening tag
+                keep = max(len(f"<{tag}>") for tag in self.tags) - 1
+                self._buffer = self._buffer[-keep:] if keep else ""
+                return blocks
+            start, tag = min(opening)
+            end = self._buffer.find(f"</{tag}>", start)
+            if end == -1:
+                self._buffer = self._buffer[start:]
+                return blocks
+            blocks.append((tag, self._buffer[start + len(f"<{tag}>") : end]))
+            self._buffer = self._buffer[end + len(f"</{tag}>") :]
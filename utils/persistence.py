@@ -0,0 +1,73 @@
+import logging
+import os
+import queue
+import tempfile
+import threading
+
+from typing import Callable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write(path: str, content: Union[str, bytes]):
+    """Write a file so readers only ever see the old or the new content"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class BackgroundWriter:
+    """Runs write jobs in order on a single background thread
+
+    `wait` blocks until every submitted job has run and re-raises the first
+    error a job hit since the last `wait`.
+    """
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                job()
+            except BaseException as e:
+                logger.error(f"Error in background write: {e}")
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def submit(self, job: Callable[[], None]):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put(job)
+
+    def wait(self):
+        self._queue.join()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Finish pending jobs and stop the thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+        self.wait()
@@ -0,0 +1,124 @@
+import argparse
+import cProfile
+import json
+import os
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Tracer:
+    """Timed spans of named phases, written to a JSON lines trace at `path`
+
+    Attributes of a span, e.g. sizes, are given when it is opened or set on
+    the yielded dict while it is open. Spans may come from several threads.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # line buffered, the trace survives a crash
+            self._file = open(path, "a", buffering=1)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+        start = time.time()
+        start_counter = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.add(name, start, time.perf_counter() - start_counter, **attributes)
+
+    def add(self, name: str, start: float, duration: float, **attributes: Any):
+        """Record a span timed elsewhere, `start` is a unix timestamp"""
+        record = {
+            "name": name,
+            "start": start,
+            "duration": duration,
+            "thread": threading.current_thread().name,
+            **attributes,
+        }
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps(record, default=str) + "\n")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+@contextmanager
+def profile(path: Optional[str]) -> Iterator[None]:
+    """cProfile the block into `path`, e.g. for snakeviz, nothing if None"""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        profiler.dump_stats(path)
+
+
+def read_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarise(spans: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Count, total, mean, p95 and max seconds per span name, by total time"""
+    durations: Dict[str, List[float]] = defaultdict(list)
+    for span in spans:
+        durations[span["name"]].append(span["duration"])
+    summary = {}
+    for name, values in durations.items():
+        values = sorted(values)
+        summary[name] = {
+            "count": len(values),
+            "total": sum(values),
+            "mean": sum(values) / len(values),
+            "p95": values[min(len(values) - 1, int(0.95 * len(values)))],
+            "max": values[-1],
+        }
+    return dict(sorted(summary.items(), key=lambda item: -item[1]["total"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Where the time of traced runs goes")
+    parser.add_argument("traces", nargs="+", help="trace.jsonl files of solver runs")
+    args = parser.parse_args()
+
+    spans = []
+    wall_time = 0.0
+    for path in args.traces:
+        trace = read_trace(path)
+        if not trace:
+            continue
+        spans.extend(trace)
+        wall_time += max(s["start"] + s["duration"] for s in trace) - min(
+            s["start"] for s in trace
+        )
+    if not wall_time:
+        parser.exit(message="No timed spans in the traces\n")
+    print(f"{len(spans)} spans over {wall_time:.2f}s, phases may overlap")
+    print(
+        f"{'span':>16} {'count':>6} {'total s':>8} {'share':>6} "
+        f"{'mean ms':>8} {'p95 ms':>8} {'max ms':>8}"
+    )
+    for name, stats in summarise(spans).items():
+        print(
+            f"{name:>16} {stats['count']:>6} {stats['total']:>8.2f} "
+            f"{stats['total'] / wall_time:>6.0%} {stats['mean'] * 1000:>8.1f} "
+            f"{stats['p95'] * 1000:>8.1f} {stats['max'] * 1000:>8.1f}"
+        )
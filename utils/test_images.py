@@ -0,0 +1,31 @@
+import base64
+import io
+
+from PIL import Image
+from utils.images import ImageEncoder
+
+
+def make_png(width: int, height: int) -> str:
+    buffer = io.BytesIO()
+    Image.new("RGBA", (width, height), (255, 0, 0, 128)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def decode(url: str) -> Image.Image:
+    return Image.open(io.BytesIO(base64.b64decode(url.split(",", 1)[1])))
+
+
+def test_image_encoder_downscales_and_memoizes():
+    encoder = ImageEncoder(max_dimension=100, image_format="JPEG", max_entries=1)
+    large = make_png(400, 200)
+
+    url = encoder.to_data_url(large)
+    assert url.startswith("data:image/jpeg;base64,")
+    assert decode(url).size == (100, 50)
+    assert encoder.to_data_url(large) is url
+
+    # small images are kept as they are when re-encoding does not help
+    small = make_png(10, 10)
+    assert encoder.to_data_url(small) == f"data:image/png;base64,{small}"
+    # the memo is bounded
+    assert encoder.to_data_url(large) is not url
@@ -0,0 +1,37 @@
+from utils.parsing import (
+    StreamingTagParser,
+    extract_blocks_from_tags,
+    tokenize_tags,
+)
+
+RESPONSE = """
+Let me add a cell.
+<add_cell><type>code</type><idx>0</idx><content>
+x = 1
+</content></add_cell>
+<delete_cell><idx>2</idx></delete_cell>
+<add_cell><type>code</type><idx>-1</idx><content>print(x)</content></add_cell>
+<stop></stop>
+"""
+
+
+def test_streaming_tag_parser_matches_full_parse():
+    parser = StreamingTagParser(["add_cell", "delete_cell", "stop"])
+    blocks = []
+    for i in range(0, len(RESPONSE), 3):
+        blocks += parser.feed(RESPONSE[i : i + 3])
+
+    assert [tag for tag, _ in blocks] == ["add_cell", "delete_cell", "add_cell", "stop"]
+    assert [block for tag, block in blocks if tag == "add_cell"] == (
+        extract_blocks_from_tags(RESPONSE, "add_cell")
+    )
+
+
+def test_tokenize_tags_in_document_order():
+    response = (
+        "a < b <stopx <add_cell>if a<b: pass</add_cell> <stop></stop> <add_cell>open"
+    )
+    assert tokenize_tags(response, ["add_cell", "stop"]) == [
+        ("add_cell", "if a<b: pass"),
+        ("stop", ""),
+    ]
@@ -0,0 +1,26 @@
+import os
+import pytest
+import time
+
+from utils.persistence import BackgroundWriter, atomic_write
+
+
+def test_background_writer_runs_jobs_in_order(tmp_path):
+    path = str(tmp_path / "state.json")
+    writer = BackgroundWriter()
+
+    def slow_write(content):
+        time.sleep(0.05)
+        atomic_write(path, content)
+
+    writer.submit(lambda: slow_write("first"))
+    writer.submit(lambda: slow_write("second"))
+    writer.wait()
+    with open(path) as f:
+        assert f.read() == "second"
+    # no temporary files are left behind
+    assert os.listdir(tmp_path) == ["state.json"]
+
+    writer.submit(lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        writer.close()
@@ -0,0 +1,32 @@
+import threading
+
+from utils.profiling import Tracer, read_trace, summarise
+
+
+def test_spans_from_threads_are_traced_and_summarised(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    tracer = Tracer(path)
+    with tracer.span("render", cells=3) as span:
+        span["items"] = 7
+
+    def execute():
+        with tracer.span("kernel"):
+            pass
+
+    threads = [threading.Thread(target=execute) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tracer.add("cell", start=100.0, duration=0.5, cell=1)
+    tracer.close()
+
+    spans = read_trace(path)
+    assert len(spans) == 6
+    assert spans[0]["name"] == "render"
+    assert spans[0]["cells"] == 3 and spans[0]["items"] == 7
+    summary = summarise(spans)
+    assert summary["kernel"]["count"] == 4
+    assert summary["cell"]["total"] == 0.5
+    # sorted by total time
+    assert list(summary)[0] == "cell"
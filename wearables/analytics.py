@@ -0,0 +1,213 @@
+import numpy as np
+import pandas as pd
+
+from typing import Any, Dict, List, Union
+
+# A single API response, a list of them or a `fetch_range` result keyed by date
+Responses = Union[Dict[str, Any], List[Any]]
+
+
+def _as_list(responses: Responses) -> List[Any]:
+    if isinstance(responses, list):
+        return responses
+    if isinstance(responses, dict) and all(
+        isinstance(key, str) and len(key) == 10 and key[4] == "-" for key in responses
+    ):
+        # fetch_range result
+        return list(responses.values())
+    return [responses]
+
+
+def _flatten(responses: Responses) -> List[Any]:
+    """Responses as one list, list responses are concatenated"""
+    flat = []
+    for response in _as_list(responses):
+        if isinstance(response, list):
+            flat += response
+        elif response:
+            flat.append(response)
+    return flat
+
+
+def _hours(seconds: pd.Series) -> pd.Series:
+    return pd.to_numeric(seconds, errors="coerce") / 3600
+
+
+def sleep_frame(responses: Responses) -> pd.DataFrame:
+    """One row per night from `get_sleep_data` responses, durations in hours"""
+    dtos = [
+        response["dailySleepDTO"]
+        for response in _as_list(responses)
+        if response and response.get("dailySleepDTO")
+    ]
+    df = pd.DataFrame(dtos).reindex(
+        columns=[
+            "calendarDate",
+            "sleepStartTimestampLocal",
+            "sleepEndTimestampLocal",
+            "sleepTimeSeconds",
+            "deepSleepSeconds",
+            "lightSleepSeconds",
+            "remSleepSeconds",
+            "awakeSleepSeconds",
+        ]
+    )
+    return pd.DataFrame(
+        {
+            "date": pd.to_datetime(df["calendarDate"]),
+            "start": pd.to_datetime(df["sleepStartTimestampLocal"], unit="ms"),
+            "end": pd.to_datetime(df["sleepEndTimestampLocal"], unit="ms"),
+            "sleep_hours": _hours(df["sleepTimeSeconds"]),
+            "deep_hours": _hours(df["deepSleepSeconds"]),
+            "light_hours": _hours(df["lightSleepSeconds"]),
+            "rem_hours": _hours(df["remSleepSeconds"]),
+            "awake_hours": _hours(df["awakeSleepSeconds"]),
+        }
+    )
+
+
+def steps_frame(responses: Responses) -> pd.DataFrame:
+    """One row per 15 minute interval from `get_steps_data` responses"""
+    df = pd.DataFrame(_flatten(responses)).reindex(
+        columns=["startGMT", "endGMT", "steps", "primaryActivityLevel"]
+    )
+    return pd.DataFrame(
+        {
+            "start": pd.to_datetime(df["startGMT"]),
+            "end": pd.to_datetime(df["endGMT"]),
+            "steps": pd.to_numeric(df["steps"]).fillna(0).astype(int),
+            "activity_level": df["primaryActivityLevel"],
+        }
+    )
+
+
+def heart_rate_frame(responses: Responses) -> pd.DataFrame:
+    """One row per sample from `get_heart_rates` responses"""
+    pairs = [
+        pair
+        for response in _as_list(responses)
+        if response
+        for pair in response.get("heartRateValues") or []
+        if pair
+    ]
+    values = np.array(pairs, dtype=float).reshape(-1, 2)
+    return pd.DataFrame(
+        {
+            "time": pd.to_datetime(values[:, 0], unit="ms"),
+            "heart_rate": values[:, 1].astype(np.float32),
+        }
+    )
+
+
+def daily_summary_frame(responses: Responses) -> pd.DataFrame:
+    """One row per day from `get_user_summary` / `get_stats` responses"""
+    df = pd.json_normalize(_flatten(responses))
+    if "calendarDate" in df:
+        df.insert(0, "date", pd.to_datetime(df.pop("calendarDate")))
+    return df
+
+
+def activities_frame(activities: List[Dict[str, Any]]) -> pd.DataFrame:
+    """One row per activity from `get_activities`"""
+    df = pd.json_normalize(activities).reindex(
+        columns=[
+            "activityId",
+            "activityName",
+            "activityType.typeKey",
+            "startTimeLocal",
+            "duration",
+            "distance",
+            "calories",
+        ]
+    )
+    return pd.DataFrame(
+        {
+            "activity_id": df["activityId"],
+            "name": df["activityName"],
+            "type": df["activityType.typeKey"],
+            "start": pd.to_datetime(df["startTimeLocal"]),
+            "duration_minutes": pd.to_numeric(df["duration"]) / 60,
+            "distance_km": pd.to_numeric(df["distance"]) / 1000,
+            "calories": pd.to_numeric(df["calories"]),
+        }
+    )
+
+
+def exercise_sets_frame(responses: Responses, active_only: bool = True) -> pd.DataFrame:
+    """One row per set from `get_activity_exercise_sets` responses
+
+    Each set is a single exercise even though `exercises` is a list, it holds
+    the candidate classifications, so the most probable one is used.
+    """
+    records = [
+        {**exercise_set, "activityId": response.get("activityId")}
+        for response in _as_list(responses)
+        if response
+        for exercise_set in response.get("exerciseSets") or []
+    ]
+    df = pd.DataFrame(records).reindex(
+        columns=[
+            "activityId",
+            "startTime",
+            "setType",
+            "exercises",
+            "repetitionCount",
+            "weight",
+            "duration",
+        ]
+    )
+    exercises = df["exercises"].map(
+        # NaN for sets without the key
+        lambda candidates: max(
+            candidates if isinstance(candidates, list) and candidates else [{}],
+            key=lambda e: e.get("probability") or 0,
+        )
+    )
+    sets = pd.DataFrame(
+        {
+            "activity_id": df["activityId"],
+            "start": pd.to_datetime(df["startTime"]),
+            "set_type": df["setType"],
+            "category": exercises.str.get("category"),
+            "exercise": exercises.str.get("name"),
+            "reps": pd.to_numeric(df["repetitionCount"]),
+            # weight is reported in grams
+            "weight_kg": pd.to_numeric(df["weight"]) / 1000,
+            "duration_seconds": pd.to_numeric(df["duration"]),
+        }
+    )
+    if active_only:
+        sets = sets[sets["set_type"] == "ACTIVE"].reset_index(drop=True)
+    return sets
+
+
+def daily_totals(
+    df: pd.DataFrame, column: str, time_column: str = "start"
+) -> pd.Series:
+    """Sum of a column per calendar day, days without data are 0"""
+    return df.set_index(time_column)[column].resample("D").sum()
+
+
+def weekly_means(df: pd.DataFrame, column: str, time_column: str = "date") -> pd.Series:
+    """Mean of a column per week, labelled by the Monday starting the week"""
+    return (
+        df.set_index(time_column)[column]
+        .resample("W-MON", label="left", closed="left")
+        .mean()
+    )
+
+
+def reps_per_exercise(sets: pd.DataFrame) -> pd.DataFrame:
+    """Sets and reps per day and exercise from `exercise_sets_frame`"""
+    return (
+        sets.assign(date=sets["start"].dt.normalize())
+        .groupby(["date", "category", "exercise"])
+        .agg(
+            sets=("reps", "size"),
+            total_reps=("reps", "sum"),
+            max_reps=("reps", "max"),
+            mean_reps=("reps", "mean"),
+            max_weight_kg=("weight_kg", "max"),
+        )
+        .reset_index()
+    )
@@ -0,0 +1,136 @@
+import diskcache
+import functools
+import json
+import logging
+import os
+import re
+import time
+
+from app.constants import (
+    GARMIN_CACHE_DIR,
+    GARMIN_CACHE_SIZE_LIMIT,
+    GARMIN_CACHE_TODAY_TTL,
+)
+from datetime import date, datetime
+from enum import Enum
+from garminconnect import Garmin
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+class CacheMode(Enum):
+    # serve fresh cached responses, fetch and record the rest
+    RECORD = "record"
+    # only serve cached responses, never touch the network
+    REPLAY = "replay"
+    OFF = "off"
+
+
+def get_cache_mode() -> CacheMode:
+    return CacheMode(os.getenv("GARMIN_CACHE_MODE", CacheMode.RECORD.value))
+
+
+class ReplayCacheMiss(LookupError):
+    pass
+
+
+def _to_date(value: Any) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and DATE_PATTERN.match(value):
+        try:
+            return date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def get_ttl(args: tuple, kwargs: dict, today_ttl: float) -> Optional[float]:
+    """Responses about past days never change, anything else is short-lived"""
+    dates: List[date] = [
+        d for d in map(_to_date, [*args, *kwargs.values()]) if d is not None
+    ]
+    if dates and max(dates) < date.today():
+        return None
+    return today_ttl
+
+
+class CachedGarmin:
+    """Proxy for `garminconnect.Garmin` that caches `get_*` responses on disk
+
+    Responses are stored per method and arguments. In replay mode no API
+    object is needed and missing responses raise `ReplayCacheMiss`.
+    """
+
+    def __init__(
+        self,
+        api: Optional[Garmin],
+        directory: str = GARMIN_CACHE_DIR,
+        mode: CacheMode = CacheMode.RECORD,
+        today_ttl: float = GARMIN_CACHE_TODAY_TTL,
+        size_limit: int = GARMIN_CACHE_SIZE_LIMIT,
+    ):
+        self._api = api
+        self.mode = mode
+        self.today_ttl = today_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = diskcache.Cache(
+            directory,
+            size_limit=size_limit,
+            eviction_policy="least-recently-used",
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        if self.mode == CacheMode.REPLAY:
+            if not name.startswith("get_"):
+                raise AttributeError(f"{name} is not available in replay mode")
+            return functools.partial(self._call, name, None)
+        attr = getattr(self._api, name)
+        if self.mode == CacheMode.OFF or not name.startswith("get_"):
+            return attr
+        if not callable(attr):
+            return attr
+        return functools.partial(self._call, name, attr)
+
+    def _call(self, name: str, method: Optional[Callable], *args, **kwargs) -> Any:
+        key = json.dumps([name, args, kwargs], sort_keys=True, default=str)
+        entry = self._cache.get(key)
+        if entry is not None:
+            recorded_at, ttl, response = entry
+            if (
+                self.mode == CacheMode.REPLAY
+                or ttl is None
+                or time.time() - recorded_at < ttl
+            ):
+                self.hits += 1
+                return response
+        if self.mode == CacheMode.REPLAY:
+            raise ReplayCacheMiss(f"No recorded response for {name}{args}")
+        assert method is not None
+
+        self.misses += 1
+        response = method(*args, **kwargs)
+        ttl = get_ttl(args, kwargs, self.today_ttl)
+        self._cache.set(key, (time.time(), ttl, response))
+        return response
+
+    def close(self):
+        self._cache.close()
+
+
+def login(tokenstore: Optional[str] = None) -> Any:
+    """Login to Garmin Connect, wrapped in the cache set by `GARMIN_CACHE_MODE`"""
+    mode = get_cache_mode()
+    if mode == CacheMode.REPLAY:
+        return CachedGarmin(None, mode=mode)
+    api = Garmin()
+    api.login(tokenstore)
+    if mode == CacheMode.OFF:
+        return api
+    return CachedGarmin(api, mode=mode)
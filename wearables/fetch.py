@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+
+from app.constants import FETCH_MAX_RETRIES, FETCH_MAX_WORKERS, FETCH_RATE_LIMIT
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from garminconnect import (
+    GarminConnectConnectionError,
+    GarminConnectTooManyRequestsError,
+)
+from requests import RequestException
+from typing import Any, Callable, Dict, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    GarminConnectConnectionError,
+    GarminConnectTooManyRequestsError,
+    RequestException,
+)
+
+
+class RateLimiter:
+    """Token bucket shared by the threads of a fetch
+
+    `clock` and `sleep` also time the retry backoff, tests pass fakes.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            self.sleep(wait)
+
+
+def date_range(start: Union[str, date], end: Union[str, date]) -> List[str]:
+    """Days from start to end (inclusive) in YYYY-MM-DD format"""
+    start = date.fromisoformat(start) if isinstance(start, str) else start
+    end = date.fromisoformat(end) if isinstance(end, str) else end
+    if start > end:
+        raise ValueError(f"Start date {start} is after end date {end}")
+    return [
+        (start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)
+    ]
+
+
+def _call_with_retry(
+    method: Callable, cdate: str, limiter: RateLimiter, max_retries: int
+) -> Any:
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            return method(cdate)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            backoff = 0.5 * 2**attempt
+            logger.warning(f"Retrying {cdate} in {backoff}s after error: {e}")
+            limiter.sleep(backoff)
+
+
+def fetch_dates(
+    method: Callable[[str], Any],
+    dates: List[str],
+    max_workers: int = FETCH_MAX_WORKERS,
+    rate_limit: float = FETCH_RATE_LIMIT,
+    max_retries: int = FETCH_MAX_RETRIES,
+    limiter: Optional[RateLimiter] = None,
+) -> Dict[str, Any]:
+    """Call a per-day API method for each of the dates in parallel"""
+    if limiter is None:
+        limiter = RateLimiter(rate_limit, burst=max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda cdate: _call_with_retry(method, cdate, limiter, max_retries),
+            dates,
+        )
+        return dict(zip(dates, results))
+
+
+def fetch_range(
+    method: Callable[[str], Any],
+    start: Union[str, date],
+    end: Union[str, date],
+    **kwargs,
+) -> Dict[str, Any]:
+    """Call a per-day API method for every day from start to end in parallel
+
+    e.g. `fetch_range(api.get_sleep_data, "2025-01-01", "2025-01-31")`
+    returns `{"2025-01-01": ..., "2025-01-02": ..., ...}` in date order.
+    """
+    return fetch_dates(method, date_range(start, end), **kwargs)
@@ -0,0 +1,78 @@
+import numpy as np
+import os
+import pandas as pd
+
+from typing import Any, List, Optional, Tuple
+from utils.persistence import atomic_write
+
+
+class IntradaySeries:
+    """Memory-mapped (timestamp, value) pairs, one file per day
+
+    A day's file holds its int64 epoch millisecond timestamps followed by its
+    values in a compact numpy dtype, missing values become NaN. Writing a day
+    again, e.g. today after a new sync, replaces its file, so stores of
+    several processes can share the directory.
+    """
+
+    def __init__(self, directory: str, value_dtype: Any = np.float32):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.value_dtype = np.dtype(value_dtype)
+
+    def _get_data_path(self, day: str) -> str:
+        return os.path.join(self.directory, f"{day}.{self.value_dtype.name}")
+
+    def _get_version_path(self, day: str) -> str:
+        return os.path.join(self.directory, f"{day}.version")
+
+    def get_version(self, day: str) -> Optional[str]:
+        try:
+            with open(self._get_version_path(day), "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write_day(self, day: str, pairs: List[List[Any]], version: str = ""):
+        pairs = [pair for pair in pairs if pair and pair[0] is not None]
+        timestamps = np.array([pair[0] for pair in pairs], dtype=np.int64)
+        values = np.array(
+            [np.nan if pair[1] is None else pair[1] for pair in pairs],
+            dtype=self.value_dtype,
+        )
+        atomic_write(self._get_data_path(day), timestamps.tobytes() + values.tobytes())
+        # written last, so the version never refers to missing data
+        atomic_write(self._get_version_path(day), version)
+
+    def _map_day(self, day: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        try:
+            f = open(self._get_data_path(day), "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            # the size of the open file, it may be replaced in the meantime
+            count = os.fstat(f.fileno()).st_size // (8 + self.value_dtype.itemsize)
+            if not count:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=self.value_dtype)
+            timestamps = np.memmap(f, dtype=np.int64, mode="r", shape=(count,))
+            values = np.memmap(
+                f, dtype=self.value_dtype, mode="r", offset=8 * count, shape=(count,)
+            )
+        return timestamps, values
+
+    def arrays(self, days: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Timestamps and values of the days, views into the file of a single day"""
+        mapped = [arrays for arrays in map(self._map_day, days) if arrays is not None]
+        if not mapped:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=self.value_dtype)
+        if len(mapped) == 1:
+            return mapped[0]
+        return (
+            np.concatenate([timestamps for timestamps, _ in mapped]),
+            np.concatenate([values for _, values in mapped]),
+        )
+
+    def to_series(self, days: List[str], name: Optional[str] = None) -> pd.Series:
+        timestamps, values = self.arrays(days)
+        index = pd.to_datetime(timestamps, unit="ms")
+        return pd.Series(values, index=index, name=name, copy=False)
@@ -0,0 +1,225 @@
+import json
+import logging
+import os
+import pandas as pd
+import sqlite3
+
+from app.constants import WEARABLE_SERIES_DIR, WEARABLE_STORE_PATH
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Union
+from wearables.cache import CachedGarmin, CacheMode, ReplayCacheMiss
+from wearables.fetch import date_range, fetch_dates
+from wearables.series import IntradaySeries
+
+logger = logging.getLogger(__name__)
+
+# metric name -> per-day Garmin API method
+METRICS = {
+    "summary": "get_user_summary",
+    "steps": "get_steps_data",
+    "heart_rate": "get_heart_rates",
+    "sleep": "get_sleep_data",
+    "stress": "get_stress_data",
+    "hydration": "get_hydration_data",
+    "training_status": "get_training_status",
+}
+
+# metric -> payload field with intraday [timestamp, value] pairs
+INTRADAY_METRICS = {
+    "heart_rate": "heartRateValues",
+    "stress": "stressValuesArray",
+}
+
+# payload of a day without a recorded response in replay mode
+_NOT_RECORDED = object()
+
+
+def _skip_not_recorded(method: Callable[[str], Any]) -> Callable[[str], Any]:
+    def get(cdate: str) -> Any:
+        try:
+            return method(cdate)
+        except ReplayCacheMiss:
+            return _NOT_RECORDED
+
+    return get
+
+
+class WearableStore:
+    """Local SQLite copy of daily Garmin data, one JSON payload per metric and day
+
+    A day is final once it was synced after it ended, so a sync only fetches
+    days that are missing or were last synced on or before that day, i.e.
+    new days and today. Intraday values are moved out of the payloads on
+    sync and served by `series` from compact memory-mapped arrays. With a replaying
+    `CachedGarmin` only missing days are synced, from recorded responses.
+    """
+
+    def __init__(
+        self,
+        api: Optional[Any],
+        path: str = WEARABLE_STORE_PATH,
+        series_dir: str = WEARABLE_SERIES_DIR,
+    ):
+        self.api = api
+        self.series_dir = series_dir
+        self._series: Dict[str, IntradaySeries] = {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS days (
+                    metric TEXT NOT NULL,
+                    date TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    synced_on TEXT NOT NULL,
+                    PRIMARY KEY (metric, date)
+                )
+                """
+            )
+
+    def _get_method(self, metric: str):
+        if metric not in METRICS:
+            raise ValueError(
+                f"Unknown metric {metric}, expected one of {list(METRICS)}"
+            )
+        return getattr(self.api, METRICS[metric])
+
+    def _get_series(self, metric: str) -> IntradaySeries:
+        if metric not in self._series:
+            self._series[metric] = IntradaySeries(os.path.join(self.series_dir, metric))
+        return self._series[metric]
+
+    def _replays(self) -> bool:
+        return isinstance(self.api, CachedGarmin) and self.api.mode == CacheMode.REPLAY
+
+    def stale_dates(
+        self, metric: str, start: Union[str, date], end: Union[str, date]
+    ) -> List[str]:
+        """Days in the range that still need to be fetched"""
+        today = date.today().isoformat()
+        # future days have no data yet
+        dates = [d for d in date_range(start, end) if d <= today]
+        if not dates:
+            return []
+        rows = self._conn.execute(
+            "SELECT date, synced_on FROM days "
+            "WHERE metric = ? AND date BETWEEN ? AND ?",
+            (metric, dates[0], dates[-1]),
+        )
+        # recorded responses never change, so every stored day is final
+        replays = self._replays()
+        final = {day for day, synced_on in rows if replays or synced_on > day}
+        return [d for d in dates if d not in final]
+
+    def sync(self, metric: str, start: Union[str, date], end: Union[str, date]) -> int:
+        """Fetch stale days of a metric, returns the number of days fetched"""
+        method = self._get_method(metric)
+        dates = self.stale_dates(metric, start, end)
+        if not dates:
+            return 0
+        if self._replays():
+            method = _skip_not_recorded(method)
+        payloads = fetch_dates(method, dates)
+        payloads = {
+            day: payload
+            for day, payload in payloads.items()
+            if payload is not _NOT_RECORDED
+        }
+        if len(payloads) < len(dates):
+            logger.warning(
+                f"No recorded {metric} for {len(dates) - len(payloads)} days"
+            )
+        synced_on = date.today().isoformat()
+        field = INTRADAY_METRICS.get(metric)
+        for day, payload in payloads.items():
+            if field is not None and isinstance(payload, dict):
+                # the arrays are written first, the payload no longer has them
+                self._get_series(metric).write_day(
+                    day, payload.pop(field, None) or [], version=synced_on
+                )
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO days VALUES (?, ?, ?, ?)",
+                [
+                    (metric, day, json.dumps(payload), synced_on)
+                    for day, payload in payloads.items()
+                ],
+            )
+        logger.info(f"Synced {len(payloads)} days of {metric}")
+        return len(payloads)
+
+    def load(
+        self,
+        metric: str,
+        start: Union[str, date],
+        end: Optional[Union[str, date]] = None,
+        sync: bool = True,
+    ) -> pd.DataFrame:
+        """Daily payloads of a metric from start to end (default today) as a DataFrame
+
+        Dict payloads become one row per day and list payloads one row per
+        entry, nested fields are flattened with "." and a `date` column is added.
+        """
+        end = end or date.today()
+        if sync and self.api is not None:
+            self.sync(metric, start, end)
+        dates = date_range(start, end)
+        rows = self._conn.execute(
+            "SELECT date, payload FROM days "
+            "WHERE metric = ? AND date BETWEEN ? AND ? ORDER BY date",
+            (metric, dates[0], dates[-1]),
+        )
+        records = []
+        for day, payload in rows:
+            payload = json.loads(payload)
+            if isinstance(payload, list):
+                records += [{**entry, "date": day} for entry in payload]
+            elif isinstance(payload, dict):
+                # only payloads stored before intraday values were moved out
+                payload.pop(INTRADAY_METRICS.get(metric), None)
+                records.append({**payload, "date": day})
+        if not records:
+            return pd.DataFrame(columns=["date"])
+        df = pd.json_normalize(records)
+        df["date"] = pd.to_datetime(df["date"])
+        return df
+
+    def series(
+        self,
+        metric: str,
+        start: Union[str, date],
+        end: Optional[Union[str, date]] = None,
+        sync: bool = True,
+    ) -> pd.Series:
+        """Intraday values of a metric from start to end (default today), indexed by time"""
+        if metric not in INTRADAY_METRICS:
+            raise ValueError(
+                f"No intraday series for {metric}, expected one of {list(INTRADAY_METRICS)}"
+            )
+        end = end or date.today()
+        if sync and self.api is not None:
+            self.sync(metric, start, end)
+        intraday = self._get_series(metric)
+
+        # extract pairs of days stored before sync moved them out of payloads
+        dates = date_range(start, end)
+        rows = self._conn.execute(
+            "SELECT date, synced_on FROM days "
+            "WHERE metric = ? AND date BETWEEN ? AND ? ORDER BY date",
+            (metric, dates[0], dates[-1]),
+        ).fetchall()
+        for day, synced_on in rows:
+            if intraday.get_version(day) == synced_on:
+                continue
+            (payload,) = self._conn.execute(
+                "SELECT payload FROM days WHERE metric = ? AND date = ?",
+                (metric, day),
+            ).fetchone()
+            pairs = (json.loads(payload) or {}).get(INTRADAY_METRICS[metric])
+            if pairs is not None:
+                intraday.write_day(day, pairs, version=synced_on)
+        return intraday.to_series(dates, name=metric)
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,104 @@
+import pandas as pd
+
+from wearables import analytics
+
+
+def test_exercise_sets_frame_without_exercises():
+    response = {
+        "activityId": 1,
+        "exerciseSets": [
+            {"setType": "ACTIVE", "startTime": "2025-01-06T10:00:00.0"},
+            {"setType": "REST", "startTime": "2025-01-06T10:01:00.0"},
+        ],
+    }
+    sets = analytics.exercise_sets_frame([response], active_only=False)
+    assert list(sets["set_type"]) == ["ACTIVE", "REST"]
+    assert sets["exercise"].isna().all()
+
+
+def test_exercise_sets_frame_and_reps_per_exercise():
+    curl = {"category": "CURL", "name": "DUMBBELL_BICEPS_CURL", "probability": 90.0}
+    response = {
+        "activityId": 1,
+        "exerciseSets": [
+            {
+                "exercises": [{"category": "ROW", "probability": 10.0}, curl],
+                "setType": "ACTIVE",
+                "startTime": "2025-01-06T10:00:00.0",
+                "repetitionCount": 12,
+                "weight": 10000.0,
+                "duration": 30.0,
+            },
+            {"exercises": [], "setType": "REST", "startTime": "2025-01-06T10:01:00.0"},
+            {
+                "exercises": [curl],
+                "setType": "ACTIVE",
+                "startTime": "2025-01-06T10:02:00.0",
+                "repetitionCount": 8,
+                "weight": 12000.0,
+                "duration": 25.0,
+            },
+        ],
+    }
+
+    sets = analytics.exercise_sets_frame([response])
+    assert list(sets["exercise"]) == ["DUMBBELL_BICEPS_CURL"] * 2
+    assert list(sets["weight_kg"]) == [10.0, 12.0]
+
+    reps = analytics.reps_per_exercise(sets)
+    assert reps.to_dict("records")[0] == {
+        "date": pd.Timestamp("2025-01-06"),
+        "category": "CURL",
+        "exercise": "DUMBBELL_BICEPS_CURL",
+        "sets": 2,
+        "total_reps": 20,
+        "max_reps": 12,
+        "mean_reps": 10.0,
+        "max_weight_kg": 12.0,
+    }
+
+
+def test_sleep_and_steps_aggregations():
+    sleep = analytics.sleep_frame(
+        {
+            "2025-01-05": {
+                "dailySleepDTO": {
+                    "calendarDate": "2025-01-05",
+                    "sleepTimeSeconds": 7 * 3600,
+                }
+            },
+            "2025-01-06": {
+                "dailySleepDTO": {
+                    "calendarDate": "2025-01-06",
+                    "sleepTimeSeconds": 8 * 3600,
+                }
+            },
+            "2025-01-07": {"dailySleepDTO": None},
+        }
+    )
+    assert list(sleep["sleep_hours"]) == [7.0, 8.0]
+    weekly = analytics.weekly_means(sleep, "sleep_hours")
+    assert list(weekly.index) == [
+        pd.Timestamp("2024-12-30"),
+        pd.Timestamp("2025-01-06"),
+    ]
+
+    steps = analytics.steps_frame(
+        [
+            [
+                {
+                    "startGMT": "2025-01-06T10:00:00.0",
+                    "endGMT": "2025-01-06T10:15:00.0",
+                    "steps": 100,
+                }
+            ],
+            [
+                {
+                    "startGMT": "2025-01-08T10:00:00.0",
+                    "endGMT": "2025-01-08T10:15:00.0",
+                    "steps": 50,
+                }
+            ],
+        ]
+    )
+    assert list(analytics.daily_totals(steps, "steps")) == [100, 0, 50]
@@ -0,0 +1,34 @@
+import pytest
+
+from datetime import date, timedelta
+from wearables.cache import CachedGarmin, CacheMode, ReplayCacheMiss
+
+
+class FakeGarmin:
+    def __init__(self):
+        self.calls = 0
+
+    def get_sleep_data(self, cdate):
+        self.calls += 1
+        return {"date": cdate, "call": self.calls}
+
+
+def test_cached_garmin_records_and_replays(tmp_path):
+    yesterday = (date.today() - timedelta(days=1)).isoformat()
+    today = date.today().isoformat()
+    fake = FakeGarmin()
+    api = CachedGarmin(fake, directory=str(tmp_path), today_ttl=0)
+
+    # past days are immutable, today is refetched once the ttl expires
+    assert api.get_sleep_data(yesterday) == api.get_sleep_data(yesterday)
+    api.get_sleep_data(today)
+    api.get_sleep_data(today)
+    assert fake.calls == 3
+    api.close()
+
+    replay = CachedGarmin(None, directory=str(tmp_path), mode=CacheMode.REPLAY)
+    assert replay.get_sleep_data(yesterday) == {"date": yesterday, "call": 1}
+    assert replay.get_sleep_data(today) == {"date": today, "call": 3}
+    with pytest.raises(ReplayCacheMiss):
+        replay.get_sleep_data("2020-01-01")
+    replay.close()
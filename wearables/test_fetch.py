@@ -0,0 +1,53 @@
+import threading
+
+from garminconnect import GarminConnectConnectionError
+from wearables.fetch import RateLimiter, fetch_range
+
+
+class FakeClock:
+    """Time that only passes when sleeping, sleeps are recorded"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+        self._lock = threading.Lock()
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        with self._lock:
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+
+def test_fetch_range_retries_with_backoff_and_keeps_date_order():
+    failed = set()
+    lock = threading.Lock()
+
+    def get_steps_data(cdate):
+        with lock:
+            # every day fails once before succeeding
+            if cdate not in failed:
+                failed.add(cdate)
+                raise GarminConnectConnectionError("flaky")
+        return cdate.replace("-", "")
+
+    clock = FakeClock()
+    limiter = RateLimiter(100, burst=4, clock=clock, sleep=clock.sleep)
+    results = fetch_range(
+        get_steps_data, "2025-01-30", "2025-02-02", max_workers=4, limiter=limiter
+    )
+
+    assert list(results) == ["2025-01-30", "2025-01-31", "2025-02-01", "2025-02-02"]
+    assert results["2025-02-01"] == "20250201"
+    # one backoff per day, the burst covers the first round of calls
+    assert clock.sleeps == [0.5] * 4
+
+
+def test_rate_limiter_waits_once_the_burst_is_spent():
+    clock = FakeClock()
+    limiter = RateLimiter(10, burst=2, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        limiter.acquire()
+    assert clock.sleeps == [0.1, 0.1]
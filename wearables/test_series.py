@@ -0,0 +1,24 @@
+import os
+
+from wearables.series import IntradaySeries
+
+
+def test_series_of_several_stores_share_the_directory(tmp_path):
+    first = IntradaySeries(str(tmp_path))
+    second = IntradaySeries(str(tmp_path))
+    first.write_day("2024-01-01", [[1000, 60], [2000, None]], version="a")
+    second.write_day("2024-01-02", [[3000, 70]], version="b")
+
+    timestamps, values = first.arrays(["2024-01-01", "2024-01-02"])
+    assert list(timestamps) == [1000, 2000, 3000]
+    assert values[0] == 60 and values[2] == 70
+    assert first.get_version("2024-01-02") == "b"
+
+
+def test_rewriting_a_day_replaces_its_pairs(tmp_path):
+    intraday = IntradaySeries(str(tmp_path))
+    for count in range(1, 4):
+        intraday.write_day("2024-01-01", [[i, i] for i in range(count)])
+    timestamps, _ = intraday.arrays(["2024-01-01"])
+    assert list(timestamps) == [0, 1, 2]
+    assert sum(os.path.getsize(path) for path in tmp_path.iterdir()) == 3 * 12
@@ -0,0 +1,94 @@
+from datetime import date, datetime, timedelta, timezone
+from wearables.cache import CachedGarmin, CacheMode
+from wearables.store import WearableStore
+
+
+class FakeGarmin:
+    def __init__(self):
+        self.calls = []
+
+    def get_sleep_data(self, cdate):
+        self.calls.append(cdate)
+        return {"dailySleepDTO": {"sleepTimeSeconds": 3600 * len(self.calls)}}
+
+    def get_steps_data(self, cdate):
+        self.calls.append(cdate)
+        return [{"steps": 10}, {"steps": 20}]
+
+
+def test_store_syncs_only_new_days_and_today(tmp_path):
+    today = date.today()
+    start = today - timedelta(days=2)
+    fake = FakeGarmin()
+    store = WearableStore(fake, path=str(tmp_path / "wearables.sqlite"))
+
+    df = store.load("sleep", start)
+    assert len(df) == 3
+    assert "dailySleepDTO.sleepTimeSeconds" in df.columns
+    assert len(fake.calls) == 3
+
+    # past days are final, today is refetched
+    fake.calls.clear()
+    store.load("sleep", start - timedelta(days=1))
+    assert sorted(fake.calls) == [
+        (start - timedelta(days=1)).isoformat(),
+        today.isoformat(),
+    ]
+
+    steps = store.load("steps", start, start)
+    assert steps["steps"].sum() == 30
+    store.close()
+
+    # data is available offline without an api
+    offline = WearableStore(None, path=str(tmp_path / "wearables.sqlite"))
+    assert len(offline.load("sleep", start - timedelta(days=1))) == 4
+
+
+class FakeHeartRateGarmin:
+    def get_heart_rates(self, cdate):
+        day = date.fromisoformat(cdate)
+        midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        start = int(midnight.timestamp()) * 1000
+        return {
+            "restingHeartRate": 50,
+            "heartRateValues": [[start, 60], [start + 120_000, None]],
+        }
+
+
+def test_store_serves_intraday_series_from_compact_arrays(tmp_path):
+    start = date.today() - timedelta(days=3)
+    end = date.today() - timedelta(days=1)
+    store = WearableStore(
+        FakeHeartRateGarmin(),
+        path=str(tmp_path / "wearables.sqlite"),
+        series_dir=str(tmp_path / "series"),
+    )
+
+    hr = store.series("heart_rate", start, end)
+    assert len(hr) == 6
+    assert hr.dtype == "float32"
+    assert hr.iloc[0] == 60 and hr.isna().sum() == 3
+    assert hr.index.is_monotonic_increasing
+    # daily rows keep the summary fields but not the intraday lists
+    daily = store.load("heart_rate", start, end)
+    assert list(daily["restingHeartRate"]) == [50, 50, 50]
+    assert "heartRateValues" not in daily.columns
+    # the payloads no longer carry them either
+    payloads = store._conn.execute("SELECT payload FROM days").fetchall()
+    assert all("heartRateValues" not in payload for (payload,) in payloads)
+
+
+def test_store_replay_only_syncs_recorded_missing_days(tmp_path):
+    day = (date.today() - timedelta(days=2)).isoformat()
+    recorder = CachedGarmin(FakeGarmin(), directory=str(tmp_path / "cache"))
+    recorder.get_sleep_data(day)
+    recorder.close()
+
+    replay = CachedGarmin(
+        None, directory=str(tmp_path / "cache"), mode=CacheMode.REPLAY
+    )
+    store = WearableStore(replay, path=str(tmp_path / "wearables.sqlite"))
+    # today and yesterday were never recorded
+    df = store.load("sleep", day)
+    assert list(df["date"].dt.strftime("%Y-%m-%d")) == [day]
+    assert store.stale_dates("sleep", day, day) == []